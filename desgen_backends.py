@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# バックエンド: スプレッドシートの読み書きと文章生成(ChatCompletion)の差し替え可能なインターフェース
+from collections import namedtuple
+from desgen_sheets import quote_sheet_name
+
+# 文章生成の結果。finish_reason が "length" の場合は max_tokens で打ち切られています
+Completion = namedtuple("Completion", ["content", "finish_reason", "prompt_tokens", "completion_tokens"])
+
+
+class SheetsBackend:
+    """
+    スプレッドシートの読み書きを行うバックエンドのインターフェース。
+    範囲はすべてA1表記 ('シート名'!A2:A100) で指定します。
+    リトライは呼び出し側 (ResilientCaller) が行うため、各メソッドはエラーをそのまま送出します。
+    """
+    def get_row_count(self, spreadsheet_id, sheet_name):
+        """シートのグリッドの行数を返します。"""
+        raise NotImplementedError
+
+    def batch_get(self, spreadsheet_id, ranges):
+        """範囲ごとの値 (行のリストのリスト) を ranges と同じ順序で返します。末尾の空行・空セルは省略されることがあります。"""
+        raise NotImplementedError
+
+    def batch_update(self, spreadsheet_id, data):
+        """data は [(A1範囲, 値)] のリストで、各範囲の先頭セルに値を書き込みます。"""
+        raise NotImplementedError
+
+
+class CompletionBackend:
+    """文章生成のバックエンドのインターフェース。"""
+    def complete(self, model, messages, max_tokens, temperature=0.2, timeout=None, response_format=None):
+        """messages に対する応答を Completion として返します。"""
+        raise NotImplementedError
+
+
+class GoogleSheetsBackend(SheetsBackend):
+    """Google Sheets API (v4) を使うバックエンド。"""
+    def __init__(self, service):
+        self.service = service
+
+    def get_row_count(self, spreadsheet_id, sheet_name):
+        response = self.service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, ranges=[quote_sheet_name(sheet_name)],
+            fields="sheets(properties(gridProperties(rowCount)))"
+        ).execute()
+        return response['sheets'][0]['properties']['gridProperties']['rowCount']
+
+    def batch_get(self, spreadsheet_id, ranges):
+        response = self.service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id, ranges=ranges
+        ).execute()
+        return [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+
+    def batch_update(self, spreadsheet_id, data):
+        body = {
+            "valueInputOption": "RAW",
+            "data": [{"range": cell_range, "values": [[value]]} for cell_range, value in data],
+        }
+        self.service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+
+
+class OpenAICompletionBackend(CompletionBackend):
+    """OpenAI の ChatCompletion を使うバックエンド。openai は最初の呼び出し時にインポートします。"""
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def complete(self, model, messages, max_tokens, temperature=0.2, timeout=None, response_format=None):
+        import openai
+        openai.api_key = self.api_key
+        options = {"response_format": response_format} if response_format else {}
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            request_timeout=timeout,
+            **options
+        )
+        choice = response["choices"][0]
+        usage = response.get("usage") or {}
+        return Completion(
+            choice["message"]["content"], choice.get("finish_reason"),
+            usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        )
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+# 一括モード: 未翻訳のテキストを Batch API 形式の JSONL にまとめて投入し、完了後に結果を翻訳キャッシュへ取り込みます
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from desgen_core import MULTI_FIELD_SYSTEM_PROMPT
+from desgen_metrics import estimate_cost
+from desgen_resilience import ResilientCaller, get_status_code
+from desgen_store import BatchJobStore, DEFAULT_DATA_DIR
+from desgen_tokens import pack_items
+
+DEFAULT_BATCH_DIR = os.path.join(DEFAULT_DATA_DIR, "batches")
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# Batch API の1ファイルあたりのリクエスト数の上限
+MAX_REQUESTS_PER_BATCH = 50000
+# Batch API の料金は通常の半額
+BATCH_PRICE_FACTOR = 0.5
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchAPIError(Exception):
+    """Batch API のHTTPエラー。http_status と headers は ResilientCaller のエラー分類に使われます。"""
+    def __init__(self, message, http_status=None, headers=None):
+        super().__init__(message)
+        self.http_status = http_status
+        self.headers = headers
+
+
+class BatchBackend:
+    """
+    Batch API のインターフェース。バッチは OpenAI と同じ形式の辞書
+    (id / status / output_file_id / error_file_id / request_counts / errors) で表します。
+    リトライは呼び出し側 (ResilientCaller) が行うため、各メソッドはエラーをそのまま送出します。
+    """
+    def upload(self, path):
+        """JSONLファイルをアップロードし、ファイルIDを返します。"""
+        raise NotImplementedError
+
+    def create(self, input_file_id, endpoint=BATCH_ENDPOINT, completion_window=COMPLETION_WINDOW, metadata=None):
+        """アップロードしたファイルのバッチを作成し、バッチを返します。"""
+        raise NotImplementedError
+
+    def retrieve(self, batch_id):
+        raise NotImplementedError
+
+    def download(self, file_id, path):
+        """ファイルの内容を path に保存します。"""
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI の Files / Batches API を使うバックエンド。openai パッケージの版に依存しないよう、REST API を直接呼び出します。"""
+    def __init__(self, api_key, base_url="https://api.openai.com/v1", timeout=300):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, method, path, data=None, headers=None):
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        request.add_header("Authorization", f"Bearer {self.api_key}")
+        for name, value in (headers or {}).items():
+            request.add_header(name, value)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            body = e.read().decode("utf-8", "replace")
+            raise BatchAPIError(f"HTTP {e.code} {path}: {body[:500]}", e.code, e.headers) from e
+
+    def _json(self, method, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else None
+        with self._open(method, path, data, headers) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def upload(self, path):
+        boundary = uuid.uuid4().hex
+        head = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"purpose\"\r\n\r\nbatch\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(path)}\"\r\n"
+            "Content-Type: application/jsonl\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+        def body():
+            # 大きなファイルをメモリに読み込まないよう、少しずつ送る
+            yield head
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+            yield tail
+
+        headers = {
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(len(head) + os.path.getsize(path) + len(tail)),
+        }
+        with self._open("POST", "/files", body(), headers) as response:
+            return json.loads(response.read().decode("utf-8"))["id"]
+
+    def create(self, input_file_id, endpoint=BATCH_ENDPOINT, completion_window=COMPLETION_WINDOW, metadata=None):
+        payload = {"input_file_id": input_file_id, "endpoint": endpoint, "completion_window": completion_window}
+        if metadata:
+            payload["metadata"] = metadata
+        return self._json("POST", "/batches", payload)
+
+    def retrieve(self, batch_id):
+        return self._json("GET", f"/batches/{batch_id}")
+
+    def download(self, file_id, path):
+        temp_path = f"{path}.tmp"
+        with self._open("GET", f"/files/{file_id}/content") as response, open(temp_path, "wb") as f:
+            while True:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(temp_path, path)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Batch API を手元で再現するバックエンド (開発・テスト用)。
+    投入されたJSONLを completion_backend でバックグラウンドのスレッドで処理し、同じ形式の結果ファイルを作ります。
+    バッチの状態は directory のJSONファイルに保存します。処理中にプロセスが終了した場合は、次の retrieve で最初から処理し直します。
+    """
+    def __init__(self, completion_backend, directory=os.path.join(DEFAULT_BATCH_DIR, "local"), max_workers=4):
+        self.completion_backend = completion_backend
+        self.directory = directory
+        self.max_workers = max_workers
+        self._threads = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _file_path(self, file_id):
+        return os.path.join(self.directory, f"{file_id}.jsonl")
+
+    def _batch_path(self, batch_id):
+        return os.path.join(self.directory, f"{batch_id}.json")
+
+    def _save(self, batch):
+        temp_path = self._batch_path(batch["id"]) + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(batch, f, ensure_ascii=False)
+        os.replace(temp_path, self._batch_path(batch["id"]))
+
+    def upload(self, path):
+        file_id = f"file-local-{uuid.uuid4().hex[:24]}"
+        with open(path, "rb") as source, open(self._file_path(file_id), "wb") as target:
+            while True:
+                chunk = source.read(1024 * 1024)
+                if not chunk:
+                    break
+                target.write(chunk)
+        return file_id
+
+    def create(self, input_file_id, endpoint=BATCH_ENDPOINT, completion_window=COMPLETION_WINDOW, metadata=None):
+        if not os.path.exists(self._file_path(input_file_id)):
+            raise BatchAPIError(f"ファイル {input_file_id} がありません", 404)
+        batch = {
+            "id": f"batch_local_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "completed_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata or {},
+            "errors": None,
+        }
+        self._save(batch)
+        self._start(batch)
+        return dict(batch)
+
+    def retrieve(self, batch_id):
+        try:
+            with open(self._batch_path(batch_id), encoding="utf-8") as f:
+                batch = json.load(f)
+        except FileNotFoundError:
+            raise BatchAPIError(f"バッチ {batch_id} がありません", 404) from None
+        if batch["status"] not in FINAL_STATUSES:
+            self._start(batch)
+        return batch
+
+    def download(self, file_id, path):
+        with open(self._file_path(file_id), "rb") as source, open(path, "wb") as target:
+            target.write(source.read())
+
+    def _start(self, batch):
+        with self._lock:
+            thread = self._threads.get(batch["id"])
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(target=self._process, args=(batch,), name=f"desgen-{batch['id']}", daemon=True)
+            self._threads[batch["id"]] = thread
+            thread.start()
+
+    def _process(self, batch):
+        with open(self._file_path(batch["input_file_id"]), encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        counts = {"total": len(requests), "completed": 0, "failed": 0}
+        batch.update(status="in_progress", request_counts=counts)
+        self._save(batch)
+        caller = ResilientCaller("Local batch", log=lambda message: None)
+        outputs, errors = [], []
+
+        def run(request):
+            body = request["body"]
+            try:
+                completion = caller.call(lambda: self.completion_backend.complete(
+                    body["model"], body["messages"], body.get("max_tokens", 1500),
+                    temperature=body.get("temperature", 0.2), response_format=body.get("response_format")
+                ), "ChatCompletion")
+            except Exception as e:
+                return None, {
+                    "id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": request["custom_id"], "response": None,
+                    "error": {"code": str(get_status_code(e) or "error"), "message": str(e)},
+                }
+            return {
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": {
+                        "object": "chat.completion",
+                        "model": body["model"],
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": completion.content},
+                            "finish_reason": completion.finish_reason,
+                        }],
+                        "usage": {
+                            "prompt_tokens": completion.prompt_tokens,
+                            "completion_tokens": completion.completion_tokens,
+                            "total_tokens": completion.prompt_tokens + completion.completion_tokens,
+                        },
+                    },
+                },
+                "error": None,
+            }, None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for output, error in executor.map(run, requests):
+                if output:
+                    outputs.append(output)
+                    counts["completed"] += 1
+                else:
+                    errors.append(error)
+                    counts["failed"] += 1
+        batch.update(status="finalizing")
+        self._save(batch)
+        for kind, lines in (("output_file_id", outputs), ("error_file_id", errors)):
+            if not lines:
+                continue
+            file_id = f"file-local-{uuid.uuid4().hex[:24]}"
+            with open(self._file_path(file_id), "w", encoding="utf-8") as f:
+                for line in lines:
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            batch[kind] = file_id
+        batch.update(status="completed", completed_at=int(time.time()))
+        self._save(batch)
+
+
+class BulkTranslator:
+    """
+    一括モード。シートの処理で必要になる翻訳を事前に集めて Batch API に投入し、結果を翻訳キャッシュに取り込んでから
+    通常の処理 (HTML生成・書き込み) を実行します。翻訳はキャッシュから取得されるため、APIはほとんど呼ばれません。
+    投入したバッチは BatchJobStore に記録し、完了を待つ間にプロセスが終了しても次回の実行で引き継ぎます。
+    バッチで翻訳できなかった項目は、通常の処理の中でリアルタイムに翻訳します。
+    """
+    def __init__(self, processor, batch_backend, store=None, work_dir=DEFAULT_BATCH_DIR,
+                 poll_interval=60.0, max_requests_per_batch=MAX_REQUESTS_PER_BATCH, log=None):
+        self.processor = processor
+        self.batch_backend = batch_backend
+        self.store = store or BatchJobStore()
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.max_requests_per_batch = max_requests_per_batch
+        self.log = log or processor.log
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.processor.stop_processing()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def _call(self, description, func, *args):
+        return self.processor.openai_caller.call(lambda: func(*args), description, self._stop_event)
+
+    def compile(self, pairs):
+        """
+        (原文, コンテキスト) のリストを、translate_fields と同じ形式 (JSON出力) のリクエストのリストにまとめます。
+        custom_id は内容・モデル・プロンプトバージョンから決まるため、同じ内容なら何度作っても同じIDになります。
+        """
+        processor = self.processor
+        items = [(str(index), text) for index, (text, _) in enumerate(pairs)]
+        requests = []
+        for pack in pack_items(items, processor.pack_token_budget, processor.translation_model):
+            payload = {f"t{position}": {"context": pairs[int(index)][1], "text": text}
+                       for position, (index, text) in enumerate(pack)}
+            user_prompt = json.dumps(payload, ensure_ascii=False)
+            digest = hashlib.sha256(
+                json.dumps([user_prompt, processor.translation_model, processor.prompt_version]).encode("utf-8")
+            ).hexdigest()
+            requests.append({
+                "custom_id": f"desgen-{digest[:32]}",
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": processor.translation_model,
+                    "messages": [
+                        {"role": "system", "content": MULTI_FIELD_SYSTEM_PROMPT},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    "max_tokens": processor.output_max_tokens(user_prompt),
+                    "temperature": 0.2,
+                    "response_format": {"type": "json_object"},
+                },
+            })
+        return requests
+
+    def submit(self, job_key, pairs):
+        """pairs を max_requests_per_batch 件ずつのバッチとして投入し、記録したバッチのリストを返します。"""
+        processor = self.processor
+        requests = self.compile(pairs)
+        os.makedirs(self.work_dir, exist_ok=True)
+        prefix = f"{time.strftime('%Y%m%d_%H%M%S')}_{hashlib.sha256(job_key.encode('utf-8')).hexdigest()[:8]}"
+        for number, start in enumerate(range(0, len(requests), self.max_requests_per_batch), 1):
+            chunk = requests[start:start + self.max_requests_per_batch]
+            path = os.path.join(self.work_dir, f"{prefix}_{number}.jsonl")
+            with open(path, "w", encoding="utf-8") as f:
+                for request in chunk:
+                    f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            file_id = self._call("Batch upload", self.batch_backend.upload, path)
+            batch = self._call(
+                "Batch create", self.batch_backend.create, file_id, BATCH_ENDPOINT, COMPLETION_WINDOW, {"job_key": job_key[:500]}
+            )
+            self.store.add(batch["id"], job_key, processor.translation_model, processor.prompt_version, path, len(chunk), batch["status"])
+            self.log(f"📤 バッチ {batch['id']} を投入しました: {len(chunk)}リクエスト ({path})")
+        return self.store.pending(job_key)
+
+    def wait(self, batch_id):
+        """バッチが終了するまで poll_interval 秒ごとに確認し、終了したバッチを返します。中断された場合は None を返します。"""
+        last_status = None
+        while not self.stopped:
+            batch = self._call("Batch retrieve", self.batch_backend.retrieve, batch_id)
+            self.store.update(batch_id, batch["status"], batch.get("output_file_id"), batch.get("error_file_id"))
+            counts = batch.get("request_counts") or {}
+            status = (batch["status"], counts.get("completed"), counts.get("failed"))
+            if status != last_status:
+                self.log(f"⏳ バッチ {batch_id}: {batch['status']} "
+                         f"(完了 {counts.get('completed', 0)} / 失敗 {counts.get('failed', 0)} / 全 {counts.get('total', 0)})")
+                last_status = status
+            if batch["status"] in FINAL_STATUSES:
+                return batch
+            self._stop_event.wait(self.poll_interval)
+        return None
+
+    def ingest(self, record, batch):
+        """
+        終了したバッチの結果を翻訳キャッシュに保存し、(保存した項目数, 保存できなかった項目数) を返します。
+        期限切れ・取り消しのバッチも、完了していた分の結果は取り込みます。
+        """
+        cache = self.processor.translation_cache
+        with open(record["input_path"], encoding="utf-8") as f:
+            payloads = {}
+            for line in f:
+                if line.strip():
+                    request = json.loads(line)
+                    payloads[request["custom_id"]] = json.loads(request["body"]["messages"][-1]["content"])
+        stored, prompt_tokens, completion_tokens = 0, 0, 0
+        if batch.get("output_file_id"):
+            output_path = os.path.join(self.work_dir, f"{record['batch_id']}_output.jsonl")
+            self._call("Batch download", self.batch_backend.download, batch["output_file_id"], output_path)
+            with open(output_path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    payload = payloads.get(result.get("custom_id"))
+                    response = result.get("response") or {}
+                    if payload is None or response.get("status_code") != 200:
+                        continue
+                    body = response.get("body") or {}
+                    usage = body.get("usage") or {}
+                    prompt_tokens += usage.get("prompt_tokens", 0)
+                    completion_tokens += usage.get("completion_tokens", 0)
+                    try:
+                        translated = json.loads(body["choices"][0]["message"]["content"])
+                    except (KeyError, IndexError, TypeError, ValueError):
+                        continue
+                    if not isinstance(translated, dict):
+                        continue
+                    for key, item in payload.items():
+                        value = translated.get(key)
+                        if isinstance(value, str) and value.strip():
+                            # 実際に翻訳したバッチのモデルのキーで保存する (振り分けが有効な場合も、処理の中で上位のモデルとして参照される)
+                            cache.set(item["text"], item["context"], record["model"], record["prompt_version"], value.strip())
+                            stored += 1
+        total = sum(len(payload) for payload in payloads.values())
+        self.store.mark_ingested(record["batch_id"])
+        cost = estimate_cost(record["model"], prompt_tokens, completion_tokens, self.processor.model_prices)
+        cost_text = f" / 推定コスト ${cost * BATCH_PRICE_FACTOR:.4f}" if cost is not None else ""
+        self.log(f"📥 バッチ {record['batch_id']} の結果を取り込みました: {stored}項目 / 全 {total}項目 "
+                 f"(入力 {prompt_tokens} / 出力 {completion_tokens} トークン{cost_text})")
+        if stored < total:
+            self.log(f"⚠️ バッチで翻訳できなかった {total - stored}項目は、処理の中でリアルタイムに翻訳します。")
+        return stored, total - stored
+
+    def run(self, mode, spreadsheet_id, sheet_name, column_settings, start_row=2, resume=False):
+        """
+        未翻訳の項目をバッチで翻訳してから、通常どおりシートを処理します。
+        {"success": 件数, "failed": 件数} を返します。中断された場合は None を返します。
+        """
+        self._stop_event.clear()
+        processor = self.processor
+        if processor.translation_cache is None:
+            # バッチの結果はキャッシュ経由で処理に渡すため、設定によらずキャッシュを使う
+            processor.enable_translation_cache()
+        job_key = processor._job_key(spreadsheet_id, sheet_name, mode)
+        records = self.store.pending(job_key)
+        if records:
+            self.log(f"🔁 前回投入したバッチ {len(records)}件の完了を待ちます。")
+        else:
+            self.log("🔎 翻訳が必要な項目を集めています...")
+            pairs = processor.collect_translations(mode, spreadsheet_id, sheet_name, column_settings, start_row)
+            if self.stopped:
+                return None
+            self.log(f"🔎 翻訳が必要な項目: {len(pairs)}件")
+            if pairs:
+                records = self.submit(job_key, pairs)
+
+        for record in records:
+            batch = self.wait(record["batch_id"])
+            if batch is None:
+                self.log("🛑 バッチの完了待ちを中断しました。同じコマンドで完了待ちから再開できます。")
+                return None
+            self.ingest(record, batch)
+            if batch["status"] == "failed":
+                errors = (batch.get("errors") or {}).get("data") or []
+                detail = "; ".join(error.get("message", "") for error in errors[:3])
+                raise RuntimeError(f"バッチ {record['batch_id']} が失敗しました: {detail or '詳細なし'}")
+
+        if self.stopped:
+            return None
+        if mode == "normal":
+            return processor.process_product_descriptions(spreadsheet_id, sheet_name, column_settings, start_row, resume=resume)
+        return processor.process_book_descriptions(spreadsheet_id, sheet_name, column_settings, start_row, resume=resume)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# ベンチマーク: 代替バックエンド (desgen_fakes) で両モードを実行し、スループットとAPI呼び出し数を測定します
+import argparse
+import json
+import math
+import os
+import tempfile
+import time
+from desgen_core import DescriptionGeneratorCore
+from desgen_fakes import FakeSheetsBackend, FakeCompletionBackend, FaultInjector
+from desgen_store import ProgressJournal
+
+SHEET_NAME = "bench"
+NORMAL_COLUMNS = {
+    'input_col': 'A', 'translated_name_col': 'K', 'jan_code_col': 'L', 'description_col': 'I', 'output_col': 'Q',
+}
+BOOK_COLUMNS = {
+    'trigger': 'A', 'product_name': 'B', 'author': 'C', 'publisher': 'D', 'release_date': 'E', 'language': 'F',
+    'pages': 'G', 'isbn10': 'H', 'isbn13': 'I', 'dimensions': 'J', 'output': 'K',
+}
+DEFAULT_ROW_COUNTS = [1000, 10000, 100000]
+
+
+def build_sheet(mode, rows, start_row=2):
+    """ベンチマーク用のシート {行番号: {列記号: 値}} を作ります。行ごとに異なる内容にしてキャッシュが効かないようにします。"""
+    sheet = {}
+    for i in range(rows):
+        row = start_row + i
+        if mode == "normal":
+            columns = NORMAL_COLUMNS
+            sheet[row] = {
+                columns['input_col']: f"ITEM-{i}",
+                columns['translated_name_col']: f"Sample Product {i}",
+                columns['jan_code_col']: f"4900000{i:06d}",
+                columns['description_col']: f"商品番号{i}の説明です。状態は良好で、付属品はすべて揃っています。丁寧に梱包して発送いたします。",
+            }
+        else:
+            columns = BOOK_COLUMNS
+            sheet[row] = {
+                columns['trigger']: "1",
+                columns['product_name']: f"Sample Book {i}",
+                columns['author']: f"著者{i}",
+                columns['publisher']: f"出版社{i % 500}",
+                columns['release_date']: f"2021年{i % 12 + 1}月{i % 28 + 1}日",
+                columns['language']: "日本語",
+                columns['pages']: f"{100 + i % 400}ページ",
+                columns['isbn10']: f"{i:010d}",
+                columns['isbn13']: f"978{i:010d}",
+                columns['dimensions']: "18.2 x 12.8 x 2 cm",
+            }
+    return sheet
+
+
+def percentile(values, fraction):
+    """最近傍順位法によるパーセンタイル。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_benchmark(mode, rows, max_workers=4, batch_size=20, openai_faults=None, sheets_faults=None, configure=None):
+    """
+    1つのモードを rows 行で実行し、測定結果の辞書を返します。
+    configure に関数を渡すと、実行前に DescriptionGeneratorCore を受け取って設定を変更できます。
+    """
+    sheets = FakeSheetsBackend({SHEET_NAME: build_sheet(mode, rows)}, faults=sheets_faults)
+    completions = FakeCompletionBackend(faults=openai_faults)
+    processor = DescriptionGeneratorCore(
+        None, None, log_callback=lambda message: None,
+        sheets_backend=sheets, completion_backend=completions
+    )
+    processor.max_workers = max_workers
+    processor.batch_size = batch_size
+    # ベンチマークでは処理そのものの速度を測るため、レート制限は無効にする
+    processor.requests_per_minute = 0
+    processor.tokens_per_minute = 0
+    processor.metrics_report_dir = None
+    if configure:
+        configure(processor)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        processor.journal = ProgressJournal(os.path.join(data_dir, "progress_journal.sqlite3"))
+        started = time.perf_counter()
+        try:
+            if mode == "normal":
+                totals = processor.process_product_descriptions("bench", SHEET_NAME, NORMAL_COLUMNS)
+            else:
+                totals = processor.process_book_descriptions("bench", SHEET_NAME, BOOK_COLUMNS)
+        finally:
+            elapsed = time.perf_counter() - started
+            processor.journal.close()
+
+    latencies = [
+        sheets.written_at[row] - sheets.read_at[row]
+        for row in sheets.written_at if row in sheets.read_at
+    ]
+    sheets_calls = sum(sheets.calls.values())
+    report = processor.last_metrics.report()
+    return {
+        "mode": mode,
+        "rows": rows,
+        "succeeded": totals["success"],
+        "failed": totals["failed"],
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(totals["success"] / elapsed, 1) if elapsed else 0.0,
+        "openai_calls_per_row": round(completions.calls / rows, 3),
+        "sheets_calls_per_row": round(sheets_calls / rows, 4),
+        "prompt_tokens": completions.prompt_tokens,
+        "completion_tokens": completions.completion_tokens,
+        "retries": processor.openai_caller.retries + processor.sheets_caller.retries,
+        "stage_seconds": {name: stage["seconds"] for name, stage in report["stages"].items()},
+        "p50_row_latency_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_row_latency_ms": round(percentile(latencies, 0.95) * 1000, 1),
+    }
+
+
+def format_table(results):
+    header = f"{'mode':<7}{'rows':>8}{'ok':>8}{'fail':>6}{'sec':>9}{'rows/s':>10}{'AI/row':>8}{'GS/row':>8}{'p50 ms':>9}{'p95 ms':>9}"
+    lines = [header, "-" * len(header)]
+    for result in results:
+        lines.append(
+            f"{result['mode']:<7}{result['rows']:>8}{result['succeeded']:>8}{result['failed']:>6}"
+            f"{result['seconds']:>9.2f}{result['rows_per_second']:>10.1f}{result['openai_calls_per_row']:>8.3f}"
+            f"{result['sheets_calls_per_row']:>8.4f}{result['p50_row_latency_ms']:>9.1f}{result['p95_row_latency_ms']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="代替バックエンドで処理を実行し、rows/sec・行あたりのAPI呼び出し数・行のレイテンシを測定します。")
+    parser.add_argument("--mode", choices=["normal", "book", "both"], default="both", help="測定するモード (既定: both)")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROW_COUNTS, help="測定する行数 (既定: 1000 10000 100000)")
+    parser.add_argument("--workers", type=int, default=4, help="翻訳の並列数 (既定: 4)")
+    parser.add_argument("--batch-size", type=int, default=20, help="バッチサイズ (既定: 20)")
+    parser.add_argument("--openai-latency", type=float, default=0.0, help="OpenAI 呼び出し1回あたりの遅延(秒)")
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="Sheets 呼び出し1回あたりの遅延(秒)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="遅延のばらつきの割合 (既定: 0.2)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="OpenAI 呼び出しが 429 になる割合")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="OpenAI 呼び出しが 503 になる割合")
+    parser.add_argument("--seed", type=int, default=0, help="エラー発生の乱数シード")
+    parser.add_argument("--json", dest="json_path", help="結果をJSONで書き出すファイル")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    modes = ["normal", "book"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        for rows in args.rows:
+            openai_faults = FaultInjector(
+                latency=args.openai_latency, jitter=args.jitter, rate_limit_rate=args.rate_limit_rate,
+                error_rate=args.error_rate, retry_after=0.0, seed=args.seed
+            )
+            sheets_faults = FaultInjector(latency=args.sheets_latency, jitter=args.jitter, seed=args.seed)
+            print(f"⏱️ {mode}モード {rows}行 を測定しています...", flush=True)
+            results.append(run_benchmark(mode, rows, args.workers, args.batch_size, openai_faults, sheets_faults))
+    print(format_table(results))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# 書誌情報の取得: ISBN / JAN から openBD (まとめて問い合わせ) と NDLサーチ (openBD に無いものを1件ずつ) で書誌情報を取得します
+import json
+import re
+import unicodedata
+import urllib.error
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+from desgen_ratelimit import RateLimiter, ProcessingCancelled
+from desgen_resilience import ResilientCaller
+
+OPENBD_URL = "https://api.openbd.jp/v1"
+NDL_URL = "https://ndlsearch.ndl.go.jp/api/opensearch"
+# openBD に1回で問い合わせるISBNの数
+OPENBD_BATCH_SIZE = 1000
+# NDLサーチは1件ずつ問い合わせるため、負荷をかけないよう1分あたりの回数を抑える
+NDL_REQUESTS_PER_MINUTE = 60
+# ISBNを探す列 (先にあるものを優先)
+CODE_KEYS = ("isbn13", "isbn10", "jan_code")
+# 書誌情報で補う書籍モードの列 (列の値が空の場合だけ補います)
+BOOK_FIELDS = ("product_name", "author", "publisher", "release_date", "language", "pages", "isbn10", "isbn13", "dimensions")
+# ONIX の言語コード (ISO 639-2) → 日本語の言語名 (翻訳前の列と同じ表記にそろえる)
+LANGUAGE_CODES = {
+    "jpn": "日本語", "eng": "英語", "chi": "中国語", "zho": "中国語", "kor": "韓国語",
+    "fre": "フランス語", "fra": "フランス語", "ger": "ドイツ語", "deu": "ドイツ語",
+    "spa": "スペイン語", "ita": "イタリア語", "rus": "ロシア語", "por": "ポルトガル語",
+}
+_NDL_NAMESPACES = {"dc": "http://purl.org/dc/elements/1.1/", "dcterms": "http://purl.org/dc/terms/"}
+
+
+class BibliographyError(Exception):
+    """書誌情報APIのHTTPエラー。http_status と headers は ResilientCaller のエラー分類に使われます。"""
+    def __init__(self, message, http_status=None, headers=None):
+        super().__init__(message)
+        self.http_status = http_status
+        self.headers = headers
+
+
+def normalize_isbn(code):
+    """ISBN-10 / ISBN-13 / 書籍JAN (978・979) をハイフンなしのISBN-13にします。ISBNでない場合は None を返します。"""
+    digits = re.sub(r"[\s\-]", "", unicodedata.normalize("NFKC", code or "")).upper()
+    if re.fullmatch(r"\d{9}[\dX]", digits):
+        total = sum((10 - i) * (10 if ch == "X" else int(ch)) for i, ch in enumerate(digits))
+        if total % 11:
+            return None
+        digits = "978" + digits[:9]
+        return digits + _isbn13_check_digit(digits)
+    if re.fullmatch(r"97[89]\d{10}", digits) and _isbn13_check_digit(digits[:12]) == digits[12]:
+        return digits
+    return None
+
+
+def _isbn13_check_digit(first12):
+    total = sum(int(ch) * (3 if i % 2 else 1) for i, ch in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+
+def isbn13_to_isbn10(isbn13):
+    """978 で始まるISBN-13をISBN-10にします。979 で始まるものは ISBN-10 が無いため None を返します。"""
+    if not isbn13 or not isbn13.startswith("978"):
+        return None
+    body = isbn13[3:12]
+    check = (11 - sum((10 - i) * int(ch) for i, ch in enumerate(body)) % 11) % 11
+    return body + ("X" if check == 10 else str(check))
+
+
+def find_isbn(item):
+    """行のデータから CODE_KEYS の順にISBNを探し、ISBN-13で返します。"""
+    for key in CODE_KEYS:
+        isbn = normalize_isbn(item.get(key, ""))
+        if isbn:
+            return isbn
+    return None
+
+
+def apply_metadata(item, metadata):
+    """書誌情報で空の列を補い、テンプレートから参照できるよう item['bibliography'] に設定します。入力済みの値は変更しません。"""
+    for key in BOOK_FIELDS:
+        if key in item and not item[key].strip() and metadata.get(key):
+            item[key] = metadata[key]
+    item["bibliography"] = metadata
+
+
+def _format_date(text):
+    """openBD / NDL の日付 (20210615, 2021-06, 2021.6 など) を「2021年6月15日」の形にします。"""
+    digits = re.sub(r"[^\d]", " ", text or "").split()
+    if len(digits) == 1 and len(digits[0]) in (4, 6, 8):
+        value = digits[0]
+        digits = [value[:4]] + ([value[4:6]] if len(value) >= 6 else []) + ([value[6:8]] if len(value) == 8 else [])
+    if not digits or len(digits[0]) != 4:
+        return text or ""
+    parts = [f"{digits[0]}年"]
+    for number, unit in zip(digits[1:3], ("月", "日")):
+        if int(number):
+            parts.append(f"{int(number)}{unit}")
+    return "".join(parts)
+
+
+def _format_millimeters(values):
+    return " x ".join(f"{value / 10:g}" for value in values) + " cm"
+
+
+def parse_openbd(entry):
+    """openBD の1件 (summary と onix) を書誌情報の辞書にします。"""
+    summary = entry.get("summary") or {}
+    detail = (entry.get("onix") or {}).get("DescriptiveDetail") or {}
+    isbn13 = normalize_isbn(summary.get("isbn", ""))
+    title = " ".join(part for part in (summary.get("title", ""), summary.get("volume", "")) if part)
+    metadata = {
+        "source": "openbd",
+        "isbn13": isbn13 or "",
+        "isbn10": isbn13_to_isbn10(isbn13) or "",
+        "product_name": title,
+        "author": summary.get("author", ""),
+        "publisher": summary.get("publisher", ""),
+        "release_date": _format_date(summary.get("pubdate", "")),
+        "series": summary.get("series", ""),
+        "cover": summary.get("cover", ""),
+        "language": "",
+        "pages": "",
+        "dimensions": "",
+    }
+    for extent in detail.get("Extent") or []:
+        if extent.get("ExtentValue"):
+            metadata["pages"] = f"{extent['ExtentValue']}ページ"
+            break
+    for language in detail.get("Language") or []:
+        code = language.get("LanguageCode", "")
+        if code:
+            metadata["language"] = LANGUAGE_CODES.get(code, code)
+            break
+    # Measure: 01=高さ 02=幅 03=厚さ (単位 mm)
+    measures = {}
+    for measure in detail.get("Measure") or []:
+        if measure.get("MeasureUnitCode", "mm") == "mm":
+            try:
+                measures[measure.get("MeasureType")] = float(measure.get("Measurement"))
+            except (TypeError, ValueError):
+                pass
+    values = [measures[kind] for kind in ("01", "02", "03") if kind in measures]
+    if values:
+        metadata["dimensions"] = _format_millimeters(values)
+    return metadata
+
+
+def parse_ndl(xml_text, isbn13):
+    """NDLサーチ OpenSearch の応答 (RSS) の最初の1件を書誌情報の辞書にします。見つからない場合は None を返します。"""
+    root = ElementTree.fromstring(xml_text)
+    item = root.find("./channel/item")
+    if item is None:
+        return None
+
+    def text(path):
+        element = item.find(path, _NDL_NAMESPACES)
+        return (element.text or "").strip() if element is not None else ""
+
+    authors = [element.text.strip() for element in item.findall("dc:creator", _NDL_NAMESPACES) if element.text]
+    extents = [element.text.strip() for element in item.findall("dc:extent", _NDL_NAMESPACES) if element.text]
+    metadata = {
+        "source": "ndl",
+        "isbn13": isbn13,
+        "isbn10": isbn13_to_isbn10(isbn13) or "",
+        "product_name": text("title"),
+        "author": "、".join(authors),
+        "publisher": text("dc:publisher"),
+        "release_date": _format_date(text("dcterms:issued")),
+        "series": "",
+        "cover": "",
+        "language": LANGUAGE_CODES.get(text("dc:language").lower(), text("dc:language")),
+        "pages": "",
+        "dimensions": "",
+    }
+    # dc:extent は「318p ; 19cm」のように、ページ数と大きさ (高さ) をまとめて表します
+    for extent in extents:
+        pages = re.search(r"(\d+)\s*(?:p|ページ|頁)", extent)
+        size = re.search(r"(\d+(?:\.\d+)?)\s*cm", extent)
+        if pages and not metadata["pages"]:
+            metadata["pages"] = f"{pages.group(1)}ページ"
+        if size and not metadata["dimensions"]:
+            metadata["dimensions"] = f"{size.group(1)} cm"
+    return metadata
+
+
+class BibliographyClient:
+    """
+    ISBNの書誌情報を取得するクライアント。
+    キャッシュに無いISBNは openBD に OPENBD_BATCH_SIZE 件ずつまとめて問い合わせ、openBD に無いものは (use_ndl が有効なら) NDLサーチで1件ずつ探します。
+    結果 (見つからなかったことも含む) は MetadataCache に保存します。
+    openbd_url / ndl_url を変えると、手元のサーバー (desgen_fakes.BibliographyFixtureServer など) に差し替えられます。
+    """
+    def __init__(self, cache=None, openbd_url=OPENBD_URL, ndl_url=NDL_URL, use_ndl=True, timeout=30,
+                 ndl_requests_per_minute=NDL_REQUESTS_PER_MINUTE, caller=None, log=print):
+        self.cache = cache
+        self.openbd_url = openbd_url.rstrip("/")
+        self.ndl_url = ndl_url
+        self.use_ndl = use_ndl
+        self.timeout = timeout
+        self.ndl_rate_limiter = RateLimiter(ndl_requests_per_minute, 0)
+        self.caller = caller or ResilientCaller("Bibliography", log=log)
+        self.log = log
+        self.requests = {"openbd": 0, "ndl": 0}
+
+    def _open(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            raise BibliographyError(f"HTTP {e.code} {request.full_url}", e.code, e.headers) from e
+
+    def fetch_openbd(self, isbns):
+        """openBD にまとめて問い合わせ、{ISBN: 書誌情報 または None} を返します。"""
+        data = urllib.parse.urlencode({"isbn": ",".join(isbns)}).encode("ascii")
+        request = urllib.request.Request(f"{self.openbd_url}/get", data=data, method="POST")
+        self.requests["openbd"] += 1
+        entries = json.loads(self.caller.call(lambda: self._open(request), "openBD get").decode("utf-8"))
+        # 応答は問い合わせと同じ順序のリストで、見つからないISBNは null になる
+        return {isbn: parse_openbd(entry) if entry else None for isbn, entry in zip(isbns, entries)}
+
+    def fetch_ndl(self, isbn13, stop_event=None):
+        """NDLサーチで1件を探し、書誌情報 または None を返します。"""
+        query = urllib.parse.urlencode({"isbn": isbn13, "cnt": 1})
+        request = urllib.request.Request(f"{self.ndl_url}?{query}")
+
+        def send():
+            self.ndl_rate_limiter.acquire(0, stop_event)
+            return self._open(request)
+
+        self.requests["ndl"] += 1
+        return parse_ndl(self.caller.call(send, "NDL opensearch", stop_event).decode("utf-8"), isbn13)
+
+    def lookup(self, isbns, stop_event=None, cache_only=False, failed=None):
+        """
+        ISBN-13 のリストの書誌情報を {ISBN: 書誌情報} で返します。見つからなかったISBNは含まれません。
+        cache_only=True の場合は問い合わせず (キャッシュへの記録もせず)、キャッシュにある書誌情報だけを返します。
+        failed に集合を渡すと、問い合わせに失敗した (見つからなかったとは確定していない) ISBNを追加します。
+        """
+        isbns = list(dict.fromkeys(isbn for isbn in isbns if isbn))
+        found = self.cache.get_many(isbns) if self.cache else {}
+        missing = [] if cache_only else [isbn for isbn in isbns if isbn not in found]
+        for i in range(0, len(missing), OPENBD_BATCH_SIZE):
+            chunk = missing[i:i + OPENBD_BATCH_SIZE]
+            results = self.fetch_openbd(chunk)
+            entries = []
+            for isbn in chunk:
+                metadata, source = results.get(isbn), "openbd"
+                if metadata is None and self.use_ndl:
+                    try:
+                        metadata, source = self.fetch_ndl(isbn, stop_event), "ndl"
+                    except ProcessingCancelled:
+                        raise
+                    except Exception as e:
+                        # 見つからなかったとは記録せず、次回の実行で問い合わせ直す
+                        self.log(f"⚠️ NDLサーチでの検索に失敗しました ({isbn}): {e}")
+                        found[isbn] = None
+                        if failed is not None:
+                            failed.add(isbn)
+                        continue
+                found[isbn] = metadata
+                entries.append((isbn, source, metadata))
+            if self.cache:
+                self.cache.set_many(entries)
+        if missing:
+            self.log(f"📚 書誌情報を取得しました: 問い合わせ {len(missing)}件 / 見つかった {sum(1 for isbn in missing if found[isbn])}件")
+        return {isbn: metadata for isbn, metadata in found.items() if metadata}
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+# コマンドラインからの実行: GUIなしで設定ファイルを読み込み、1回だけ、または常駐して定期的に処理します
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+from datetime import datetime
+
+DEFAULT_CONFIG_FILE = "description_generator_config_v3.json"
+MODES = {"normal": 0, "book": 1}
+
+
+def log(message):
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {message}", flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="商品説明生成ツールをGUIなしで実行します。設定はGUIで保存した設定ファイルを使います。"
+    )
+    parser.add_argument("--config", default=DEFAULT_CONFIG_FILE, help=f"設定ファイルのパス (既定: {DEFAULT_CONFIG_FILE})")
+    parser.add_argument("--mode", choices=sorted(MODES), help="処理モード (既定: 設定ファイルで選択中のタブ)")
+    parser.add_argument("--spreadsheet-id", help="スプレッドシートID (設定ファイルの値を上書き)")
+    parser.add_argument("--sheet", help="シート名 (設定ファイルの値を上書き)")
+    parser.add_argument("--start-row", type=int, help="開始行 (設定ファイルの値を上書き)")
+    parser.add_argument("--resume", action=argparse.BooleanOptionalAction, default=None,
+                        help="前回の中断地点から再開する (既定: 設定ファイルの値)")
+    parser.add_argument("--incremental", action=argparse.BooleanOptionalAction, default=None,
+                        help="入力が変わっていない生成済みの行をスキップする (既定: 設定ファイルの値)")
+    parser.add_argument("--watch", action="store_true",
+                        help="常駐して --interval 秒ごとに新しくトリガーされた行を処理する (差分処理が有効になります)")
+    parser.add_argument("--interval", type=float, default=300.0, help="--watch の確認間隔(秒) (既定: 300)")
+    parser.add_argument("--report-dir", help="実行レポート(JSON)の保存先 (既定: desgen_data/reports)")
+    parser.add_argument("--keep-reports", type=int,
+                        help="実行レポートを新しいものから何件残すか (0 で無制限。既定: 設定ファイルの値、なければ 200)")
+    parser.add_argument("--report-max-days", type=float, help="これより古い (日数) 実行レポートを削除する (既定: 削除しない)")
+    parser.add_argument("--prometheus-file", help="実行ごとに Prometheus 形式のメトリクスを書き出すファイル")
+    parser.add_argument("--metrics-port", type=int, help="Prometheus 形式のメトリクスを http://localhost:PORT/metrics で公開する")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="--metrics-port で待ち受けるアドレス (既定: 127.0.0.1。他のマシンから収集する場合は 0.0.0.0 など)")
+    parser.add_argument("--jobs", help="複数のシートをまとめて処理するジョブファイル (JSON)。レート制限は全ジョブで共有します")
+    parser.add_argument("--max-jobs", type=int, help="ジョブの同時実行数 (既定: ジョブファイルの max_concurrent_jobs、なければ 2)")
+    parser.add_argument("--processes", type=int,
+                        help="シート全体を行範囲 (シャード) に分け、指定した数のワーカープロセスで分担して処理する")
+    parser.add_argument("--shard-rows", type=int, default=500, help="1シャードあたりのトリガー行数 (既定: 500)")
+    parser.add_argument("--lease-db", help="シャードの作業表と共有レート制限のファイル。複数のマシンで分担する場合は共有ディスク上に置きます "
+                                           "(既定: desgen_data/shard_leases.sqlite3)")
+    parser.add_argument("--join", action="store_true", help="--lease-db の未完了の作業表に参加してシャードを処理する (他のマシン用)")
+    parser.add_argument("--input", help="スプレッドシートの代わりに読み込むファイル (CSV / TSV / XLSX / Parquet)。1行目は見出し行です")
+    parser.add_argument("--output", help="--input の出力先 (既定: 入力ファイル名_output.拡張子)")
+    parser.add_argument("--in-place", action="store_true", help="--input のファイルに直接書き戻す")
+    parser.add_argument("--sync-to-sheets", action="store_true",
+                        help="--input の処理後、生成結果を設定ファイルのスプレッドシート・シートの同じ行に書き込む")
+    parser.add_argument("--template", help="HTMLテンプレートセットの名前 (templates/ 内) またはディレクトリ (設定ファイルの値を上書き)")
+    parser.add_argument("--html-output", choices=["inline", "minify", "class"],
+                        help="HTMLの出力形式。minify は空白を除き、class はさらにインラインスタイルをクラスにまとめる (設定ファイルの値を上書き)")
+    parser.add_argument("--enrich", action=argparse.BooleanOptionalAction, default=None,
+                        help="ISBN / JAN から openBD・NDLサーチで書誌情報を取得し、空の列を補う (設定ファイルの値を上書き)")
+    parser.add_argument("--openbd-url", help="openBD API のURL (既定: https://api.openbd.jp/v1。テスト用のサーバーに差し替える場合に指定)")
+    parser.add_argument("--ndl-url", help="NDLサーチ OpenSearch API のURL (既定: https://ndlsearch.ndl.go.jp/api/opensearch)")
+    parser.add_argument("--dedup", action=argparse.BooleanOptionalAction, default=None,
+                        help="色・サイズなどだけが違う類似の説明文は、翻訳済みの結果を再利用・部分修正する (設定ファイルの値を上書き)")
+    parser.add_argument("--dedup-threshold", type=float,
+                        help="--dedup で類似とみなす類似度 (0〜1、既定: 設定ファイルの値、なければ 0.85)")
+    parser.add_argument("--purge-stale-cache", action="store_true",
+                        help="現在のプロンプトバージョン以外の翻訳キャッシュ・類似文の索引のエントリを削除して終了する (保守用)")
+    parser.add_argument("--dedup-audit", metavar="CSV",
+                        help="類似文の翻訳を再利用した記録 (監査ログ) をCSVに書き出して終了する")
+    parser.add_argument("--chunk-tokens", type=int,
+                        help="推定トークン数がこれを超える説明文は段落・文で分けて並行して翻訳する (0 で分けない。既定: 設定ファイルの値、なければ 800)")
+    parser.add_argument("--routing", action=argparse.BooleanOptionalAction, default=None,
+                        help="項目と入力の長さでモデルを振り分け、短い項目は軽量モデルで翻訳する (設定ファイルの値を上書き)")
+    parser.add_argument("--routing-file", help="--routing の振り分けの規則 (JSON)。省略すると既定の規則を使います")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="ドライラン: シートを読み込むだけで、処理対象の行数・トークン数・API呼び出し回数・コスト・所要時間を見積もり、計画ファイルに保存して終了する")
+    parser.add_argument("--plan-file", help="--dry-run の計画ファイルの保存先 (既定: desgen_data/plans/日時_モード.json)")
+    parser.add_argument("--execute-plan", metavar="PLAN",
+                        help="--dry-run で保存した計画ファイルを、計画時の設定で実行する (計画に含まれる行だけを処理します)")
+    parser.add_argument("--bulk", action="store_true",
+                        help="一括モード: 必要な翻訳を Batch API にまとめて投入し、完了後に結果を使って処理する (最大24時間かかります)")
+    parser.add_argument("--bulk-poll", type=float, default=60.0, help="--bulk のバッチの完了を確認する間隔(秒) (既定: 60)")
+    parser.add_argument("--bulk-local", action="store_true",
+                        help="--bulk のバッチを Batch API ではなく手元で処理する (動作確認用。通常のAPIを順に呼び出します)")
+    args = parser.parse_args(argv)
+    if args.bulk_local:
+        args.bulk = True
+    if args.dedup_threshold is not None and not 0 < args.dedup_threshold <= 1:
+        parser.error("--dedup-threshold には 0 より大きく 1 以下の値を指定してください")
+    if args.keep_reports is not None and args.keep_reports < 0:
+        parser.error("--keep-reports には0以上を指定してください")
+    if args.report_max_days is not None and args.report_max_days <= 0:
+        parser.error("--report-max-days には0より大きい値を指定してください")
+    if args.chunk_tokens is not None and args.chunk_tokens < 0:
+        parser.error("--chunk-tokens には0以上を指定してください")
+    if args.dry_run and args.execute_plan:
+        parser.error("--dry-run と --execute-plan は同時には指定できません")
+    if (args.dry_run or args.execute_plan) and (args.jobs or args.processes or args.watch or args.bulk or args.input):
+        parser.error("--dry-run / --execute-plan は --jobs / --processes / --watch / --bulk / --input と同時には指定できません")
+    if args.plan_file and not args.dry_run:
+        parser.error("--plan-file は --dry-run と一緒に指定してください")
+    if args.bulk and (args.jobs or args.processes or args.watch):
+        parser.error("--bulk は --jobs / --processes / --watch と同時には指定できません")
+    if args.input and (args.jobs or args.processes or args.watch):
+        parser.error("--input は --jobs / --processes / --watch と同時には指定できません")
+    if (args.output or args.in_place or args.sync_to_sheets) and not args.input:
+        parser.error("--output / --in-place / --sync-to-sheets は --input と一緒に指定してください")
+    if args.join and not args.processes:
+        args.processes = 1
+    if args.processes is not None and args.processes < 1:
+        parser.error("--processes には1以上を指定してください")
+    if args.processes and args.jobs:
+        parser.error("--processes / --join は --jobs と同時には指定できません")
+    if (args.jobs or args.processes) and (args.metrics_port is not None or args.prometheus_file):
+        parser.error("--metrics-port / --prometheus-file は --jobs / --processes と同時には指定できません (実行ごとのレポートを使ってください)")
+    return args
+
+
+def load_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def validate_config(config, require_spreadsheet=True, require_credentials=True, require_api_key=True):
+    """
+    GUIの validate_settings と同じ確認を行い、問題があればメッセージを返します。
+    ジョブファイルで実行する場合はスプレッドシートIDをジョブごとに確認するため、require_spreadsheet=False にします。
+    ファイルだけを処理する場合は Google の認証も不要なため、require_credentials=False にします。
+    ドライランは OpenAI API を呼ばないため、require_api_key=False にします。
+    """
+    if require_credentials and not os.path.exists(config.get("credentials_var", "")): return "Google認証ファイルが見つかりません。"
+    if require_api_key and not config.get("openai_api_key_var"): return "OpenAI APIキーが設定されていません (設定ファイルまたは環境変数 OPENAI_API_KEY)。"
+    if require_spreadsheet and not config.get("spreadsheet_id_var"): return "スプレッドシートIDが設定されていません。"
+    try: int(config.get("start_row_var", 2))
+    except ValueError: return "開始行は半角数値を指定してください。"
+    if config.get("model_routing_var") and config.get("routing_file_var"):
+        from desgen_routing import RoutingPolicy
+        try: RoutingPolicy.load(config["routing_file_var"])
+        except (OSError, ValueError) as e: return f"振り分けの規則 {config['routing_file_var']} を読み込めませんでした: {e}"
+    return None
+
+
+def load_jobs(path, config, default_mode):
+    """
+    ジョブファイルを読み込み、(同時実行数, [JobQueue.add_job の引数]) を返します。
+    ジョブファイルはジョブの配列、または {"max_concurrent_jobs": 件数, "jobs": [...]} です。
+    各ジョブで省略した項目 (spreadsheet_id / mode / columns / start_row) は設定ファイルの値を使います。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"jobs": data}
+    jobs = []
+    for entry in data.get("jobs", []):
+        mode = entry.get("mode", default_mode)
+        if mode not in MODES:
+            raise ValueError(f"不明なモードです: {mode}")
+        if not entry.get("spreadsheet_id", config.get("spreadsheet_id_var")):
+            raise ValueError(f"スプレッドシートIDが設定されていません: {entry.get('name') or entry.get('sheet_name')}")
+        jobs.append({
+            "spreadsheet_id": entry.get("spreadsheet_id", config.get("spreadsheet_id_var")),
+            "sheet_name": entry["sheet_name"],
+            "mode": mode,
+            "column_settings": entry.get("columns", config.get("normal_mode" if mode == "normal" else "book_mode", {})),
+            "start_row": entry.get("start_row", config.get("start_row_var", 2)),
+            "priority": entry.get("priority", 1),
+            "name": entry.get("name"),
+        })
+    return data.get("max_concurrent_jobs", 2), jobs
+
+
+def run_once(processor, config, mode, resume, bulk=None):
+    """
+    選択したモードで1回処理し、{"success": 件数, "failed": 件数} を返します。
+    bulk (desgen_batch.BulkTranslator) を渡すと、翻訳をバッチで済ませてから処理します。
+    """
+    spreadsheet_id = config["spreadsheet_id_var"]
+    sheet_name = config.get("sheet_name_var", "集計")
+    start_row = int(config.get("start_row_var", 2))
+    if bulk is not None:
+        column_settings = config.get("normal_mode" if mode == "normal" else "book_mode", {})
+        totals = bulk.run(mode, spreadsheet_id, sheet_name, column_settings, start_row, resume=resume)
+        return totals or {"success": 0, "failed": 0}
+    if mode == "normal":
+        return processor.process_product_descriptions(
+            spreadsheet_id, sheet_name, config.get("normal_mode", {}), start_row, resume=resume
+        )
+    return processor.process_book_descriptions(
+        spreadsheet_id, sheet_name, config.get("book_mode", {}), start_row, resume=resume
+    )
+
+
+def export_dedup_audit(path):
+    """類似文の再利用の監査ログを新しい順にCSVへ書き出します (Excelで開けるようBOM付きUTF-8)。"""
+    import csv
+    from desgen_store import DedupIndex
+    index = DedupIndex()
+    entries = index.audit()
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=DedupIndex.AUDIT_COLUMNS)
+        writer.writeheader()
+        for entry in entries:
+            writer.writerow(dict(entry, created_at=datetime.fromtimestamp(entry["created_at"]).isoformat(timespec="seconds")))
+    index.close()
+    return len(entries)
+
+
+def purge_stale_entries():
+    """現在のプロンプトバージョン以外の翻訳キャッシュ・類似文の索引のエントリを削除し、(キャッシュ, 索引) の削除件数を返します。"""
+    from desgen_core import PROMPT_VERSION
+    from desgen_store import TranslationCache, DedupIndex
+    removed = []
+    for store in (TranslationCache(), DedupIndex()):
+        try:
+            removed.append(store.invalidate(PROMPT_VERSION, keep_current=True))
+        finally:
+            store.close()
+    return tuple(removed)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.purge_stale_cache:
+        try:
+            cache_removed, index_removed = purge_stale_entries()
+        except Exception as e:
+            log(f"❌ 古いキャッシュを削除できませんでした: {e}")
+            return 2
+        log(f"🗃️ 現在のプロンプトバージョン以外のエントリを削除しました: 翻訳キャッシュ {cache_removed}件 / 類似文の索引 {index_removed}件")
+        return 0
+    if args.dedup_audit:
+        try:
+            count = export_dedup_audit(args.dedup_audit)
+        except OSError as e:
+            log(f"❌ 監査ログを書き出せませんでした: {e}")
+            return 2
+        log(f"🧬 類似文の再利用の記録 {count}件を {args.dedup_audit} に書き出しました。")
+        return 0
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        log(f"❌ 設定ファイル {args.config} を読み込めませんでした: {e}")
+        return 2
+
+    # コマンドライン引数と環境変数で設定ファイルの値を上書きする
+    if os.environ.get("OPENAI_API_KEY") and not config.get("openai_api_key_var"):
+        config["openai_api_key_var"] = os.environ["OPENAI_API_KEY"]
+    if args.spreadsheet_id:
+        config["spreadsheet_id_var"] = args.spreadsheet_id
+    if args.sheet:
+        config["sheet_name_var"] = args.sheet
+    if args.start_row is not None:
+        config["start_row_var"] = args.start_row
+    if args.incremental is not None:
+        config["incremental_var"] = args.incremental
+    if args.template:
+        config["template_var"] = args.template
+    if args.html_output:
+        config["html_output_var"] = args.html_output
+    if args.chunk_tokens is not None:
+        config["chunk_token_budget_var"] = args.chunk_tokens
+    if args.keep_reports is not None:
+        config["report_keep_var"] = args.keep_reports
+    if args.report_max_days is not None:
+        config["report_max_age_days_var"] = args.report_max_days
+    if args.routing_file:
+        config["routing_file_var"] = args.routing_file
+        if args.routing is None:
+            args.routing = True
+    if args.routing is not None:
+        config["model_routing_var"] = args.routing
+    if args.dedup is not None:
+        config["dedup_var"] = args.dedup
+    if args.dedup_threshold is not None:
+        config["dedup_threshold_var"] = args.dedup_threshold
+    if args.enrich is not None:
+        config["enrich_bibliography_var"] = args.enrich
+    if args.openbd_url:
+        config["openbd_url_var"] = args.openbd_url
+    if args.ndl_url:
+        config["ndl_url_var"] = args.ndl_url
+    if args.watch:
+        # 常駐時は毎回シート全体を確認するため、生成済みの行は差分処理でスキップする
+        config["incremental_var"] = True
+    plan = None
+    if args.execute_plan:
+        from desgen_plan import load_plan
+        try:
+            plan = load_plan(args.execute_plan)
+        except (OSError, ValueError) as e:
+            log(f"❌ 計画ファイル {args.execute_plan} を読み込めませんでした: {e}")
+            return 2
+        # 計画の対象と設定を使う (認証情報は計画に含まれないため設定ファイルのものを使う)
+        config.update(plan.get("settings", {}), spreadsheet_id_var=plan["spreadsheet_id"], sheet_name_var=plan["sheet_name"])
+        args.mode = plan["mode"]
+    mode = args.mode or next(name for name, index in MODES.items() if index == config.get("selected_tab", 0))
+    resume = args.resume if args.resume is not None else bool(config.get("resume_var", True))
+
+    uses_sheets = not args.input or args.sync_to_sheets
+    error = validate_config(
+        config, require_spreadsheet=uses_sheets and not (args.jobs or args.join), require_credentials=uses_sheets,
+        require_api_key=not args.dry_run
+    )
+    if error:
+        log(f"❌ 設定エラー: {error}")
+        return 2
+
+    if args.jobs:
+        try:
+            max_jobs, job_specs = load_jobs(args.jobs, config, mode)
+        except (OSError, ValueError, KeyError) as e:
+            log(f"❌ ジョブファイル {args.jobs} を読み込めませんでした: {e}")
+            return 2
+        max_jobs = args.max_jobs or max_jobs
+
+    # --help や設定エラーの表示を速くするため、コアモジュールは引数の確認が済んでからインポートする
+    from desgen_core import DescriptionGeneratorCore
+
+    def create_processor(log_callback):
+        processor = DescriptionGeneratorCore(config["credentials_var"], config.get("openai_api_key_var", ""), log_callback)
+        if args.report_dir:
+            processor.metrics_report_dir = args.report_dir
+        return processor
+
+    def create_bulk(processor):
+        if not args.bulk:
+            return None
+        from desgen_batch import BulkTranslator, LocalBatchBackend, OpenAIBatchBackend
+        if args.bulk_local:
+            batch_backend = LocalBatchBackend(processor.completion_backend)
+        else:
+            batch_backend = OpenAIBatchBackend(config["openai_api_key_var"])
+        return BulkTranslator(processor, batch_backend, poll_interval=args.bulk_poll, log=log)
+
+    if args.processes:
+        import multiprocessing
+        import desgen_shards
+        lease_path = args.lease_db or desgen_shards.DEFAULT_LEASE_DB
+        stop_workers = multiprocessing.get_context("spawn").Event()
+
+        def run_cycle(resume):
+            # シャードはジャーナルから再開するため、resume の指定によらず未完了の作業表を引き継ぐ
+            if args.join:
+                totals = desgen_shards.join_sharded(
+                    config, args.processes, lease_path, stop_event=stop_workers, log=log, report_dir=args.report_dir
+                )
+            else:
+                totals = desgen_shards.run_sharded(
+                    config, mode, args.processes, args.shard_rows, lease_path,
+                    stop_event=stop_workers, log=log, report_dir=args.report_dir
+                )
+            return not (totals["failed"] or totals["failed_shards"] or totals["unfinished_shards"])
+
+        def stop():
+            stop_workers.set()
+    elif args.input:
+        from desgen_backends import GoogleSheetsBackend
+        from desgen_files import FileSheetsBackend
+        stem, extension = os.path.splitext(args.input)
+        output_path = args.input if args.in_place else (args.output or f"{stem}_output{extension}")
+        mode_key = "normal_mode" if mode == "normal" else "book_mode"
+        try:
+            backend = FileSheetsBackend(args.input, output_path, sheet_name=args.sheet)
+            # ジャーナルと差分処理のハッシュは、スプレッドシートIDの代わりにファイルのパスで区別する
+            file_config = dict(config, spreadsheet_id_var=os.path.abspath(args.input), sheet_name_var=backend.sheet_name)
+            file_config[mode_key] = backend.resolve_columns(config.get(mode_key, {}))
+        except (OSError, ValueError, RuntimeError) as e:
+            log(f"❌ 入力ファイル {args.input} を開けませんでした: {e}")
+            return 2
+        processor = create_processor(log)
+        processor.sheets_backend = backend
+        processor.apply_settings(config)
+        if not args.sync_to_sheets:
+            # ファイルにはセルの文字数の上限がない
+            processor.cell_limit = None
+        processor.prometheus_file = args.prometheus_file
+        processor.metrics_port = args.metrics_port
+        processor.metrics_host = args.metrics_host
+        bulk = create_bulk(processor)
+
+        def run_cycle(resume):
+            totals = run_once(processor, file_config, mode, resume, bulk)
+            if processor.stop_flag:
+                log("📁 中断したため出力ファイルは書き出していません。同じコマンドで続きから処理できます。")
+                return False
+            if args.sync_to_sheets:
+                backend.sync_to_sheets(
+                    GoogleSheetsBackend(processor.sheets_service), config["spreadsheet_id_var"],
+                    config.get("sheet_name_var", "集計"), caller=processor.sheets_caller, log=log
+                )
+            cells = backend.finalize()
+            log(f"📁 出力ファイルを書き出しました: {backend.output_path} ({cells} セル)")
+            return not totals["failed"]
+
+        def stop():
+            if bulk:
+                bulk.stop()
+            else:
+                processor.stop_processing()
+    elif args.dry_run or plan:
+        processor = create_processor(log)
+        processor.apply_settings(config)
+        processor.prometheus_file = args.prometheus_file
+        processor.metrics_port = args.metrics_port
+        processor.metrics_host = args.metrics_host
+
+        def run_cycle(resume):
+            if plan:
+                return not processor.execute_plan(plan, resume=resume)["failed"]
+            column_settings = config.get("normal_mode" if mode == "normal" else "book_mode", {})
+            planned = processor.plan_run(
+                mode, config["spreadsheet_id_var"], config.get("sheet_name_var", "集計"), column_settings,
+                int(config.get("start_row_var", 2)), resume=resume, settings=config, path=args.plan_file
+            )
+            if planned:
+                log(f"🧾 実行するには: python desgen_cli.py --execute-plan {planned['path']}")
+            return planned is not None
+
+        def stop():
+            processor.stop_processing()
+    elif args.jobs:
+        from desgen_jobs import JobQueue, DONE
+        current = {}
+
+        def run_cycle(resume):
+            # ジョブの状態は実行ごとに作り直す (共有のリミッターもここで新しくなる)
+            queue = JobQueue(
+                create_processor, config, max_jobs,
+                requests_per_minute=int(config.get("requests_per_minute_var", 500)),
+                tokens_per_minute=int(config.get("tokens_per_minute_var", 30000)), log=log
+            )
+            for spec in job_specs:
+                queue.add_job(resume=resume, **spec)
+            current["queue"] = queue
+            try:
+                summary = queue.run()
+            finally:
+                queue.close()
+            return all(job["status"] == DONE and not job["totals"]["failed"] for job in summary)
+
+        def stop():
+            if "queue" in current:
+                current["queue"].stop()
+    else:
+        processor = create_processor(log)
+        processor.apply_settings(config)
+        processor.prometheus_file = args.prometheus_file
+        processor.metrics_port = args.metrics_port
+        processor.metrics_host = args.metrics_host
+        bulk = create_bulk(processor)
+
+        def run_cycle(resume):
+            return not run_once(processor, config, mode, resume, bulk)["failed"]
+
+        def stop():
+            if bulk:
+                bulk.stop()
+            else:
+                processor.stop_processing()
+
+    shutdown = threading.Event()
+
+    def request_shutdown(signum, frame):
+        if shutdown.is_set():
+            # 2回目の割り込みでは書き込みの完了を待たずに終了する
+            raise KeyboardInterrupt
+        shutdown.set()
+        stop()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, request_shutdown)
+
+    if not args.watch:
+        try:
+            succeeded = run_cycle(resume)
+        except Exception as e:
+            log(f"❌ 致命的なエラーが発生しました: {e}")
+            return 1
+        return 0 if succeeded else 1
+
+    target = f"{len(job_specs)}件のジョブ" if args.jobs else f"{mode}モード"
+    if args.processes:
+        target += f" / {args.processes}プロセス"
+    log(f"👀 常駐モードで開始しました ({target} / {args.interval:.0f}秒ごとに確認)。停止するには Ctrl+C を押してください。")
+    while not shutdown.is_set():
+        try:
+            run_cycle(resume=True)
+        except Exception as e:
+            # 一時的な障害で常駐が終わらないよう、記録して次の確認まで待つ
+            log(f"❌ 処理中にエラーが発生しました: {e}")
+        shutdown.wait(args.interval)
+    log("👋 常駐モードを終了しました。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
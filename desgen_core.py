@@ -1,53 +1,465 @@
 # -*- coding: utf-8 -*-
 # コア処理クラス: 商品説明生成
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import openai
+# gspread / openai / googleapiclient は起動を速くするため、初めて使う時点でインポートします
 import time
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 import threading
+import hashlib
+import json
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from desgen_backends import GoogleSheetsBackend, OpenAICompletionBackend
+from desgen_bibliography import BibliographyClient, OPENBD_URL, NDL_URL, find_isbn, apply_metadata
+from desgen_dedup import Deduplicator, DEFAULT_THRESHOLD, PATCH_CONTEXT, is_verbatim, apply_replacements
+from desgen_metrics import RunMetrics, MetricsServer, ProgressTracker, MODEL_PRICES, DEFAULT_REPORT_KEEP, prune_reports
+from desgen_normalize import normalize_field, normalize_dimensions
+from desgen_plan import (
+    EstimatingCompletionBackend, estimate_duration, summarize_requests, public_settings, summary_lines, write_plan, load_plan,
+    PLAN_VERSION, DEFAULT_PLAN_DIR
+)
+from desgen_ratelimit import RateLimiter, ProcessingCancelled
+from desgen_resilience import ResilientCaller
+from desgen_routing import RoutingPolicy, Route, check_translation
+from desgen_sheets import SheetWriter, coalesce_rows, quote_sheet_name, CELL_CHARACTER_LIMIT
+from desgen_store import TranslationCache, RowHashStore, ProgressJournal, MetadataCache, DedupIndex, DEFAULT_DATA_DIR
+from desgen_templates import TemplateSet, DEFAULT_TEMPLATE_SET
+from desgen_tokens import estimate_tokens, pack_items, split_text
+
+TRANSLATION_SYSTEM_PROMPT = "You are a professional translator. Convert the following Japanese text into natural, fluent English. This text is a {context}. Return only the translated text itself, without any additional comments or explanations."
+TRANSLATION_USER_PROMPT = "Please translate this into English: {text}"
+# 長文を分けて翻訳するときのプロンプト (分けない場合と同じ翻訳になるよう、キャッシュのバージョンには含めない)
+CHUNK_SYSTEM_PROMPT = "You are a professional translator. Convert the following Japanese text into natural, fluent English. This text is part {index} of {count} of a {context} for the product \"{title}\"; the other parts are translated separately and joined afterwards, so translate only this part and keep its paragraphs and line breaks. Return only the translated text itself, without any additional comments or explanations."
+MULTI_FIELD_SYSTEM_PROMPT = "You are a professional translator. You will receive a JSON object whose values each contain a Japanese \"text\" and a \"context\" describing what the text is. Convert every text into natural, fluent English. Respond with a JSON object that has exactly the same keys, where each value is only the translated text as a string."
+# プロンプトを変更するとバージョンが変わり、古いキャッシュは参照されなくなります
+PROMPT_VERSION = hashlib.sha256(
+    (TRANSLATION_SYSTEM_PROMPT + TRANSLATION_USER_PROMPT + MULTI_FIELD_SYSTEM_PROMPT).encode("utf-8")
+).hexdigest()[:12]
+# 1回のリクエストの出力トークン数の上限。打ち切られた応答はここまで max_tokens を増やして再送する
+MAX_COMPLETION_TOKENS = 4096
+# 書誌情報を補えなかった行の入力のハッシュに付ける印。次回の差分処理で入力と一致せず、作り直される
+ENRICHMENT_PENDING_SUFFIX = ":enrichment-pending"
+# パイプラインの各段に終端を知らせる目印
+_END_OF_STREAM = object()
+
+
+class TranslationError(Exception):
+    """リトライしても翻訳できなかったことを表す例外。該当行は失敗として扱われます。"""
+
+class TruncatedCompletionError(Exception):
+    """max_tokens を上限まで増やしても応答が打ち切られたことを表す例外。"""
 
 class DescriptionGeneratorCore:
     """
     商品説明生成のコアロジックを管理するクラス。
     通常モードと書籍モードの処理を担当します。
     """
-    def __init__(self, credentials_file, openai_api_key, log_callback=None):
+    def __init__(self, credentials_file, openai_api_key, log_callback=None, sheets_backend=None, completion_backend=None):
         """
         クラスの初期化。
+        sheets_backend / completion_backend を省略すると、Google Sheets API と OpenAI を使います。
         """
         self.credentials_file = credentials_file
         self.openai_api_key = openai_api_key
         self.log_callback = log_callback or print
         
-        openai.api_key = self.openai_api_key
-        
         self.scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-        self.credentials = service_account.Credentials.from_service_account_file(
-            credentials_file, scopes=self.scopes
-        )
-        self.sheets_service = build("sheets", "v4", credentials=self.credentials)
-        
-        self.client = gspread.authorize(
-            ServiceAccountCredentials.from_json_keyfile_name(credentials_file, self.scopes)
-        )
+        # API クライアントは初回アクセス時に作成します (sheets_service / client / 各バックエンド)
+        self._sheets_service = None
+        self._client = None
+        self._sheets_backend = sheets_backend
+        self._completion_backend = completion_backend
+        self._client_lock = threading.Lock()
         
         self.batch_size = 20
-        self.translation_delay = 1.0
-        self.batch_delay = 5.0
-        self.stop_flag = False
-        
-        self.log("✅ Google API & OpenAI サービスの初期化が完了しました。")
+        self.prefetch_batches = 2
+        self.index_chunk_rows = 10000
+        self.coalesce_gap = 5
+        self.incremental = False
+        self.row_hash_store = None
+        self.journal = None
+        self._journal_job_key = None
+        self._stop_event = threading.Event()
+        self.max_workers = 4
+        self.requests_per_minute = 500
+        self.tokens_per_minute = 30000
+        self.rate_limiter = None
+        # 振り分けの rate_limits で別枠にしたモデルのリミッター ({モデル: RateLimiter})
+        self.model_rate_limiters = {}
+        # 別枠のリミッターを作る関数 (モデル, 1分あたりのリクエスト数, トークン数) → リミッター。
+        # None の場合は RateLimiter を作ります (ジョブキューは FairRateLimiter、シャードは SharedRateLimiter を設定します)
+        self.rate_limiter_factory = None
+        self._rate_limiter_lock = threading.Lock()
+        # Sheets API のレート制限 (None で無制限)。ジョブキューでは全ジョブで共有します
+        self.sheets_rate_limiter = None
+        # 共有の FairRateLimiter で枠を分け合うときの識別子と重み (ジョブキューが設定します)
+        self.rate_limit_client = None
+        self.rate_limit_weight = 1.0
+        self._executor = None
+        self.request_timeout = 120
+        self.openai_caller = ResilientCaller("OpenAI", log=self.log)
+        self.sheets_caller = ResilientCaller("Google Sheets", log=self.log)
+        self.write_flush_rows = 50
+        self.write_flush_interval = 30.0
+        self.translation_model = "gpt-4o"
+        # 項目・入力の長さによるモデルの振り分け (enable_routing で有効化)。無効な場合は常に translation_model を使う
+        self.routing = None
+        self.prompt_version = PROMPT_VERSION
+        self.translation_cache = None
+        self.book_field_batching = True
+        self.pack_translations = True
+        self.pack_token_budget = 2000
+        self.local_normalization = True
+        # 推定トークン数がこれを超える原文は、段落・文の区切りで分けて並行して翻訳する (0 で分けない)
+        self.chunk_token_budget = 800
+        self._chunk_executor = None
+        # 類似の原文の翻訳を再利用する (enable_dedup で有効化)
+        self.deduplicator = None
+        self.dedup_threshold = DEFAULT_THRESHOLD
+        # 書誌情報: enricher (BibliographyClient) を設定すると、ISBN / JAN から空の列を補う段が翻訳段と並行して動きます
+        self.enricher = None
+        # HTMLテンプレート: 実行の開始時に template_set を html_output の形式で読み込み、コンパイルします
+        self.template_set = DEFAULT_TEMPLATE_SET
+        self.html_output = "inline"
+        self.templates = None
+        # 1セルの文字数の上限 (None で無制限)。超えた行は書き込まずに失敗にします
+        self.cell_limit = CELL_CHARACTER_LIMIT
+        # collect_translations の実行中だけ設定され、APIを呼ぶ代わりに (原文, コンテキスト) を受け取る関数
+        self.translation_collector = None
+        # ドライラン (plan_run) の実行中は、APIの代わりに見積もり用のバックエンドを使い、キャッシュ・ジャーナルには書き込まない
+        self._estimating = False
+        self._estimated_translations = {}
+        # 計画の実行 (execute_plan) では、計画に含まれる行だけを処理する
+        self.row_filter = None
+        # 計測: metrics は実行中のみ設定され、終了後は last_metrics に移ります
+        self.metrics = None
+        self.last_metrics = None
+        self.model_prices = dict(MODEL_PRICES)
+        self.metrics_report_dir = os.path.join(DEFAULT_DATA_DIR, "reports")
+        # 実行レポートは新しいものから metrics_report_keep 件、metrics_report_max_age_days 日分だけ残す (None で無制限)
+        self.metrics_report_keep = DEFAULT_REPORT_KEEP
+        self.metrics_report_max_age_days = None
+        self.prometheus_file = None
+        self.metrics_port = None
+        self.metrics_host = "127.0.0.1"
+        self._metrics_server = None
+        # 進捗: progress_callback には件数が変わるたびに ProgressTracker.snapshot() の結果が渡されます
+        self.progress = ProgressTracker()
+        self.progress_callback = None
     
     def log(self, message):
         if self.log_callback:
             self.log_callback(message)
+
+    @property
+    def sheets_service(self):
+        """Google Sheets API (v4) のクライアント。初回アクセス時に認証して作成します。"""
+        if self._sheets_service is None:
+            with self._client_lock:
+                if self._sheets_service is None:
+                    from google.oauth2 import service_account
+                    from googleapiclient.discovery import build
+                    credentials = service_account.Credentials.from_service_account_file(
+                        self.credentials_file, scopes=self.scopes
+                    )
+                    self._sheets_service = build("sheets", "v4", credentials=credentials)
+                    self.log("✅ Google Sheets API の初期化が完了しました。")
+        return self._sheets_service
+
+    @sheets_service.setter
+    def sheets_service(self, service):
+        self._sheets_service = service
+
+    @property
+    def client(self):
+        """gspread のクライアント。初回アクセス時に認証して作成します。"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import gspread
+                    from oauth2client.service_account import ServiceAccountCredentials
+                    self._client = gspread.authorize(
+                        ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, self.scopes)
+                    )
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def sheets_backend(self):
+        """スプレッドシートの読み書きに使うバックエンド (desgen_backends.SheetsBackend)。"""
+        if self._sheets_backend is None:
+            self._sheets_backend = GoogleSheetsBackend(self.sheets_service)
+        return self._sheets_backend
+
+    @sheets_backend.setter
+    def sheets_backend(self, backend):
+        self._sheets_backend = backend
+
+    @property
+    def completion_backend(self):
+        """翻訳に使う文章生成のバックエンド (desgen_backends.CompletionBackend)。"""
+        if self._completion_backend is None:
+            self._completion_backend = OpenAICompletionBackend(self.openai_api_key)
+        return self._completion_backend
+
+    @completion_backend.setter
+    def completion_backend(self, backend):
+        self._completion_backend = backend
+
+    def apply_settings(self, config):
+        """
+        設定ファイル (GUIの保存形式) の辞書から処理設定を反映します。
+        含まれていない項目は現在の値のままです。GUIとCLIの両方から使います。
+        """
+        converters = {
+            "batch_size_var": ("batch_size", int),
+            "max_workers_var": ("max_workers", int),
+            "requests_per_minute_var": ("requests_per_minute", int),
+            "tokens_per_minute_var": ("tokens_per_minute", int),
+            "write_flush_rows_var": ("write_flush_rows", int),
+            "write_flush_interval_var": ("write_flush_interval", float),
+            "prefetch_batches_var": ("prefetch_batches", int),
+            "book_field_batching_var": ("book_field_batching", bool),
+            "pack_translations_var": ("pack_translations", bool),
+            "pack_token_budget_var": ("pack_token_budget", int),
+            "incremental_var": ("incremental", bool),
+            "template_var": ("template_set", str),
+            "html_output_var": ("html_output", str),
+            "dedup_threshold_var": ("dedup_threshold", float),
+            "chunk_token_budget_var": ("chunk_token_budget", int),
+            "report_keep_var": ("metrics_report_keep", int),
+            "report_max_age_days_var": ("metrics_report_max_age_days", float),
+        }
+        for key, (attribute, convert) in converters.items():
+            if key in config:
+                setattr(self, attribute, convert(config[key]))
+        if config.get("use_translation_cache_var") and self.translation_cache is None:
+            self.enable_translation_cache()
+        if "enrich_bibliography_var" in config:
+            if not config["enrich_bibliography_var"]:
+                self.enricher = None
+            elif self.enricher is None:
+                self.enable_enrichment(
+                    openbd_url=config.get("openbd_url_var") or os.environ.get("DESGEN_OPENBD_URL") or OPENBD_URL,
+                    ndl_url=config.get("ndl_url_var") or os.environ.get("DESGEN_NDL_URL") or NDL_URL,
+                    use_ndl=bool(config.get("use_ndl_var", True))
+                )
+        if "model_routing_var" in config:
+            if not config["model_routing_var"]:
+                self.routing = None
+            elif self.routing is None:
+                self.enable_routing(config.get("routing_file_var") or None)
+        if "dedup_var" in config:
+            if not config["dedup_var"]:
+                self.deduplicator = None
+            elif self.deduplicator is None:
+                self.enable_dedup()
+        if self.deduplicator is not None:
+            self.deduplicator.threshold = self.dedup_threshold
     
+    @property
+    def stop_flag(self):
+        return self._stop_event.is_set()
+
+    @stop_flag.setter
+    def stop_flag(self, value):
+        if value:
+            self._stop_event.set()
+        else:
+            self._stop_event.clear()
+
     def stop_processing(self):
         self.stop_flag = True
         self.log("🛑 処理の中断リクエストを受け付けました。")
+
+    def close(self):
+        """
+        開いているストア (翻訳キャッシュ・行ハッシュ・進捗ジャーナル・類似文の索引・書誌情報キャッシュ) と
+        メトリクスのHTTPサーバーを閉じます。閉じた後に同じインスタンスで処理を続ける場合は、再度有効化してください。
+        """
+        stores = [self.translation_cache, self.row_hash_store, self.journal]
+        if self.deduplicator is not None:
+            stores.append(self.deduplicator.index)
+        if self.enricher is not None:
+            stores.append(self.enricher.cache)
+        for store in stores:
+            if store is not None:
+                store.close()
+        self.translation_cache = self.row_hash_store = self.journal = None
+        self.deduplicator = self.enricher = None
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._metrics_server = None
     
+    def enable_translation_cache(self, path=None, **options):
+        """
+        翻訳キャッシュを有効にします。期限切れ・上限超過のエントリはここで削除されます。
+        他のプロンプトバージョンのエントリは参照されないだけで削除しません (同じキャッシュを使う別の環境のため)。
+        まとめて削除する場合は desgen_cli.py --purge-stale-cache を使います。
+        """
+        self.translation_cache = TranslationCache(path, **options) if path else TranslationCache(**options)
+        removed = self.translation_cache.evict()
+        stats = self.translation_cache.stats()
+        self.log(f"🗃️ 翻訳キャッシュを有効化しました: {stats['entries']}件 (期限切れ・上限超過のエントリ {removed}件を削除)")
+
+    def enable_dedup(self, path=None, **options):
+        """
+        類似の原文の翻訳の再利用を有効にします。options は Deduplicator の引数 (min_chars など) です。
+        他のプロンプトバージョンのエントリは (バケットのキーが違うため) 参照されないだけで削除しません。
+        まとめて削除する場合は desgen_cli.py --purge-stale-cache を使います。
+        """
+        index = DedupIndex(path) if path else DedupIndex()
+        options.setdefault("threshold", self.dedup_threshold)
+        self.deduplicator = Deduplicator(index, **options)
+        stats = index.stats()
+        self.log(
+            f"🧬 類似文の翻訳の再利用を有効化しました: 索引 {stats['entries']}件 / しきい値 {self.deduplicator.threshold}"
+        )
+
+    def enable_routing(self, path=None):
+        """
+        項目・入力の長さによるモデルの振り分けを有効にします。path を省略すると既定の規則 (desgen_routing.DEFAULT_ROUTES) を使います。
+        不備のある応答をやり直す上位のモデルは translation_model です。
+        """
+        if path:
+            self.routing = RoutingPolicy.load(path, escalation_model=self.translation_model)
+        else:
+            self.routing = RoutingPolicy(escalation_model=self.translation_model)
+        models = sorted({tier["model"] for tiers in self.routing.routes.values() for tier in tiers})
+        self.log(f"🔀 モデルの振り分けを有効化しました: {len(self.routing.routes)}項目 ({', '.join(models)} → {self.routing.escalation_model})")
+
+    def load_templates(self):
+        """template_set のテンプレートを html_output の形式で読み込み、コンパイルします。"""
+        self.templates = TemplateSet.load(self.template_set, self.html_output)
+        self.log(f"🧩 テンプレート「{self.templates.name}」を読み込みました (出力形式: {self.templates.output_mode})")
+        return self.templates
+
+    def render_description(self, mode, context):
+        """
+        mode (normal / book) のテンプレートで商品説明のHTMLを生成します。
+        セルの文字数の上限 (cell_limit) は書き込み時に SheetWriter が確認します。
+        """
+        if self.templates is None:
+            self.load_templates()
+        return self.templates.render(mode, context)
+
+    def enable_enrichment(self, cache_path=None, **options):
+        """
+        書誌情報の取得を有効にします。options は BibliographyClient の引数 (openbd_url / ndl_url / use_ndl など) です。
+        期限切れの書誌情報キャッシュはここで削除されます。
+        """
+        cache = MetadataCache(cache_path) if cache_path else MetadataCache()
+        removed = cache.evict()
+        self.enricher = BibliographyClient(cache, caller=ResilientCaller("Bibliography", log=self.log), log=self.log, **options)
+        self.log(f"📚 書誌情報の取得を有効化しました: {self.enricher.openbd_url} (期限切れのキャッシュ {removed}件を削除)")
+
+    def enrich_batch(self, batch_data):
+        """
+        バッチ内の各行のISBN / JANで書誌情報をまとめて取得し、空の列を補います。補った行数を返します。
+        問い合わせに失敗した行は、次回の差分処理で書誌情報を補って作り直せるよう、入力のハッシュに印を付けて記録します。
+        """
+        isbns = {item["row"]: find_isbn(item) for item in batch_data}
+        failed = set()
+        # 見積もり中は問い合わせず、キャッシュにある書誌情報だけで補う
+        metadata = self.enricher.lookup(isbns.values(), self._stop_event, cache_only=self._estimating, failed=failed)
+        enriched = 0
+        for item in batch_data:
+            record = metadata.get(isbns[item["row"]])
+            if record:
+                apply_metadata(item, record)
+                enriched += 1
+            elif isbns[item["row"]] in failed:
+                self._mark_enrichment_pending([item])
+        self._count("rows_enriched", enriched)
+        return enriched
+
+    @staticmethod
+    def _mark_enrichment_pending(batch_data):
+        """
+        書き込み後に記録する入力のハッシュに、書誌情報を補えなかった印を付けます。
+        (ハッシュを記録しないと、差分処理は出力済みの行を処理済みとみなすため、印の付いたハッシュは次回の入力と一致させない)
+        """
+        for item in batch_data:
+            if item.get("input_hash"):
+                item["input_hash"] += ENRICHMENT_PENDING_SUFFIX
+
+    def log_cache_stats(self):
+        if not self.translation_cache:
+            return
+        stats = self.translation_cache.stats()
+        self.log(f"🗃️ 翻訳キャッシュ: ヒット {stats['hits']} 件 / ミス {stats['misses']} 件 (ヒット率 {stats['hit_rate']:.1%})")
+
+    def _stage(self, name, rows=0):
+        """実行中であれば name 段の処理時間を計測するコンテキストマネージャーを返します。"""
+        return self.metrics.stage(name, rows) if self.metrics else nullcontext()
+
+    def _record_stage(self, name, started, rows=0):
+        if self.metrics:
+            self.metrics.record_stage(name, time.perf_counter() - started, rows)
+
+    def _count(self, name, amount=1):
+        if self.metrics:
+            self.metrics.increment(name, amount)
+
+    def _start_metrics(self, mode, job_key):
+        self.metrics = RunMetrics(mode, job_key, self.model_prices)
+        if self.metrics_port is not None and self._metrics_server is None:
+            self._metrics_server = MetricsServer(
+                self.metrics_port, lambda: (self.metrics or self.last_metrics).to_prometheus(), host=self.metrics_host
+            )
+            self.log(f"📈 メトリクスを http://{self.metrics_host}:{self._metrics_server.port}/metrics で公開しています。")
+        # キャッシュとリトライの件数は累計なので、開始時点の値を差し引いて今回の分を求める
+        return self._metrics_snapshot()
+
+    def _metrics_snapshot(self):
+        snapshot = {
+            "retries_openai": self.openai_caller.retries,
+            "retries_sheets": self.sheets_caller.retries,
+            "breaker_trips_openai": self.openai_caller.breaker.trips,
+            "breaker_trips_sheets": self.sheets_caller.breaker.trips,
+        }
+        if self.translation_cache:
+            stats = self.translation_cache.stats()
+            snapshot.update(cache_hits=stats["hits"], cache_misses=stats["misses"])
+        return snapshot
+
+    def _finish_metrics(self, totals, baseline):
+        """計測を締めくくり、実行レポート(JSON)と Prometheus 形式のファイルを書き出します。"""
+        metrics, current = self.metrics, self._metrics_snapshot()
+        delta = {key: value - baseline.get(key, 0) for key, value in current.items()}
+        cache = {}
+        if "cache_hits" in delta:
+            lookups = delta["cache_hits"] + delta["cache_misses"]
+            cache = {"hits": delta["cache_hits"], "misses": delta["cache_misses"],
+                     "hit_rate": round(delta["cache_hits"] / lookups, 4) if lookups else 0.0}
+        retries = {
+            backend: {"retries": delta[f"retries_{backend}"], "breaker_trips": delta[f"breaker_trips_{backend}"]}
+            for backend in ("openai", "sheets")
+        }
+        metrics.finish(totals, cache, retries)
+        self.last_metrics, self.metrics = metrics, None
+
+        report = metrics.report()
+        per_row = report["cost_usd"]["per_row"]
+        self.log(
+            f"💰 トークン: 入力 {report['tokens']['prompt']} / 出力 {report['tokens']['completion']} "
+            f"(推定コスト ${report['cost_usd']['total']:.4f}" + (f", 1行あたり ${per_row:.6f})" if per_row else ")")
+        )
+        try:
+            if self.metrics_report_dir:
+                path = os.path.join(self.metrics_report_dir, f"{datetime.now():%Y%m%d_%H%M%S_%f}_{metrics.mode}.json")
+                metrics.write_json(path)
+                self.log(f"📈 実行レポートを保存しました: {path}")
+                prune_reports(self.metrics_report_dir, self.metrics_report_keep, self.metrics_report_max_age_days)
+            if self.prometheus_file:
+                metrics.write_prometheus(self.prometheus_file)
+        except OSError as e:
+            self.log(f"⚠️ 実行レポートの保存に失敗しました: {e}")
+
     def column_letter_to_number(self, column_letter):
         column_letter = column_letter.upper()
         result = 0
@@ -55,166 +467,874 @@ class DescriptionGeneratorCore:
             result = result * 26 + (ord(char) - ord('A') + 1)
         return result
     
-    def translate_text(self, text, context=""):
+    def translate_text(self, text, context="", title=None, route=None):
         """
         OpenAI APIを使用してテキストを翻訳します。
+        chunk_token_budget を超える長文は translate_chunks で分けて翻訳します (title は各チャンクに渡す商品名)。
+        モデル・max_tokens・temperature は振り分けの規則で決まります。route を指定するとそのモデルで翻訳します。
         """
         if not text or not text.strip():
             return ""
         
+        normalized = self._normalize_locally(text, context)
+        if normalized is not None:
+            return normalized
+
+        cached = self._get_cached_translation(text, context)
+        if cached is not None:
+            return cached
+        reused = self._reuse_near_duplicate(text, context)
+        if reused is not None:
+            return reused
+        if self.translation_collector is not None:
+            self.translation_collector(text, context)
+            return text
+
         try:
-            self.log(f"🔄 翻訳を開始 ({context}): {text[:30]}...")
-            time.sleep(self.translation_delay)
-            
-            system_prompt = f"You are a professional translator. Convert the following Japanese text into natural, fluent English. This text is a {context if context else 'product description'}. Return only the translated text itself, without any additional comments or explanations."
-            
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Please translate this into English: {text}"}
-                ],
-                temperature=0.2,
-                max_tokens=1500
-            )
-            
-            result = response["choices"][0]["message"]["content"].strip()
+            route = route or self._route(text, context)
+            if self.is_long_text(text):
+                result, model = self.translate_chunks(text, context, title, route)
+            else:
+                self.log(f"🔄 翻訳を開始 ({context}): {text[:30]}...")
+                system_prompt = TRANSLATION_SYSTEM_PROMPT.format(context=context if context else 'product description')
+                user_prompt = TRANSLATION_USER_PROMPT.format(text=text)
+                result, model = self._request_translation(
+                    system_prompt, user_prompt, route, check=lambda output: check_translation(text, output)
+                )
             self.log(f"✅ 翻訳完了 ({context}): {result[:30]}...")
+            self._store_translation(text, context, result, model)
             return result
             
+        except ProcessingCancelled:
+            raise
         except Exception as e:
             self.log(f"❌ 翻訳中にエラーが発生 ({context} - {text[:20]}...): {e}")
-            time.sleep(2)
-            return f"Error: Translation failed. Original text: {text}"
+            raise TranslationError(f"{context}: {e}") from e
+
+    def translate_fields(self, fields, max_tokens=None, errors=None):
+        """
+        複数の項目を1回のリクエスト(JSON出力)でまとめて翻訳します。
+        fields は {キー: (原文, コンテキスト)} の辞書で、{キー: 翻訳結果} を返します。
+        応答に含まれなかった項目は translate_text で個別に翻訳し直します。
+        errors に辞書を渡すと、翻訳できなかった項目は例外を送出せず errors に記録します。
+        """
+        results, pending = {}, {}
+
+        def translate_single(key, text, context, route=None):
+            try:
+                results[key] = self.translate_text(text, context, route=route)
+            except TranslationError as e:
+                if errors is None:
+                    raise
+                errors[key] = e
+
+        for key, (text, context) in fields.items():
+            if not text or not text.strip():
+                results[key] = ""
+                continue
+            normalized = self._normalize_locally(text, context)
+            if normalized is not None:
+                results[key] = normalized
+                continue
+            cached = self._get_cached_translation(text, context)
+            if cached is None:
+                cached = self._reuse_near_duplicate(text, context)
+            if cached is not None:
+                results[key] = cached
+            else:
+                pending[key] = (text, context)
+
+        if self.translation_collector is not None:
+            for key, (text, context) in pending.items():
+                self.translation_collector(text, context)
+                results[key] = text
+            return results
+
+        if len(pending) == 1:
+            key, (text, context) = next(iter(pending.items()))
+            translate_single(key, text, context)
+            return results
+
+        if pending:
+            translated = {}
+            try:
+                self.log(f"🔄 {len(pending)}項目を一括翻訳します: {', '.join(pending)}")
+                payload = {key: {"context": context, "text": text} for key, (text, context) in pending.items()}
+                user_prompt = json.dumps(payload, ensure_ascii=False)
+                route = self._combined_route([self._route(text, context) for text, context in pending.values()])
+                content, model = self._request_translation(
+                    MULTI_FIELD_SYSTEM_PROMPT, user_prompt, route,
+                    max_tokens=max_tokens, response_format={"type": "json_object"}
+                )
+                translated = json.loads(content)
+                if not isinstance(translated, dict):
+                    raise ValueError("応答がJSONオブジェクトではありません")
+            except ProcessingCancelled:
+                raise
+            except Exception as e:
+                self.log(f"⚠️ 一括翻訳に失敗したため、項目ごとに翻訳します: {e}")
+                translated = {}
+
+            for key, (text, context) in pending.items():
+                value = translated.get(key)
+                problem = check_translation(text, value) if isinstance(value, str) and self.routing is not None else None
+                if problem and self.routing.can_escalate(route):
+                    self._count("escalations")
+                    self.log(f"⤴️ '{key}' の翻訳に不備があるため ({problem})、{self.routing.escalation_model} で翻訳し直します。")
+                    translate_single(key, text, context, self.routing.escalate(route))
+                elif isinstance(value, str) and value.strip():
+                    results[key] = value.strip()
+                    self._store_translation(text, context, results[key], model)
+                else:
+                    if translated:
+                        self.log(f"⚠️ 一括翻訳の応答に '{key}' がありません。個別に翻訳します。")
+                    translate_single(key, text, context)
+            self.log(f"✅ 一括翻訳完了: {len(pending)}項目")
+        return results
+
+    def output_max_tokens(self, user_prompt):
+        """翻訳の1リクエストの max_tokens。英訳は原文より長くなることが多いため、入力の2倍 + JSONの余白を確保します。"""
+        return max(1500, min(MAX_COMPLETION_TOKENS, estimate_tokens(user_prompt, self.translation_model) * 2 + 200))
+
+    def _route(self, text, context):
+        """text の翻訳に使う Route。振り分けが無効な場合は常に translation_model です。"""
+        if self.routing is None:
+            return Route(self.translation_model)
+        return self.routing.route(context, estimate_tokens(text, self.translation_model))
+
+    def _combined_route(self, routes):
+        """
+        複数の項目をまとめて翻訳する1回のリクエストの Route。
+        モデルが1つにそろわない場合は上位のモデルを使い、max_tokens は各項目の上限の合計 + JSONの余白にします。
+        """
+        models = {route.model for route in routes}
+        model = models.pop() if len(models) == 1 else self.routing.escalation_model
+        max_tokens = None
+        if all(route.max_tokens for route in routes):
+            max_tokens = sum(route.max_tokens for route in routes) + 20 * len(routes) + 50
+        return Route(model, max_tokens, min(route.temperature for route in routes))
+
+    def cache_model(self, text, context):
+        """類似文の索引のキーにするモデル (振り分けで text に使われるモデル)。"""
+        return self._route(text, context).model
+
+    def cache_models(self, text, context):
+        """
+        翻訳キャッシュを探すモデルを優先順に返します。キャッシュは実際に翻訳したモデルをキーに保存するため、
+        振り分けで text に使われるモデルで見つからなければ、上位のモデル (まとめ翻訳・やり直しで使われる) と
+        translation_model (一括モードで使われる) の翻訳を使います。
+        """
+        models = [self.cache_model(text, context)]
+        upper = self.routing.escalation_model if self.routing is not None else self.translation_model
+        for model in (upper, self.translation_model):
+            if model not in models:
+                models.append(model)
+        return models
+
+    def _request_translation(self, system_prompt, user_prompt, route, check=None, max_tokens=None, response_format=None):
+        """
+        route のモデル・max_tokens・temperature で翻訳をリクエストし、(応答本文, 実際に使ったモデル) を返します。
+        max_tokens は route.max_tokens → 引数 → 入力の長さから決めた値の順で使います。
+        振り分けが有効な場合、リクエストが失敗したときや check (応答 → 不備の理由 または None) で不備が見つかったときは、
+        上位のモデル (escalation_model) で1回だけやり直します。
+        """
+        can_escalate = self.routing is not None and self.routing.can_escalate(route)
+        try:
+            result = self._request_completion(
+                system_prompt, user_prompt, max_tokens=route.max_tokens or max_tokens or self.output_max_tokens(user_prompt),
+                response_format=response_format, model=route.model, temperature=route.temperature
+            )
+            problem = check(result) if check else None
+        except ProcessingCancelled:
+            raise
+        except Exception as e:
+            if not can_escalate:
+                raise
+            problem = str(e)
+        if not problem or not can_escalate:
+            return result, route.model
+        escalated = self.routing.escalate(route)
+        self._count("escalations")
+        self.log(f"⤴️ {route.model} の応答に不備があるため ({problem})、{escalated.model} でやり直します。")
+        result = self._request_completion(
+            system_prompt, user_prompt, max_tokens=max_tokens or self.output_max_tokens(user_prompt),
+            response_format=response_format, model=escalated.model, temperature=escalated.temperature
+        )
+        return result, escalated.model
+
+    def is_long_text(self, text):
+        return bool(self.chunk_token_budget) and estimate_tokens(text, self.translation_model) > self.chunk_token_budget
+
+    def translate_chunks(self, text, context="", title=None, route=None):
+        """
+        長文を段落・文の区切りで chunk_token_budget 以内のチャンクに分け、並行して翻訳してから元の順序でつなげます。
+        1回の長い逐次生成を避けるため、所要時間は全文ではなく最も長いチャンクの生成時間で決まります。
+        各チャンクは全文の route (省略した場合は振り分けの規則) のモデルで翻訳します。
+        (翻訳結果, モデル) を返します。一部のチャンクを上位のモデルでやり直した場合のモデルは上位のモデルです。
+        """
+        route = route or self._route(text, context)
+        chunks = split_text(text, self.chunk_token_budget, self.translation_model)
+        context = context or "product description"
+        self._count("translations_chunked")
+        self._count("chunks_translated", len(chunks))
+        self.log(f"✂️ 長文を {len(chunks)}個に分けて並行して翻訳します ({context}): {text[:30]}...")
+
+        def translate_chunk(numbered):
+            index, chunk = numbered
+            system_prompt = CHUNK_SYSTEM_PROMPT.format(
+                index=index + 1, count=len(chunks), context=context, title=title or "unknown"
+            )
+            user_prompt = TRANSLATION_USER_PROMPT.format(text=chunk)
+            return self._request_translation(
+                system_prompt, user_prompt, Route(route.model, None, route.temperature),
+                check=lambda output: check_translation(chunk, output)
+            )
+
+        # 翻訳段のワーカーの中から呼ばれるため、ワーカープールとは別のプールで実行する (同じプールで待つとデッドロックする)
+        translated = self._run_concurrently(
+            translate_chunk, [(index, chunk) for index, (chunk, _) in enumerate(chunks)], executor=self._chunk_executor
+        )
+        models = {model for _, model in translated}
+        model = models.pop() if len(models) == 1 else self.routing.escalation_model
+        return "".join(part + joiner for (part, _), (_, joiner) in zip(translated, chunks)).strip(), model
+
+    def translate_packed(self, texts, context="product description", errors=None, titles=None):
+        """
+        複数行のテキストをトークン予算内でまとめ、少ないリクエスト数で翻訳します。
+        texts は {行番号: 原文} の辞書で、{行番号: 翻訳結果} を返します。
+        形式が不正だった行は translate_fields 内で個別に再翻訳されます。
+        それでも翻訳できなかった行は errors ({行番号: 例外}) に記録され、結果には含まれません。
+        類似文の再利用が有効な場合、バッチ内に類似の原文がある行は、先に翻訳した行の結果を再利用できるよう後から翻訳します。
+        長文は translate_text でチャンクに分けて翻訳します (titles は {行番号: 商品名} で、各チャンクに渡します)。
+        """
+        titles = titles or {}
+        items = [(f"row_{row}", text) for row, text in texts.items() if text and text.strip()]
+        long_items = [(key, text) for key, text in items if self.is_long_text(text)]
+        if long_items:
+            items = [(key, text) for key, text in items if not self.is_long_text(text)]
+        groups = [items]
+        if self.deduplicator is not None and self.translation_collector is None:
+            groups = self.deduplicator.split_batch(items)
+            if groups[1]:
+                self.log(f"🧬 バッチ内の類似文 {len(groups[1])}行は、先に翻訳する行の結果を再利用して翻訳します。")
+        results = {row: "" for row in texts}
+        pack_errors = {}
+        for group in groups:
+            packs = pack_items(group, self.pack_token_budget, self.translation_model)
+            if packs:
+                self.log(f"📦 {len(group)}行の翻訳を {len(packs)}件のリクエストにまとめます。")
+            translated_packs = self._run_concurrently(
+                lambda pack: self.translate_fields({key: (text, context) for key, text in pack}, errors=pack_errors), packs
+            )
+            for translated in translated_packs:
+                for key, value in translated.items():
+                    results[int(key[len("row_"):])] = value
+        translated_long = self._run_concurrently(self._capture_errors(
+            lambda item: self.translate_text(item[1], context, title=titles.get(int(item[0][len("row_"):])))
+        ), long_items)
+        for (key, _), translated in zip(long_items, translated_long):
+            if isinstance(translated, TranslationError):
+                pack_errors[key] = translated
+            else:
+                results[int(key[len("row_"):])] = translated
+        for key, error in pack_errors.items():
+            row = int(key[len("row_"):])
+            results.pop(row, None)
+            if errors is None:
+                raise error
+            errors[row] = error
+        return results
+
+    def _get_rate_limiter(self, model=None):
+        """
+        model のリクエストに使うリミッター。振り分けの rate_limits で別枠にしたモデル以外は、
+        translation_model と同じリミッター (ジョブキュー・シャードでは共有のもの) を使います。
+        別枠のリミッターは rate_limiter_factory で作ります。
+        """
+        limits = self.routing.rate_limits.get(model) if self.routing is not None and model != self.translation_model else None
+        with self._rate_limiter_lock:
+            if limits:
+                if model not in self.model_rate_limiters:
+                    requests_per_minute, tokens_per_minute = limits.get("requests_per_minute", 0), limits.get("tokens_per_minute", 0)
+                    if self.rate_limiter_factory is not None:
+                        limiter = self.rate_limiter_factory(model, requests_per_minute, tokens_per_minute)
+                    else:
+                        limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+                    # ジョブキューでは辞書を複数の processor で共有するため、先に作られたものを優先する
+                    self.model_rate_limiters.setdefault(model, limiter)
+                return self.model_rate_limiters[model]
+            if self.rate_limiter is None:
+                self.rate_limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+            return self.rate_limiter
+
+    def _capture_errors(self, func):
+        """func が送出した TranslationError を、例外ではなく戻り値として返すようにします。"""
+        def wrapper(item):
+            try:
+                return func(item)
+            except TranslationError as e:
+                return e
+        return wrapper
+
+    def _run_concurrently(self, func, items, executor=None):
+        """
+        items の各要素に func をワーカープール (executor を省略した場合は翻訳段のプール) で並行適用し、入力と同じ順序で結果を返します。
+        中断された場合は未着手のタスクを取り消して ProcessingCancelled を送出します。
+        """
+        executor = executor or self._executor
+        if executor is None or len(items) <= 1:
+            results = []
+            for item in items:
+                if self.stop_flag: raise ProcessingCancelled()
+                results.append(func(item))
+            return results
+
+        futures = [executor.submit(func, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _request_completion(self, system_prompt, user_prompt, max_tokens=1500, response_format=None, model=None, temperature=0.2):
+        """
+        completion_backend で文章を生成し、応答本文を返します。レート制限の枠が空くまで待機します。
+        レート制限・一時的なエラーは openai_caller がバックオフしながらリトライします。
+        応答が max_tokens で打ち切られた (finish_reason が length) 場合は、MAX_COMPLETION_TOKENS まで max_tokens を倍にして再送し、
+        それでも打ち切られる場合は TruncatedCompletionError を送出します (途中までの訳を黙って使わないため)。
+        model を省略すると translation_model を使います。
+        """
+        model = model or self.translation_model
+        prompt_tokens = estimate_tokens(system_prompt + user_prompt, model)
+
+        def send():
+            # OpenAIのTPM制限は max_tokens も含めて計上されるため、同じ基準で枠を確保する
+            tokens = prompt_tokens + max_tokens
+            if not self._estimating:
+                self._get_rate_limiter(model).acquire(
+                    tokens, self._stop_event, client=self.rate_limit_client, weight=self.rate_limit_weight
+                )
+            return self.completion_backend.complete(
+                model,
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=self.request_timeout,
+                response_format=response_format
+            )
+
+        while True:
+            completion = self.openai_caller.call(send, "ChatCompletion", self._stop_event)
+            if self.metrics:
+                self.metrics.record_completion(model, completion.prompt_tokens, completion.completion_tokens)
+            if completion.finish_reason != "length":
+                return completion.content.strip()
+            if max_tokens >= MAX_COMPLETION_TOKENS:
+                raise TruncatedCompletionError(f"応答が max_tokens ({max_tokens}) で打ち切られました")
+            self._count("truncated_retries")
+            self.log(f"✂️ 応答が max_tokens ({max_tokens}) で打ち切られたため、上限を増やして再送します。")
+            max_tokens = min(MAX_COMPLETION_TOKENS, max_tokens * 2)
+
+    def _normalize_locally(self, text, context):
+        """日付・言語・ページ数などはルールで変換できればLLMを呼ばずに済ませます。"""
+        if not self.local_normalization:
+            return None
+        normalized = normalize_field(text, context)
+        if normalized is not None:
+            self._count("translations_normalized")
+            self.log(f"🧮 ルールで変換 ({context}): {text[:30]} → {normalized}")
+        return normalized
+
+    def _get_cached_translation(self, text, context):
+        if self._estimating and (text, context) in self._estimated_translations:
+            # ドライランでは、同じ原文の2回目以降は実際の処理と同じくキャッシュから取得したものとして数える
+            self._count("translations_from_cache")
+            return self._estimated_translations[(text, context)]
+        if self._journal_job_key:
+            journaled = self.journal.get_translation(self._journal_job_key, text, context)
+            if journaled is not None:
+                self._count("translations_from_journal")
+                self.log(f"📒 ジャーナルから翻訳を取得 ({context}): {journaled[:30]}...")
+                return journaled
+        if not self.translation_cache:
+            return None
+        cached = self.translation_cache.get(
+            text, context, self.cache_models(text, context), self.prompt_version, peek=self._estimating
+        )
+        if cached is not None:
+            self._count("translations_from_cache")
+            self.log(f"♻️ キャッシュから翻訳を取得 ({context}): {cached[:30]}...")
+        return cached
+
+    def _store_translation(self, text, context, result, model):
+        """API で翻訳した結果を記録します。model は実際に翻訳したモデルで、翻訳キャッシュのキーになります。"""
+        self._count("translations_from_api")
+        self._remember_translation(text, context, result, model)
+        if self.deduplicator is not None and not self._estimating:
+            self.deduplicator.add(text, context, self.cache_model(text, context), self.prompt_version, result)
+
+    def _remember_translation(self, text, context, result, model):
+        if self._estimating:
+            self._estimated_translations[(text, context)] = result
+            return
+        if self._journal_job_key:
+            self.journal.record_translation(self._journal_job_key, text, context, result)
+        if self.translation_cache:
+            self.translation_cache.set(text, context, model, self.prompt_version, result)
+
+    def _reuse_near_duplicate(self, text, context):
+        """
+        索引に類似の原文があれば、その翻訳を再利用 (違いが空白だけの場合) または違う語句だけ差し替えて返します。
+        差し替える語句の英訳が元の翻訳に見つからない場合などは None を返し、通常どおり翻訳します。
+        一括モードの収集中は使いません (収集した原文はまとめて翻訳されるため)。
+        """
+        if self.deduplicator is None or self.translation_collector is not None or not self.deduplicator.applies(text):
+            return None
+        match = self.deduplicator.find(text, context, self.cache_model(text, context), self.prompt_version)
+        if match is None:
+            return None
+        replacements = []
+        try:
+            for old, new in match.segments:
+                # 日本語を含まない語句 (サイズ・型番など) は英訳にもそのまま現れるため、翻訳せずに差し替える
+                replacements.append((
+                    old if is_verbatim(old) else self.translate_text(old, PATCH_CONTEXT),
+                    new if is_verbatim(new) else self.translate_text(new, PATCH_CONTEXT),
+                    is_verbatim(old)
+                ))
+        except TranslationError as e:
+            self.log(f"⚠️ 類似文の差し替える語句を翻訳できなかったため、全文を翻訳します: {e}")
+            return None
+        result = apply_replacements(match.translation, replacements)
+        if result is None:
+            self._count("dedup_patch_failed")
+            self.log(f"⚠️ 類似文の翻訳に差し替える語句が見つからないため、全文を翻訳します ({context}): {text[:30]}...")
+            return None
+        action = "patch" if match.segments else "reuse"
+        self._count("translations_patched" if match.segments else "translations_reused")
+        if not self._estimating:
+            self.deduplicator.index.record(
+                self._journal_job_key, context, action, round(match.similarity, 4), text, match.source, result,
+                [[old, new] for old, new in match.segments]
+            )
+        changes = ", ".join(f"{old}→{new}" for old, new in match.segments)
+        self.log(f"🧬 類似文の翻訳を{'修正して' if match.segments else ''}再利用 ({context}, 類似度 {match.similarity:.2f}){': ' + changes if changes else ''}")
+        # 差し替えた翻訳は、類似文の索引と同じく振り分けのモデルのキーで保存する
+        self._remember_translation(text, context, result, self.cache_model(text, context))
+        return result
 
     # --- 共通処理ループ ---
-    def _processing_loop(self, spreadsheet_id, sheet_name, column_settings, start_row, data_fetcher, batch_processor):
+    def _processing_loop(self, mode, spreadsheet_id, sheet_name, column_settings, start_row, data_fetcher, batch_processor, trigger_col, output_col, resume=False, end_row=None):
         """
         両方のモードで共通の処理ループ。
+        読み込み・翻訳(HTML生成)・書き込みの3段をキューでつなぎ、別スレッドで並行して実行します。
+        キューの長さは prefetch_batches で制限され、遅い段に合わせて前段が待機します。
+        読み込み段は最初にトリガー列の索引を作り、値のある行のデータだけを取得します。
+        incremental が有効な場合は、入力が前回から変わっていない出力済みの行をスキップします。
+        進捗はジャーナルに記録され、resume=True の場合は前回の中断地点から再開します。
+        end_row を指定すると start_row から end_row までの行だけを処理します (シャード実行用)。
+        段ごとの処理時間・トークン数などは metrics に集計し、終了時に実行レポートとして保存します。
+        {"success": 成功件数, "failed": 失敗件数} を返します。
         """
         self.stop_flag = False
+        self.load_templates()
+        job_key = self._job_key(spreadsheet_id, sheet_name, mode)
+        # 範囲を指定した実行 (シャード) は、範囲ごとに別の進捗としてジャーナルに記録する
+        journal_key = job_key if end_row is None else f"{job_key}:{start_row}-{end_row}"
+        if self.incremental and self.row_hash_store is None:
+            self.row_hash_store = RowHashStore()
+        if self.journal is None:
+            self.journal = ProgressJournal()
+        skip_rows, pending_outputs = set(), []
+        previous_run = self.journal.get_run(journal_key) if resume else None
+        if previous_run:
+            start_row = previous_run["start_row"]
+            skip_rows = self.journal.written_rows(journal_key)
+            pending_outputs = self.journal.pending_outputs(journal_key)
+            skip_rows.update(result["row"] for result in pending_outputs)
+            self.log(f"📒 前回の中断地点から再開します: 書き込み済み {len(skip_rows) - len(pending_outputs)} 行 / 未書き込み {len(pending_outputs)} 行")
+        self.journal.begin(journal_key, start_row, column_settings, resume=resume)
+        self._journal_job_key = journal_key
+        metrics_baseline = self._start_metrics(mode, journal_key)
+        self.progress = ProgressTracker(self.progress_callback)
+        self.progress.add_total(len(pending_outputs))
+        completed = False
         start_time = time.time()
-        current_row = start_row
-        total_success, total_failed = 0, 0
-        consecutive_empty_batches = 0
+        totals = {"success": 0, "failed": 0}
+        fetch_queue = queue.Queue(maxsize=self.prefetch_batches)
+        write_queue = queue.Queue(maxsize=self.prefetch_batches)
+        pipeline_done = threading.Event()
+        if self.max_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="desgen-translate")
+            self._chunk_executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="desgen-chunk")
+        writer = SheetWriter(
+            self.sheets_backend, spreadsheet_id, sheet_name,
+            flush_rows=self.write_flush_rows, flush_interval=self.write_flush_interval, log=self.log,
+            caller=self.sheets_caller, throttle=self._throttle_sheets, cell_limit=self.cell_limit
+        )
+        stage_threads = []
+        read_queue = fetch_queue
+        if self.enricher is not None:
+            # 書誌情報の取得は、読み込み段と翻訳段の間の別スレッドで行う
+            read_queue = queue.Queue(maxsize=self.prefetch_batches)
+            stage_threads.append(threading.Thread(
+                target=self._enrich_stage, name="desgen-enrich", daemon=True,
+                args=(read_queue, fetch_queue, pipeline_done)
+            ))
+        reader_thread = threading.Thread(
+            target=self._reader_stage, name="desgen-reader", daemon=True,
+            args=(read_queue, pipeline_done, job_key, spreadsheet_id, sheet_name, column_settings, start_row, end_row, trigger_col, data_fetcher, skip_rows)
+        )
+        writer_thread = threading.Thread(
+            target=self._writer_stage, name="desgen-writer", daemon=True,
+            args=(write_queue, writer, job_key, journal_key, output_col, totals)
+        )
+        reader_thread.start()
+        for thread in stage_threads:
+            thread.start()
+        writer_thread.start()
 
-        while not self.stop_flag:
-            batch_data = data_fetcher(spreadsheet_id, sheet_name, current_row, self.batch_size, column_settings)
-            
-            if not batch_data:
-                consecutive_empty_batches += 1
-                self.log(f"INFO: 有効なデータが見つかりませんでした。({consecutive_empty_batches}/3)")
-                if consecutive_empty_batches >= 3:
-                    self.log("🛑 3回連続で有効なデータがなかったため、処理を自動終了します。")
+        try:
+            if pending_outputs:
+                # 翻訳済みで未書き込みだった結果は、OpenAIを呼ばずにそのまま書き込む
+                write_queue.put(pending_outputs)
+            while not self.stop_flag:
+                try:
+                    batch_data = fetch_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if batch_data is _END_OF_STREAM:
+                    completed = True
                     break
-                current_row += self.batch_size
-                continue
-            
-            consecutive_empty_batches = 0
-            results = batch_processor(batch_data, spreadsheet_id, sheet_name, column_settings)
-            
-            batch_success = sum(1 for r in results if r == "success")
-            total_success += batch_success
-            total_failed += len(results) - batch_success
-            
-            current_row += self.batch_size
-            
-            if not self.stop_flag and batch_data:
-                self.log(f"⏳ 次のバッチ処理まで {self.batch_delay}秒 待機します...")
-                time.sleep(self.batch_delay)
+                if isinstance(batch_data, dict):
+                    # 読み込みに失敗したバッチは、全行を失敗として集計する
+                    write_queue.put([{"row": row, "error": batch_data["error"]} for row in batch_data["failed_rows"]])
+                    continue
+                results = batch_processor(batch_data, spreadsheet_id, sheet_name, column_settings)
+                # 書き込み前にジャーナルへ記録しておく (先行書き込み)
+                self.journal.record_rendered(journal_key, results)
+                write_queue.put(results)
+        finally:
+            pipeline_done.set()
+            for executor in (self._executor, self._chunk_executor):
+                if executor is not None:
+                    # 未着手のタスクは取り消し、実行中のリクエストの完了は待たない
+                    executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._chunk_executor = None
+            # 中断された場合も、生成済みのHTMLは書き込んでから終了する
+            write_queue.put(_END_OF_STREAM)
+            writer_thread.join()
+            self._journal_job_key = None
+
+        self.progress.finish()
+        if completed and not self.stop_flag:
+            remaining = self.journal.finish(journal_key)
+            if remaining:
+                self.log(f"📒 書き込みに失敗した {remaining} 行はジャーナルに残しました。再開時に書き込みます。")
+        else:
+            self.log("📒 進捗をジャーナルに保存しました。「前回の続きから再開」で再開できます。")
 
         total_duration = time.time() - start_time
         self.log("\n" + "="*60 + "\n🎉 全ての処理が完了しました。\n" + "="*60)
-        self.log(f"✅ 成功件数: {total_success} 件")
-        self.log(f"❌ 失敗件数: {total_failed} 件")
+        self.log(f"✅ 成功件数: {totals['success']} 件")
+        self.log(f"❌ 失敗件数: {totals['failed']} 件")
         self.log(f"⏱️  総処理時間: {total_duration:.1f} 秒")
+        self.log_cache_stats()
+        self._finish_metrics(totals, metrics_baseline)
+        return totals
+
+    def _reader_stage(self, fetch_queue, pipeline_done, job_key, spreadsheet_id, sheet_name, column_settings, start_row, end_row, trigger_col, data_fetcher, skip_rows):
+        """読み込み段: トリガー行の索引を作り、バッチごとにデータを取得してキューに積みます。"""
+        index_started = time.perf_counter()
+        try:
+            trigger_rows = self.build_trigger_index(spreadsheet_id, sheet_name, trigger_col, start_row, end_row)
+            self._record_stage("index", index_started, len(trigger_rows))
+        except Exception as e:
+            self.log(f"❌ トリガー列の読み込み中にエラーが発生しました: {e}")
+            trigger_rows = []
+        if skip_rows:
+            # ジャーナル上で処理済みの行は読み込まない
+            trigger_rows = [row for row in trigger_rows if row not in skip_rows]
+        if self.row_filter is not None:
+            trigger_rows = self._filter_planned_rows(trigger_rows)
+        self.progress.add_total(len(trigger_rows))
+
+        for i in range(0, len(trigger_rows), self.batch_size):
+            if self.stop_flag or pipeline_done.is_set():
+                return
+            batch_rows = trigger_rows[i:i + self.batch_size]
+            try:
+                with self._stage("fetch", len(batch_rows)):
+                    batch_data = data_fetcher(spreadsheet_id, sheet_name, batch_rows, column_settings)
+                    # 索引作成後にトリガーが消された行は処理済みとして数える
+                    self.progress.record(skipped=len(batch_rows) - len(batch_data))
+                    if self.incremental:
+                        batch_data = self._select_changed_rows(job_key, batch_data)
+            except ProcessingCancelled:
+                return
+            except Exception as e:
+                self.log(f"❌ {batch_rows[0]}-{batch_rows[-1]}行目のデータ取得に失敗しました: {e}")
+                batch_data = {"failed_rows": batch_rows, "error": str(e)}
+            # キューが満杯の間は待機する
+            if batch_data and not self._put_until_done(fetch_queue, batch_data, pipeline_done):
+                return
+        self._put_until_done(fetch_queue, _END_OF_STREAM, pipeline_done)
+
+    def _enrich_stage(self, read_queue, fetch_queue, pipeline_done):
+        """書誌情報段: 読み込んだバッチの書誌情報を取得して空の列を補い、翻訳段のキューに渡します。"""
+        while not (self.stop_flag or pipeline_done.is_set()):
+            try:
+                batch_data = read_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if batch_data is not _END_OF_STREAM and not isinstance(batch_data, dict):
+                try:
+                    with self._stage("enrich", len(batch_data)):
+                        self.enrich_batch(batch_data)
+                except ProcessingCancelled:
+                    return
+                except Exception as e:
+                    # 書誌情報が取れなくても、入力済みの値で処理を続ける (次回の差分処理で補って作り直す)
+                    self.log(f"⚠️ 書誌情報を取得できませんでした (入力済みの値で処理します): {e}")
+                    self._mark_enrichment_pending(batch_data)
+            if not self._put_until_done(fetch_queue, batch_data, pipeline_done) or batch_data is _END_OF_STREAM:
+                return
+
+    def _writer_stage(self, write_queue, writer, job_key, journal_key, output_col, totals):
+        """
+        書き込み段: 生成結果を SheetWriter にため、条件を満たしたらまとめて書き込みます。
+        この段が止まると前段がキューへの追加で待ち続けるため、エラーは記録して _END_OF_STREAM までキューを読み続けます。
+        """
+        pending_hashes = {}
+
+        def record(succeeded, failed):
+            totals["success"] += len(succeeded)
+            totals["failed"] += len(failed)
+            self.progress.record(success=len(succeeded), failed=len(failed))
+            # 書き込みに成功した行だけ入力ハッシュを記録する
+            written = [(row, pending_hashes.pop(row)) for row in succeeded if row in pending_hashes]
+            for row in failed:
+                pending_hashes.pop(row, None)
+            try:
+                if succeeded:
+                    self.journal.mark_written(journal_key, succeeded)
+                if written and self.row_hash_store is not None:
+                    self.row_hash_store.set_many(job_key, written)
+            except Exception as e:
+                # シートには書き込めているため成功として数える (ジャーナルに残った行は再開時にもう一度書き込む)
+                self.log(f"⚠️ 書き込んだ {len(succeeded)}行の進捗を記録できませんでした: {e}")
+
+        def flush_and_record():
+            if not writer.pending:
+                return
+            rows = [row for row, _, _ in writer.pending]
+            try:
+                with self._stage("write", len(rows)):
+                    succeeded, failed = writer.flush()
+            except Exception as e:
+                self.log(f"❌ {len(rows)}行の書き込み中にエラーが発生しました: {e}")
+                writer.pending = []
+                succeeded, failed = [], {row: str(e) for row in rows}
+            record(succeeded, failed)
+
+        while True:
+            try:
+                results = write_queue.get(timeout=1.0)
+            except queue.Empty:
+                # 新しい結果がなくても、書き込み間隔を過ぎていれば書き込む
+                results = []
+            if results is _END_OF_STREAM:
+                break
+            for result in results:
+                if "output" in result:
+                    writer.add(result["row"], output_col, result["output"])
+                    if result.get("input_hash"):
+                        pending_hashes[result["row"]] = result["input_hash"]
+                else:
+                    totals["failed"] += 1
+                    self.progress.record(failed=1)
+            if writer.is_due():
+                flush_and_record()
+
+        flush_and_record()
+
+    def _select_changed_rows(self, job_key, batch_data):
+        """
+        差分処理: 出力が空の行と、前回の出力時から入力が変わった行だけを返します。
+        出力済みでハッシュの記録がない行は、現在の入力で出力済みとみなして記録します (見積もり中は記録しません)。
+        """
+        stored = self.row_hash_store.get_many(job_key, [item['row'] for item in batch_data])
+        selected, adopted = [], []
+        for item in batch_data:
+            if not item.get('existing_output'):
+                selected.append(item)
+            elif item['row'] not in stored:
+                adopted.append((item['row'], item['input_hash']))
+            elif stored[item['row']] != item['input_hash']:
+                if stored[item['row']].endswith(ENRICHMENT_PENDING_SUFFIX):
+                    self.log(f"🔁 {item['row']}行目は前回書誌情報を補えなかったため再生成します。")
+                else:
+                    self.log(f"🔁 {item['row']}行目は入力が変更されたため再生成します。")
+                selected.append(item)
+        if adopted and not self._estimating:
+            self.row_hash_store.set_many(job_key, adopted)
+        skipped = len(batch_data) - len(selected)
+        self.progress.record(skipped=skipped)
+        if skipped:
+            self.log(f"⏭️ 出力済みで変更のない {skipped} 行をスキップしました。")
+        return selected
+
+    @staticmethod
+    def _job_key(spreadsheet_id, sheet_name, mode):
+        return f"{spreadsheet_id}:{sheet_name}:{mode}"
+
+    def _put_until_done(self, target_queue, item, pipeline_done):
+        """キューに空きができるまで待って item を積みます。処理が終了・中断された場合は False を返します。"""
+        while not self.stop_flag and not pipeline_done.is_set():
+            try:
+                target_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
     
     # --- 通常モード ---
-    def process_product_descriptions(self, spreadsheet_id, sheet_name, column_settings, start_row=2):
+    def process_product_descriptions(self, spreadsheet_id, sheet_name, column_settings, start_row=2, resume=False, end_row=None):
         self.log("="*60 + "\n🚀 [通常モード] 商品説明の生成処理を開始します。\n" + "="*60)
-        self._processing_loop(
-            spreadsheet_id, sheet_name, column_settings, start_row,
-            self.get_normal_mode_batch_data, self.process_normal_mode_batch
+        return self._processing_loop(
+            "normal", spreadsheet_id, sheet_name, column_settings, start_row,
+            self.get_normal_mode_batch_data, self.process_normal_mode_batch,
+            column_settings['input_col'], column_settings['output_col'], resume=resume, end_row=end_row
         )
 
-    def get_normal_mode_batch_data(self, spreadsheet_id, sheet_name, start_row, batch_size, column_settings):
-        end_row = start_row + batch_size - 1
-        ranges = [
-            f"{sheet_name}!{column_settings['input_col']}{start_row}:{column_settings['input_col']}{end_row}",
-            f"{sheet_name}!{column_settings['translated_name_col']}{start_row}:{column_settings['translated_name_col']}{end_row}",
-            f"{sheet_name}!{column_settings['jan_code_col']}{start_row}:{column_settings['jan_code_col']}{end_row}",
-            f"{sheet_name}!{column_settings['description_col']}{start_row}:{column_settings['description_col']}{end_row}"
+    def get_normal_mode_batch_data(self, spreadsheet_id, sheet_name, rows, column_settings):
+        columns = [
+            ('trigger_value', column_settings['input_col']),
+            ('translated_name', column_settings['translated_name_col']),
+            ('jan_code', column_settings['jan_code_col']),
+            ('description', column_settings['description_col']),
         ]
-        self.log(f"📊 [通常] スプレッドシートからデータを取得します... (行: {start_row}-{end_row})")
-        return self._get_batch_data(spreadsheet_id, ranges, start_row, ['trigger_value', 'translated_name', 'jan_code', 'description'])
+        if self.incremental:
+            columns.append(('existing_output', column_settings['output_col']))
+        self.log(f"📊 [通常] スプレッドシートからデータを取得します... (行: {rows[0]}-{rows[-1]}, {len(rows)}行)")
+        return self._get_rows_data(spreadsheet_id, sheet_name, rows, columns)
 
     def process_normal_mode_batch(self, batch_data, spreadsheet_id, sheet_name, column_settings):
-        sheet = self.client.open_by_key(spreadsheet_id).worksheet(sheet_name)
-        output_col_num = self.column_letter_to_number(column_settings['output_col'])
+        """バッチ内の各行を翻訳してHTMLを生成し、[{'row': 行番号, 'output': HTML}] を返します。"""
         results = []
+        errors = {}
+        try:
+            with self._stage("translate", len(batch_data)):
+                if self.pack_translations:
+                    translations = self.translate_packed(
+                        {item["row"]: item["description"] for item in batch_data}, errors=errors,
+                        titles={item["row"]: item.get("translated_name") for item in batch_data}
+                    )
+                else:
+                    translated_list = self._run_concurrently(self._capture_errors(
+                        lambda item: self.translate_text(item["description"], "product description", title=item.get("translated_name"))
+                    ), batch_data)
+                    translations = {}
+                    for item, translated in zip(batch_data, translated_list):
+                        if isinstance(translated, TranslationError):
+                            errors[item["row"]] = translated
+                        else:
+                            translations[item["row"]] = translated
+        except ProcessingCancelled:
+            self.log("🛑 翻訳を中断しました。")
+            return results
 
+        # 中断が要求されていても、翻訳済みの行はHTMLまで生成してジャーナルに残す
+        render_started = time.perf_counter()
         for i, item in enumerate(batch_data):
-            if self.stop_flag: break
             self.log(f"\n📄 [通常] {i+1}/{len(batch_data)} 件目 (シート {item['row']} 行目)...")
+            if item["row"] in errors:
+                self.log(f"❌ {item['row']}行目は翻訳に失敗したため、出力しません。")
+                results.append({"row": item["row"], "error": str(errors[item["row"]])})
+                continue
             
-            translated_description = self.translate_text(item["description"], "product description")
-            html_content = f"""<p><strong>Product Title:</strong> {item.get('translated_name', 'N/A')}</p>
-<p><strong>JAN Code:</strong> {item.get('jan_code', 'N/A')}</p><br>
-<p><strong>Description:</strong></p><p>{translated_description}</p>"""
-            final_html = self.combine_with_template(html_content)
-            
-            sheet.update_cell(item["row"], output_col_num, final_html)
-            self.log(f"✅ {item['row']}行目の更新完了。")
-            results.append("success")
+            final_html = self.render_description("normal", dict(
+                item, translated_name=item.get('translated_name', 'N/A'), jan_code=item.get('jan_code', 'N/A'),
+                description=translations[item["row"]]
+            ))
+
+            results.append({"row": item["row"], "output": final_html, "input_hash": item.get("input_hash")})
+            self.log(f"✅ {item['row']}行目のHTMLを生成しました。")
+        self._record_stage("render", render_started, len(results))
         return results
 
     # --- 書籍モード ---
-    def process_book_descriptions(self, spreadsheet_id, sheet_name, column_settings, start_row=2):
+    def process_book_descriptions(self, spreadsheet_id, sheet_name, column_settings, start_row=2, resume=False, end_row=None):
         self.log("="*60 + "\n📚 [書籍モード] 商品説明の生成処理を開始します。\n" + "="*60)
-        self._processing_loop(
-            spreadsheet_id, sheet_name, column_settings, start_row,
-            self.get_book_mode_batch_data, self.process_book_mode_batch
+        return self._processing_loop(
+            "book", spreadsheet_id, sheet_name, column_settings, start_row,
+            self.get_book_mode_batch_data, self.process_book_mode_batch,
+            column_settings['trigger'], column_settings['output'], resume=resume, end_row=end_row
         )
 
-    def get_book_mode_batch_data(self, spreadsheet_id, sheet_name, start_row, batch_size, column_settings):
-        end_row = start_row + batch_size - 1
-        # GUIから渡されるキーとスプレッドシートの列をマッピング
-        col_map = {
-            'trigger': 'trigger', 'product_name': 'product_name', 'author': 'author',
-            'publisher': 'publisher', 'release_date': 'release_date', 'language': 'language',
-            'pages': 'pages', 'isbn10': 'isbn10', 'isbn13': 'isbn13', 'dimensions': 'dimensions'
-        }
-        ranges = [f"{sheet_name}!{column_settings[key]}{start_row}:{column_settings[key]}{end_row}" for key in col_map]
-        self.log(f"📊 [書籍] スプレッドシートからデータを取得します... (行: {start_row}-{end_row})")
-        return self._get_batch_data(spreadsheet_id, ranges, start_row, list(col_map.values()))
+    def get_book_mode_batch_data(self, spreadsheet_id, sheet_name, rows, column_settings):
+        # GUIから渡されるキーとスプレッドシートの列をマッピング (先頭はトリガー列)
+        keys = [
+            'trigger', 'product_name', 'author', 'publisher', 'release_date',
+            'language', 'pages', 'isbn10', 'isbn13', 'dimensions'
+        ]
+        columns = [(key, column_settings[key]) for key in keys]
+        if self.incremental:
+            columns.append(('existing_output', column_settings['output']))
+        self.log(f"📊 [書籍] スプレッドシートからデータを取得します... (行: {rows[0]}-{rows[-1]}, {len(rows)}行)")
+        return self._get_rows_data(spreadsheet_id, sheet_name, rows, columns)
 
     def process_book_mode_batch(self, batch_data, spreadsheet_id, sheet_name, column_settings):
-        sheet = self.client.open_by_key(spreadsheet_id).worksheet(sheet_name)
-        output_col_num = self.column_letter_to_number(column_settings['output'])
+        """バッチ内の各行を翻訳してHTMLを生成し、[{'row': 行番号, 'output': HTML}] を返します。"""
         results = []
+        try:
+            # 各行の翻訳をワーカープールで並行して実行 (結果は行の順序どおり)
+            with self._stage("translate", len(batch_data)):
+                translations = self._run_concurrently(self._capture_errors(self._translate_book_item), batch_data)
+        except ProcessingCancelled:
+            self.log("🛑 翻訳を中断しました。")
+            return results
 
-        for i, item in enumerate(batch_data):
-            if self.stop_flag: break
+        # 中断が要求されていても、翻訳済みの行はHTMLまで生成してジャーナルに残す
+        render_started = time.perf_counter()
+        for i, (item, translated) in enumerate(zip(batch_data, translations)):
             self.log(f"\n📖 [書籍] {i+1}/{len(batch_data)} 件目 (シート {item['row']} 行目)...")
+            if isinstance(translated, TranslationError):
+                self.log(f"❌ {item['row']}行目は翻訳に失敗したため、出力しません。")
+                results.append({"row": item["row"], "error": str(translated)})
+                continue
             
-            # 必要な項目を並行して翻訳
-            item['translated_author'] = self.translate_text(item.get('author', ''), 'author name')
-            item['translated_publisher'] = self.translate_text(item.get('publisher', ''), 'publisher name')
-            item['translated_release_date'] = self.translate_text(item.get('release_date', ''), 'date')
-            item['translated_language'] = self.translate_text(item.get('language', ''), 'language')
-            item['translated_pages'] = self.translate_text(item.get('pages', ''), 'page count')
-            
-            html_content = self.generate_book_html_description(item)
-            final_html = self.combine_with_template(html_content)
+            item.update(translated)
+            final_html = self.render_description("book", dict(item, details=self.book_details(item)))
 
-            sheet.update_cell(item["row"], output_col_num, final_html)
-            self.log(f"✅ {item['row']}行目の更新完了。")
-            results.append("success")
+            results.append({"row": item["row"], "output": final_html, "input_hash": item.get("input_hash")})
+            self.log(f"✅ {item['row']}行目のHTMLを生成しました。")
+        self._record_stage("render", render_started, len(results))
         return results
 
-    def generate_book_html_description(self, item_data):
-        """書籍データからHTML商品説明を生成します。"""
-        # データを安全に取得
+    def _translate_book_item(self, item):
+        fields = {
+            'translated_author': (item.get('author', ''), 'author name'),
+            'translated_publisher': (item.get('publisher', ''), 'publisher name'),
+            'translated_release_date': (item.get('release_date', ''), 'date'),
+            'translated_language': (item.get('language', ''), 'language'),
+            'translated_pages': (item.get('pages', ''), 'page count'),
+        }
+        if self.book_field_batching:
+            # 必要な項目を1回のリクエストでまとめて翻訳
+            translated = self.translate_fields(fields)
+        else:
+            translated = {key: self.translate_text(text, context) for key, (text, context) in fields.items()}
+        if self.local_normalization and item.get('dimensions'):
+            # 寸法は翻訳しないが、表記ゆれ(全角・×・㎝など)はそろえておく
+            translated['dimensions'] = normalize_dimensions(item['dimensions']) or item['dimensions']
+        return translated
+
+    def book_details(self, item_data):
+        """書籍テンプレートの表に出す [{'label': 項目名, 'value': 値}] を返します。値が空・N/A の項目は含めません。"""
         details = {
             "Product Name": item_data.get('product_name', 'N/A'),
             "Author": item_data.get('translated_author', 'N/A'),
@@ -226,63 +1346,285 @@ class DescriptionGeneratorCore:
             "ISBN-13": item_data.get('isbn13', 'N/A'),
             "Dimensions": item_data.get('dimensions', 'N/A'),
         }
-        
-        html = "<h3>Product Details</h3>\n<table border=\"1\" cellpadding=\"5\" cellspacing=\"0\" style=\"border-collapse: collapse; width: 100%;\">\n"
-        for key, value in details.items():
-            if value and value.strip() != 'N/A':
-                html += f"  <tr>\n    <td style=\"width: 30%; background-color: #f2f2f2;\"><strong>{key}</strong></td>\n    <td>{value}</td>\n  </tr>\n"
-        html += "</table>"
-        
-        self.log(f"✅ [書籍] HTMLを生成しました: {details['Product Name'][:30]}...")
-        return html
+        return [{"label": key, "value": value} for key, value in details.items() if value and value.strip() != 'N/A']
 
-    # --- 共通ヘルパー ---
-    def _get_batch_data(self, spreadsheet_id, ranges, start_row, keys):
+    # --- 書き込みを伴わない走査 ---
+    def scan_rows(self, mode, spreadsheet_id, sheet_name, column_settings, start_row=2, end_row=None, skip_rows=None, stats=None):
+        """
+        処理対象の行をバッチごとに読み込んで返すジェネレーター (書き込み・ジャーナルへの記録はしません)。
+        incremental が有効な場合は、実際の処理と同じく出力済みで変更のない行を除きます。
+        skip_rows (ジャーナル上で処理済みの行) は読み込みません。
+        stats に辞書を渡すと、トリガーのある行数・除いた行数・読み込みにかかった秒数を記録します。
+        """
+        if mode == "normal":
+            trigger_col, data_fetcher = column_settings['input_col'], self.get_normal_mode_batch_data
+        else:
+            trigger_col, data_fetcher = column_settings['trigger'], self.get_book_mode_batch_data
+        job_key = self._job_key(spreadsheet_id, sheet_name, mode)
+        if self.incremental and self.row_hash_store is None:
+            self.row_hash_store = RowHashStore()
+        stats = {} if stats is None else stats
+        stats.update(triggered=0, skipped_done=0, skipped_unchanged=0, read_seconds=0.0)
+        started = time.perf_counter()
+        trigger_rows = self.build_trigger_index(spreadsheet_id, sheet_name, trigger_col, start_row, end_row)
+        stats["triggered"] = len(trigger_rows)
+        if skip_rows:
+            trigger_rows = [row for row in trigger_rows if row not in skip_rows]
+            stats["skipped_done"] = stats["triggered"] - len(trigger_rows)
+        if self.row_filter is not None:
+            trigger_rows = self._filter_planned_rows(trigger_rows)
+        stats["read_seconds"] += time.perf_counter() - started
+        for i in range(0, len(trigger_rows), self.batch_size):
+            if self.stop_flag:
+                return
+            started = time.perf_counter()
+            batch_data = data_fetcher(spreadsheet_id, sheet_name, trigger_rows[i:i + self.batch_size], column_settings)
+            stats["read_seconds"] += time.perf_counter() - started
+            if self.incremental:
+                fetched = len(batch_data)
+                batch_data = self._select_changed_rows(job_key, batch_data)
+                stats["skipped_unchanged"] += fetched - len(batch_data)
+            if batch_data and self.enricher is not None:
+                self.enrich_batch(batch_data)
+            if batch_data:
+                yield batch_data
+
+    def collect_translations(self, mode, spreadsheet_id, sheet_name, column_settings, start_row=2, end_row=None):
+        """
+        実際に処理した場合にAPIで翻訳することになる (原文, コンテキスト) を、APIを呼ばずに集めて返します。
+        ルールで変換できるもの・キャッシュやジャーナルにあるものは含みません (同じ組は1つにまとめます)。
+        """
+        self.stop_flag = False
+        pairs = {}
+        batch_processor = self.process_normal_mode_batch if mode == "normal" else self.process_book_mode_batch
+        self.translation_collector = lambda text, context: pairs.setdefault((text, context), None)
+        # 各行のHTML生成のログは不要なので、集計中は出力しない
+        log_callback, self.log_callback = self.log_callback, lambda message: None
         try:
-            response = self.sheets_service.spreadsheets().values().batchGet(
-                spreadsheetId=spreadsheet_id, ranges=ranges
-            ).execute()
-            
-            value_ranges = response.get('valueRanges', [])
-            if not value_ranges: return []
+            for batch_data in self.scan_rows(mode, spreadsheet_id, sheet_name, column_settings, start_row, end_row):
+                batch_processor(batch_data, spreadsheet_id, sheet_name, column_settings)
+        finally:
+            self.translation_collector = None
+            self.log_callback = log_callback
+        return list(pairs)
+
+    def plan_run(self, mode, spreadsheet_id, sheet_name, column_settings, start_row=2, end_row=None, resume=True, settings=None, path=None):
+        """
+        ドライラン: シートを読み込むだけで (シートへの書き込み・API呼び出し・キャッシュや行ハッシュへの記録はしません) 処理対象の行を数え、
+        トークン数・API呼び出し回数・推定コスト・所要時間を見積もって計画ファイル (JSON) に保存し、計画の辞書を返します。
+        翻訳は実際の処理と同じ経路 (ルールでの変換・キャッシュ・まとめ翻訳・振り分け・長文の分割) を通り、
+        APIの代わりに EstimatingCompletionBackend がトークン数を見積もります。
+        resume=True の場合は、ジャーナル上で処理済みの行を除きます。settings (GUIの設定の辞書) は計画に保存され、実行時に反映されます。
+        path を省略すると desgen_data/plans/ に保存します。
+        類似文の再利用は、索引に登録済みの翻訳だけを数えます (この実行で翻訳する行どうしの再利用は数えないため、多めの見積もりになります)。
+        書誌情報はキャッシュにあるものだけで補います (openBD / NDLサーチには問い合わせないため、未取得の行は補わずに見積もります)。
+        """
+        self.stop_flag = False
+        self.load_templates()
+        job_key = self._job_key(spreadsheet_id, sheet_name, mode)
+        journal_key = job_key if end_row is None else f"{job_key}:{start_row}-{end_row}"
+        skip_rows = set()
+        if resume:
+            if self.journal is None:
+                self.journal = ProgressJournal()
+            previous_run = self.journal.get_run(journal_key)
+            if previous_run:
+                start_row = previous_run["start_row"]
+                skip_rows = self.journal.written_rows(journal_key)
+                skip_rows.update(result["row"] for result in self.journal.pending_outputs(journal_key))
+        self.log(f"🧾 [{mode}] 処理内容を見積もります (書き込み・API呼び出しはしません)...")
+        batch_processor = self.process_normal_mode_batch if mode == "normal" else self.process_book_mode_batch
+        estimator = EstimatingCompletionBackend(TRANSLATION_USER_PROMPT.split("{text}")[0])
+        completion_backend, self._completion_backend = self._completion_backend, estimator
+        metrics, self.metrics = self.metrics, RunMetrics(mode, journal_key, self.model_prices)
+        # 各行のHTML生成のログは不要なので、見積もり中は出力しない
+        log_callback, self.log_callback = self.log_callback, lambda message: None
+        self._estimating = True
+        self._estimated_translations = {}
+        stats, rows, failed = {}, [], 0
+        try:
+            for batch_data in self.scan_rows(mode, spreadsheet_id, sheet_name, column_settings, start_row, end_row, skip_rows, stats):
+                results = batch_processor(batch_data, spreadsheet_id, sheet_name, column_settings)
+                rows.extend(item["row"] for item in batch_data)
+                # セルの上限を超える行は書き込み時に失敗する
+                failed += sum(
+                    1 for result in results
+                    if "error" in result or (self.cell_limit is not None and len(result["output"]) > self.cell_limit)
+                )
+        finally:
+            self._estimating = False
+            self._estimated_translations = {}
+            self._completion_backend = completion_backend
+            self.log_callback = log_callback
+            estimate_metrics, self.metrics = self.metrics, metrics
+        if self.stop_flag:
+            self.log("🛑 見積もりを中断しました。")
+            return None
+
+        limits = {"default": (self.requests_per_minute, self.tokens_per_minute)}
+        limiter_names = {}
+        if self.routing is not None:
+            for model, model_limits in self.routing.rate_limits.items():
+                if model != self.translation_model:
+                    limits[model] = (model_limits.get("requests_per_minute", 0), model_limits.get("tokens_per_minute", 0))
+                    limiter_names[model] = model
+        plan = {
+            "version": PLAN_VERSION,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "mode": mode,
+            "spreadsheet_id": spreadsheet_id,
+            "sheet_name": sheet_name,
+            "column_settings": column_settings,
+            "start_row": start_row,
+            "end_row": end_row,
+            "model": self.translation_model,
+            "prompt_version": self.prompt_version,
+            "settings": public_settings(settings),
+            "rows": {
+                "triggered": stats.get("triggered", 0),
+                "skipped_done": stats.get("skipped_done", 0),
+                "skipped_unchanged": stats.get("skipped_unchanged", 0),
+                "to_process": len(rows),
+                "estimated_failures": failed,
+            },
+            "row_numbers": rows,
+            "api": summarize_requests(estimator.requests, self.model_prices),
+            "translations": estimate_metrics.report()["counters"],
+            "duration": estimate_duration(
+                estimator.requests, self.max_workers, limits, limiter_names,
+                read_seconds=stats.get("read_seconds", 0.0),
+                write_calls=-(-len(rows) // max(1, self.write_flush_rows))
+            ),
+            "limits": {
+                "batch_size": self.batch_size, "max_workers": self.max_workers,
+                "requests_per_minute": self.requests_per_minute, "tokens_per_minute": self.tokens_per_minute,
+            },
+        }
+        path = path or os.path.join(DEFAULT_PLAN_DIR, f"{datetime.now():%Y%m%d_%H%M%S_%f}_{mode}.json")
+        write_plan(plan, path)
+        plan["path"] = path
+        for line in summary_lines(plan):
+            self.log(line)
+        self.log(f"🧾 計画を保存しました: {path}")
+        return plan
+
+    def execute_plan(self, plan, resume=True):
+        """
+        plan_run で保存した計画 (辞書または計画ファイルのパス) を実行します。計画時の設定を反映し、計画に含まれる行だけを処理します。
+        計画後にトリガーが消された行・変更のなくなった行は、通常の処理と同じく除かれます。
+        """
+        if isinstance(plan, str):
+            plan = load_plan(plan)
+        if plan.get("settings"):
+            self.apply_settings(plan["settings"])
+        if plan.get("prompt_version") != self.prompt_version:
+            self.log("⚠️ 計画の作成後にプロンプトが変わったため、見積もりと実際のトークン数が異なる場合があります。")
+        self.log(f"🧾 計画を実行します: {len(plan['row_numbers'])} 行 (作成 {plan.get('created_at', '不明')})")
+        self.row_filter = set(plan["row_numbers"])
+        try:
+            if plan["mode"] == "normal":
+                return self.process_product_descriptions(
+                    plan["spreadsheet_id"], plan["sheet_name"], plan["column_settings"],
+                    plan.get("start_row", 2), resume=resume, end_row=plan.get("end_row")
+                )
+            return self.process_book_descriptions(
+                plan["spreadsheet_id"], plan["sheet_name"], plan["column_settings"],
+                plan.get("start_row", 2), resume=resume, end_row=plan.get("end_row")
+            )
+        finally:
+            self.row_filter = None
+
+    def _filter_planned_rows(self, trigger_rows):
+        """トリガー行のうち、実行中の計画に含まれる行だけを返します。"""
+        planned = [row for row in trigger_rows if row in self.row_filter]
+        missing = len(self.row_filter) - len(planned)
+        if missing:
+            self.log(f"🧾 計画の {missing} 行は、トリガー列が空になったか範囲外のため処理しません。")
+        return planned
+
+    # --- 共通ヘルパー ---
+    def build_trigger_index(self, spreadsheet_id, sheet_name, trigger_col, start_row=2, end_row=None):
+        """
+        トリガー列だけを大きな単位でまとめて読み込み、値のある行番号のリストを返します。
+        最終行はシートのグリッド情報から取得するため、途中に空白行が続いても取りこぼしません。
+        end_row を指定した場合は、その行までを対象にします。
+        """
+        last_row = self._get_last_row(spreadsheet_id, sheet_name)
+        if end_row is not None:
+            last_row = min(last_row, end_row)
+        sheet = quote_sheet_name(sheet_name)
+        chunks = [
+            (chunk_start, min(chunk_start + self.index_chunk_rows - 1, last_row))
+            for chunk_start in range(start_row, last_row + 1, self.index_chunk_rows)
+        ]
+        trigger_rows = []
+        # 1回の batchGet で最大10チャンクをまとめて読み込む
+        for i in range(0, len(chunks), 10):
+            group = chunks[i:i + 10]
+            value_ranges = self._call_sheets(
+                "batchGet", self.sheets_backend.batch_get, spreadsheet_id,
+                [f"{sheet}!{trigger_col}{chunk_start}:{trigger_col}{chunk_end}" for chunk_start, chunk_end in group]
+            )
+            for (chunk_start, _), values in zip(group, value_ranges):
+                for offset, cells in enumerate(values):
+                    if cells and str(cells[0]).strip():
+                        trigger_rows.append(chunk_start + offset)
+        self.log(f"🔎 トリガー列を索引化しました: 対象 {len(trigger_rows)} 行 (行: {start_row}-{last_row})")
+        return trigger_rows
 
-            max_rows = max(len(vr.get('values', [])) for vr in value_ranges)
-            batch_data = []
+    def _get_last_row(self, spreadsheet_id, sheet_name):
+        return self._call_sheets("get", self.sheets_backend.get_row_count, spreadsheet_id, sheet_name)
 
-            for i in range(max_rows):
-                def get_cell_value(range_index):
+    def _get_rows_data(self, spreadsheet_id, sheet_name, rows, columns):
+        """
+        指定した行のデータを取得します。columns は [(キー, 列記号)] で、先頭をトリガー列とみなします。
+        各行には入力項目のハッシュ 'input_hash' を付加します。
+        近接する行はまとめて1つの範囲として読み込みます。
+        """
+        sheet = quote_sheet_name(sheet_name)
+        runs = coalesce_rows(rows, self.coalesce_gap)
+        ranges = [f"{sheet}!{column}{run_start}:{column}{run_end}" for run_start, run_end in runs for _, column in columns]
+        # リトライしても取得できない場合は例外を送出し、読み込み段でバッチ全体を失敗として扱う
+        value_ranges = self._call_sheets("batchGet", self.sheets_backend.batch_get, spreadsheet_id, ranges)
+        wanted_rows = set(rows)
+        batch_data = []
+
+        for run_index, (run_start, run_end) in enumerate(runs):
+            run_ranges = value_ranges[run_index * len(columns):(run_index + 1) * len(columns)]
+            for offset in range(run_end - run_start + 1):
+                if run_start + offset not in wanted_rows:
+                    continue
+                def get_cell_value(values):
                     try:
-                        return value_ranges[range_index]['values'][i][0]
-                    except (IndexError, KeyError):
+                        return str(values[offset][0])
+                    except IndexError:
                         return ""
-                
-                # トリガー列(最初の列)に値がある場合のみ処理対象とする
-                trigger_value = get_cell_value(0)
-                if trigger_value and trigger_value.strip():
-                    row_data = {'row': start_row + i}
-                    for j, key in enumerate(keys):
-                        row_data[key] = get_cell_value(j).strip()
+
+                values = [get_cell_value(value_range) for value_range in run_ranges]
+                # 索引作成後にトリガーが消された行は対象外にする
+                if values and values[0].strip():
+                    row_data = {'row': run_start + offset}
+                    for (key, _), value in zip(columns, values):
+                        row_data[key] = value.strip()
+                    # トリガー列と既存の出力を除いた入力項目のハッシュ (差分処理用)
+                    row_data['input_hash'] = RowHashStore.hash_fields(
+                        {key: row_data[key] for key, _ in columns[1:] if key != 'existing_output'}
+                    )
                     batch_data.append(row_data)
-            
-            self.log(f"✅ データ取得完了。{len(batch_data)}件の有効なデータが見つかりました。")
-            return batch_data
-            
-        except Exception as e:
-            self.log(f"❌ データの一括取得中にエラーが発生しました: {e}")
-            return []
-    
-    def combine_with_template(self, description_html):
-        """商品説明を指定のHTMLテンプレートに埋め込みます。"""
-        return f'''<div id="ds_div">
-<meta http-equiv="Content-Type" content="text/html; charset=utf-8">
-<p class="sub_tit" style="width:780px; line-height:30px; padding:10px;background-color:#330000; color:#FFFFFF; font-size:35px; font-weight:bold;">Description</p>
-{description_html}
-<p class="Payment" style="width:780px;line-height:40px;padding:10px;background-color:#330000;color:#FFFFFF;font-size:35px;font-weight:bold;">Payment</p>
-<p class="sub_text" style="width:660px;padding:0px 10px;">Please pay within 5 days after the auction closed.</p>
-<p class="Shipping" style="width:780px;line-height:40px;padding:10px;background-color:#330000;color:#FFFFFF;font-size:35px;font-weight:bold;">Shipping</p>
-<p class="sub_text" style="width:780px;padding:0px 10px;">The products are shipped mainly to the United States.<br>If you wish to ship to other regions, please contact us.</p>
-<p class="sub_tit" style="width:780px; line-height:40px;padding:10px;background-color:#330000;color:#FFFFFF;font-size:35px;font-weight:bold;">Returns</p>
-<p class="sub_text" style="width:780px;padding:0px 10px;">Returns will ONLY be accepted if the item is not as described.</p>
-<p class="sub_tit" style="width:780px;line-height:40px;padding:10px;background-color:#330000;color:#FFFFFF;font-size:35px;font-weight:bold;">International Buyers - Please Note:</p>
-<p class="sub_text" style="width:780px;padding:0px 10px;">* Import duties, taxes and charges are not included in the item price or shipping charges. These charges are the buyer's responsibility.<br>* Please check with your country's customs office to determine what these additional costs will be prior to bidding/buying.<br>* These charges are normally collected by the delivering freight (shipping) company or when you pick the item up - do not confuse them for additional shipping charges.<br>* We do not mark merchandise values below value or mark items as "gifts" - US and International government regulations prohibit such behavior.</p>
-</div>'''
+        
+        self.log(f"✅ データ取得完了。{len(batch_data)}件の有効なデータが見つかりました。")
+        return batch_data
+
+    def _call_sheets(self, description, func, *args):
+        """sheets_backend の呼び出しを、レート制限・一時的なエラーをリトライしながら実行します。"""
+        def call():
+            self._throttle_sheets(self._stop_event)
+            return func(*args)
+        return self.sheets_caller.call(call, description, self._stop_event)
+
+    def _throttle_sheets(self, stop_event=None):
+        """sheets_rate_limiter が設定されていれば、Sheets API の枠が空くまで待機します。"""
+        if self.sheets_rate_limiter is not None:
+            self.sheets_rate_limiter.acquire(
+                0, stop_event, client=self.rate_limit_client, weight=self.rate_limit_weight
+            )
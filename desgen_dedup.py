@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# 類似文の重複排除: 色・サイズ・空白などだけが違う原文を MinHash / LSH で見つけ、既存の翻訳を再利用・部分修正します
+import difflib
+import hashlib
+import json
+import random
+import re
+import unicodedata
+
+# 原文どうしの類似度 (文字3-gramのJaccard係数) がこの値以上なら再利用の候補にする
+DEFAULT_THRESHOLD = 0.85
+# これより短い原文は対象にしない (短い語句は1文字の違いで意味が変わるため)
+MIN_CHARS = 40
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+# 64 = 16バンド × 4行。類似度0.85の組はほぼ確実に、0.5の組でも6割ほどが候補になる (候補は実際の類似度で確認する)
+BANDS = 16
+# 部分修正で差し替える箇所の数と1箇所の長さの上限。超える場合は通常どおり翻訳する
+MAX_PATCHES = 4
+MAX_PATCH_CHARS = 20
+# 差し替える語句を翻訳するときのコンテキスト
+PATCH_CONTEXT = "short phrase taken from a product description, such as a color, size or material"
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# 実行ごと・プロセスごとに同じ署名になるよう、係数は固定のシードで作る
+_rng = random.Random(20240611)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+# 差分を取る単位: 英数字の語・カタカナ語・漢字語・ひらがな・空白・その他の1文字
+_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[.,'/-][A-Za-z0-9]+)*|[ァ-ヺー]+|[一-鿿々〆ヶ]+|[ぁ-ゖ]+|\s+|.", re.DOTALL)
+_JAPANESE_PATTERN = re.compile(r"[ぁ-ゖァ-ヺー一-鿿々〆ヶ]")
+
+
+def clean_text(text):
+    """全角・半角をそろえ (NFKC)、連続する空白を1つにまとめます。差分を取る際の原文です。"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def normalize_text(text):
+    """類似度を計算するための正規化: clean_text に加えて小文字にそろえ、空白を除きます。"""
+    return re.sub(r"\s+", "", clean_text(text).lower())
+
+
+def shingles(text):
+    """正規化済みの文字列の文字 SHINGLE_SIZE-gram の集合を返します。"""
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(shingle_set):
+    """shingle の集合から NUM_PERMUTATIONS 個の MinHash 署名を計算します。"""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+        for shingle in shingle_set
+    ]
+    return [min(((a * value + b) % _MERSENNE_PRIME) & _MAX_HASH for value in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_keys(signature, scope):
+    """署名をバンドに分け、LSHのバケットのキーにします。scope (コンテキスト・モデルなど) が違うものは同じバケットに入りません。"""
+    rows = NUM_PERMUTATIONS // BANDS
+    keys = []
+    for band in range(BANDS):
+        values = ",".join(str(value) for value in signature[band * rows:(band + 1) * rows])
+        keys.append(f"{scope}:{band}:" + hashlib.blake2b(values.encode("ascii"), digest_size=8).hexdigest())
+    return keys
+
+
+def make_scope(context, model, prompt_version):
+    payload = json.dumps([context, model, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def is_verbatim(term):
+    """日本語を含まない語句 (サイズ・型番・数値など) は、英訳にもそのまま現れるものとして扱います。"""
+    return not _JAPANESE_PATTERN.search(term)
+
+
+def diff_segments(source, target, max_patches=MAX_PATCHES, max_chars=MAX_PATCH_CHARS):
+    """
+    2つの原文の違いを [(元の語句, 新しい語句)] で返します。空白だけの違いは含めません。
+    語句の追加・削除がある場合や、違いが多すぎる・長すぎる場合は、差し替えでは対応できないため None を返します。
+    """
+    source_tokens = _TOKEN_PATTERN.findall(clean_text(source))
+    target_tokens = _TOKEN_PATTERN.findall(clean_text(target))
+    matcher = difflib.SequenceMatcher(None, source_tokens, target_tokens, autojunk=False)
+    segments = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        old = "".join(source_tokens[i1:i2]).strip()
+        new = "".join(target_tokens[j1:j2]).strip()
+        if old == new:
+            continue
+        if not old or not new or len(old) > max_chars or len(new) > max_chars:
+            return None
+        segments.append((old, new))
+        if len(segments) > max_patches:
+            return None
+    return segments
+
+
+def apply_replacements(translation, replacements):
+    """
+    翻訳文の語句を差し替えます。replacements は [(元の英語, 新しい英語, 大文字小文字を区別するか)] です。
+    元の英語が翻訳文にちょうど1回現れる場合だけ差し替え、見つからない・複数ある場合は None を返します
+    (「2個セット…保証期間は2年間」の「2個」だけが変わった場合に、保証期間まで書き換えないため)。
+    """
+    for old, new, case_sensitive in replacements:
+        if not old or not new:
+            return None
+        if old == new:
+            continue
+        pattern = re.compile(
+            r"(?<![A-Za-z0-9])" + re.escape(old) + r"(?![A-Za-z0-9])", 0 if case_sensitive else re.IGNORECASE
+        )
+
+        def replace(match, new=new):
+            # 文頭などで大文字になっている箇所は、差し替え後も大文字で始める
+            if match.group(0)[:1].isupper() and new[:1].islower():
+                return new[:1].upper() + new[1:]
+            return new
+
+        if len(pattern.findall(translation)) != 1:
+            return None
+        translation = pattern.sub(replace, translation)
+    return translation
+
+
+class NearDuplicate:
+    """索引で見つかった類似の原文と、その翻訳・差し替える語句。"""
+    def __init__(self, source, translation, similarity, segments):
+        self.source = source
+        self.translation = translation
+        self.similarity = similarity
+        self.segments = segments
+
+
+class Deduplicator:
+    """
+    翻訳済みの原文を MinHash / LSH の索引 (DedupIndex) に登録し、類似の原文の翻訳を探します。
+    類似度が threshold 以上で、違いが差し替えで対応できる範囲のものだけを返します。
+    """
+    def __init__(self, index, threshold=DEFAULT_THRESHOLD, min_chars=MIN_CHARS, max_candidates=10):
+        self.index = index
+        self.threshold = threshold
+        self.min_chars = min_chars
+        self.max_candidates = max_candidates
+
+    def applies(self, text):
+        return len(clean_text(text)) >= self.min_chars
+
+    def _signature(self, text):
+        shingle_set = shingles(normalize_text(text))
+        return shingle_set, minhash(shingle_set)
+
+    def add(self, text, context, model, prompt_version, translation):
+        if not self.applies(text):
+            return
+        scope = make_scope(context, model, prompt_version)
+        _, signature = self._signature(text)
+        self.index.add(scope, context, model, prompt_version, text, translation, band_keys(signature, scope))
+
+    def find(self, text, context, model, prompt_version):
+        """類似の翻訳済みの原文を NearDuplicate で返します。見つからない場合は None です。"""
+        if not self.applies(text):
+            return None
+        scope = make_scope(context, model, prompt_version)
+        shingle_set, signature = self._signature(text)
+        candidates = []
+        for source, translation in self.index.candidates(band_keys(signature, scope), self.max_candidates):
+            similarity = jaccard(shingle_set, shingles(normalize_text(source)))
+            if similarity >= self.threshold:
+                candidates.append((similarity, source, translation))
+        for similarity, source, translation in sorted(candidates, key=lambda candidate: -candidate[0]):
+            segments = diff_segments(source, text)
+            if segments is not None:
+                return NearDuplicate(source, translation, similarity, segments)
+        return None
+
+    def split_batch(self, items):
+        """
+        [(キー, 原文)] を、先に翻訳するものと、同じバッチ内に類似の原文があるため後で翻訳するものに分けます。
+        後に回したものは、先に翻訳したものが索引に登録されてから find で再利用できます。
+        """
+        leaders, followers = [], []
+        buckets, leaders_shingles = {}, {}
+        for key, text in items:
+            if not self.applies(text):
+                leaders.append((key, text))
+                continue
+            shingle_set, signature = self._signature(text)
+            keys = band_keys(signature, "batch")
+            candidates = {index for bucket in keys for index in buckets.get(bucket, ())}
+            if any(
+                jaccard(shingle_set, leaders_shingles[index]) >= self.threshold
+                and diff_segments(leaders[index][1], text) is not None
+                for index in candidates
+            ):
+                followers.append((key, text))
+                continue
+            for bucket in keys:
+                buckets.setdefault(bucket, []).append(len(leaders))
+            leaders_shingles[len(leaders)] = shingle_set
+            leaders.append((key, text))
+        return leaders, followers
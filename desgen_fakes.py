@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# ローカルで動く代替バックエンド: APIを呼ばずに遅延・レート制限・エラーを再現し、性能測定や動作確認に使います
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape as xml_escape
+from desgen_backends import SheetsBackend, CompletionBackend, Completion
+from desgen_sheets import column_to_number, parse_a1_range
+from desgen_tokens import estimate_tokens
+
+_TRANSLATE_PREFIX = "Please translate this into English: "
+
+
+class FakeAPIError(Exception):
+    """代替バックエンドが送出するエラー。http_status / retry_after は実際のAPIのエラーと同じように分類されます。"""
+    def __init__(self, message, http_status, retry_after=None):
+        super().__init__(message)
+        self.http_status = http_status
+        self.retry_after = retry_after
+
+
+class FaultInjector:
+    """
+    呼び出しごとに遅延を入れ、指定した割合でレート制限(429)・一時的なエラー(503)・恒久的なエラー(400)を発生させます。
+    latency は1回あたりの平均遅延(秒)で、jitter の割合だけ前後にばらつきます。
+    """
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_rate=0.0, error_rate=0.0,
+                 permanent_error_rate=0.0, retry_after=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.permanent_error_rate = permanent_error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.injected = {"rate_limit": 0, "transient": 0, "permanent": 0}
+        self._lock = threading.Lock()
+
+    def before_call(self, operation):
+        with self._lock:
+            delay = self.latency * (1 + self.random.uniform(-self.jitter, self.jitter)) if self.latency else 0.0
+            roll = self.random.random()
+        if delay > 0:
+            time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            self._count("rate_limit")
+            raise FakeAPIError(f"{operation}: Rate limit exceeded", 429, self.retry_after)
+        roll -= self.rate_limit_rate
+        if roll < self.error_rate:
+            self._count("transient")
+            raise FakeAPIError(f"{operation}: Service unavailable", 503)
+        roll -= self.error_rate
+        if roll < self.permanent_error_rate:
+            self._count("permanent")
+            raise FakeAPIError(f"{operation}: Invalid request", 400)
+
+    def _count(self, kind):
+        with self._lock:
+            self.injected[kind] += 1
+
+
+def _parse_range(cell_range):
+    try:
+        return parse_a1_range(cell_range)
+    except ValueError as e:
+        raise FakeAPIError(str(e), 400)
+
+
+class FakeSheetsBackend(SheetsBackend):
+    """
+    メモリ上のシートを読み書きする SheetsBackend。
+    シートは {シート名: {行番号: {列記号: 値}}} で渡します。
+    calls にメソッドごとの呼び出し回数、read_at / written_at に行ごとの最終読み込み・書き込み時刻を記録します。
+    """
+    def __init__(self, sheets=None, row_count=None, faults=None):
+        self.sheets = {
+            name: {row: {column_to_number(column): value for column, value in cells.items()} for row, cells in rows.items()}
+            for name, rows in (sheets or {}).items()
+        }
+        self.row_count = row_count
+        self.faults = faults or FaultInjector()
+        self.calls = {"get": 0, "batchGet": 0, "batchUpdate": 0}
+        self.read_at = {}
+        self.written_at = {}
+        self._lock = threading.Lock()
+
+    def value(self, sheet_name, row, column):
+        return self.sheets.get(sheet_name, {}).get(row, {}).get(column_to_number(column), "")
+
+    def get_row_count(self, spreadsheet_id, sheet_name):
+        self._before_call("get")
+        if self.row_count is not None:
+            return self.row_count
+        # 実際のシートと同じく、データの下に空白行の余裕を持たせる
+        return max(self.sheets.get(sheet_name, {}) or [1]) + 100
+
+    def batch_get(self, spreadsheet_id, ranges):
+        self._before_call("batchGet")
+        now = time.perf_counter()
+        results = []
+        with self._lock:
+            for cell_range in ranges:
+                sheet_name, first_row, last_row, first_col, last_col = _parse_range(cell_range)
+                rows = self.sheets.get(sheet_name, {})
+                values = []
+                for row in range(first_row, last_row + 1):
+                    cells = rows.get(row, {})
+                    values.append([cells.get(col, "") for col in range(first_col, last_col + 1)])
+                    self.read_at[row] = now
+                # APIと同じく末尾の空行・空セルは省略する
+                while values and not any(values[-1]):
+                    values.pop()
+                results.append([_trim_row(row_values) for row_values in values])
+        return results
+
+    def batch_update(self, spreadsheet_id, data):
+        self._before_call("batchUpdate")
+        now = time.perf_counter()
+        with self._lock:
+            for cell_range, value in data:
+                sheet_name, row, _, col, _ = _parse_range(cell_range)
+                self.sheets.setdefault(sheet_name, {}).setdefault(row, {})[col] = value
+                self.written_at[row] = now
+
+    def _before_call(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        self.faults.before_call(operation)
+
+
+def _trim_row(values):
+    while values and values[-1] == "":
+        values = values[:-1]
+    return values
+
+
+def fake_translate(text):
+    """既定の疑似翻訳。原文に目印を付けて返します。"""
+    return f"[EN] {text}"
+
+
+class FakeCompletionBackend(CompletionBackend):
+    """
+    プロンプトの形式に合わせた疑似翻訳を返す CompletionBackend。
+    JSON出力 (response_format) の場合は、入力と同じキーに各テキストの翻訳を入れたJSONを返します。
+    トークン数は desgen_tokens の見積もりで集計します。応答が max_tokens を超える場合は、実際のAPIと同じく途中で打ち切ります。
+    seconds_per_token を指定すると、出力トークン数に比例した生成時間を待ちます (長文の逐次生成の遅さの再現用)。
+    """
+    def __init__(self, translate=fake_translate, faults=None, seconds_per_token=0.0):
+        self.translate = translate
+        self.faults = faults or FaultInjector()
+        self.seconds_per_token = seconds_per_token
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def complete(self, model, messages, max_tokens, temperature=0.2, timeout=None, response_format=None):
+        with self._lock:
+            self.calls += 1
+        self.faults.before_call("ChatCompletion")
+        user_prompt = messages[-1]["content"]
+        if response_format and response_format.get("type") == "json_object":
+            payload = json.loads(user_prompt)
+            content = json.dumps(
+                {key: self.translate(value["text"]) for key, value in payload.items()}, ensure_ascii=False
+            )
+        else:
+            text = user_prompt[len(_TRANSLATE_PREFIX):] if user_prompt.startswith(_TRANSLATE_PREFIX) else user_prompt
+            content = self.translate(text)
+        prompt_tokens = sum(estimate_tokens(message["content"], model) for message in messages)
+        completion_tokens = estimate_tokens(content, model)
+        finish_reason = "stop"
+        if completion_tokens > max_tokens:
+            content = content[:len(content) * max_tokens // completion_tokens]
+            completion_tokens, finish_reason = max_tokens, "length"
+        if self.seconds_per_token:
+            time.sleep(completion_tokens * self.seconds_per_token)
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        return Completion(content, finish_reason, prompt_tokens, completion_tokens)
+
+
+class BibliographyFixtureServer:
+    """
+    openBD (POST /openbd/get) と NDLサーチ (GET /ndl/opensearch) の応答を返す手元のHTTPサーバー。
+    BibliographyClient の openbd_url / ndl_url を openbd_url / ndl_url に向けると、外部に接続せずに書誌情報の取得を試せます。
+    openbd_records は {ISBN-13: openBD の1件 (summary / onix)}、ndl_records は {ISBN-13: {"title", "creator", "publisher", "issued", "extent"}} です。
+    """
+    def __init__(self, openbd_records=None, ndl_records=None, faults=None, host="127.0.0.1", port=0):
+        self.openbd_records = dict(openbd_records or {})
+        self.ndl_records = dict(ndl_records or {})
+        self.faults = faults or FaultInjector()
+        self.calls = {"openbd": 0, "ndl": 0}
+        self.lookups = {"openbd": 0, "ndl": 0}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status, body, content_type):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _fault(self, operation):
+                try:
+                    server.faults.before_call(operation)
+                except FakeAPIError as e:
+                    self.send_response(e.http_status)
+                    if e.retry_after is not None:
+                        self.send_header("Retry-After", str(e.retry_after))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return True
+                return False
+
+            def do_POST(self):
+                if self.path.split("?")[0] != "/openbd/get":
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                form = urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8"))
+                isbns = [isbn for isbn in ",".join(form.get("isbn", [])).split(",") if isbn]
+                server.calls["openbd"] += 1
+                server.lookups["openbd"] += len(isbns)
+                if self._fault("openbd"):
+                    return
+                body = json.dumps([server.openbd_records.get(isbn) for isbn in isbns], ensure_ascii=False)
+                self._send(200, body, "application/json; charset=utf-8")
+
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                if path != "/ndl/opensearch":
+                    self.send_error(404)
+                    return
+                isbn = (urllib.parse.parse_qs(query).get("isbn") or [""])[0]
+                server.calls["ndl"] += 1
+                server.lookups["ndl"] += 1
+                if self._fault("ndl"):
+                    return
+                self._send(200, server.ndl_rss(isbn), "application/rss+xml; charset=utf-8")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        base_url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.openbd_url = f"{base_url}/openbd"
+        self.ndl_url = f"{base_url}/ndl/opensearch"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="desgen-bibliography-fixture", daemon=True)
+        self.thread.start()
+
+    def ndl_rss(self, isbn):
+        record = self.ndl_records.get(isbn)
+        item = ""
+        if record:
+            item = (
+                "<item>"
+                f"<title>{xml_escape(record.get('title', ''))}</title>"
+                f"<dc:creator>{xml_escape(record.get('creator', ''))}</dc:creator>"
+                f"<dc:publisher>{xml_escape(record.get('publisher', ''))}</dc:publisher>"
+                f"<dcterms:issued>{xml_escape(record.get('issued', ''))}</dcterms:issued>"
+                f"<dc:extent>{xml_escape(record.get('extent', ''))}</dc:extent>"
+                "</item>"
+            )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/">'
+            f"<channel><title>NDL Search</title>{item}</channel></rss>"
+        )
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+# ファイルバックエンド: CSV / XLSX / Parquet をスプレッドシートの代わりに読み書きします
+# openpyxl (XLSX) と pyarrow (Parquet) は任意の依存で、そのファイル形式を使うときだけインポートします
+import csv
+import os
+import re
+import threading
+from desgen_backends import SheetsBackend
+from desgen_sheets import column_to_number, number_to_column, parse_a1_range, quote_sheet_name
+from desgen_store import SQLiteStore
+
+FORMATS = {".csv": "csv", ".tsv": "csv", ".xlsx": "xlsx", ".xlsm": "xlsx", ".parquet": "parquet"}
+# 出力先の列として、見出しに無い名前を指定したときに新しい列を追加してよい設定のキー
+OUTPUT_KEYS = ("output_col", "output")
+_COLUMN_LETTERS = re.compile(r"^[A-Z]{1,3}$")
+
+
+def _import_openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise RuntimeError("XLSX ファイルを扱うには openpyxl が必要です: pip install openpyxl")
+    return openpyxl
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet ファイルを扱うには pyarrow が必要です: pip install pyarrow")
+    return pyarrow
+
+
+def _cell_text(value):
+    return "" if value is None else str(value)
+
+
+class _ResultStore(SQLiteStore):
+    """書き込まれたセルを (行, 列) ごとに保存し、出力ファイルを書き出すまでディスクに置いておくストア。"""
+    schema = """
+    CREATE TABLE IF NOT EXISTS results (
+        row INTEGER NOT NULL,
+        col INTEGER NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (row, col)
+    );
+    """
+
+    def put_many(self, cells):
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO results (row, col, value) VALUES (?, ?, ?)", cells)
+
+    def columns(self):
+        return [col for (col,) in self.execute("SELECT DISTINCT col FROM results ORDER BY col")]
+
+    def count(self):
+        return self.execute("SELECT COUNT(*) FROM results")[0][0]
+
+    def iter_rows(self, page_size=1000):
+        """行番号の順に (行, {列番号: 値}) を返します。メモリに載せるのは page_size セルずつです。"""
+        last_row, last_col, current_row, cells = 0, 0, None, {}
+        while True:
+            page = self.execute(
+                "SELECT row, col, value FROM results WHERE row > ? OR (row = ? AND col > ?) ORDER BY row, col LIMIT ?",
+                (last_row, last_row, last_col, page_size)
+            )
+            if not page:
+                break
+            for row, col, value in page:
+                if row != current_row and cells:
+                    yield current_row, cells
+                    cells = {}
+                current_row = row
+                cells[col] = value
+            last_row, last_col = page[-1][0], page[-1][1]
+        if cells:
+            yield current_row, cells
+
+
+class FileSheetsBackend(SheetsBackend):
+    """
+    CSV / XLSX / Parquet ファイルを1枚のシートとして読み書きする SheetsBackend。
+    1行目は見出し行で、データは2行目から始まります (Parquet は列名を1行目とみなします)。
+    読み込みはファイルを先頭から順に読み進め、要求された範囲の行だけをメモリに保持します。
+    前に戻る範囲を要求された場合はファイルを先頭から読み直します。
+    書き込まれた値は出力先の隣の SQLite ファイル (*.results.sqlite3) にため、finalize() で入力と突き合わせて
+    出力ファイルを書き出します。範囲のシート名は無視し、XLSX のシートは sheet_name で選びます。
+    """
+    def __init__(self, path, output_path=None, sheet_name=None, encoding="utf-8-sig", batch_rows=10000):
+        self.path = path
+        self.format = FORMATS.get(os.path.splitext(path)[1].lower())
+        if self.format is None:
+            raise ValueError(f"対応していないファイル形式です: {path} (CSV / TSV / XLSX / Parquet)")
+        self.output_path = output_path or path
+        if FORMATS.get(os.path.splitext(self.output_path)[1].lower()) != self.format:
+            raise ValueError("出力ファイルは入力ファイルと同じ形式にしてください。")
+        self.encoding = encoding
+        self.delimiter = "\t" if path.lower().endswith(".tsv") else ","
+        self.batch_rows = batch_rows
+        self.sheet_name = sheet_name or self._default_sheet_name()
+        self.header = [_cell_text(value) for value in next(self._iter_rows(), [])]
+        # 見出しに無い名前の出力列は、既存の列の右に追加する {列番号: 見出し}
+        self.new_columns = {}
+        self.results = _ResultStore(self.output_path + ".results.sqlite3")
+        self._row_count = None
+        self._stream = None
+        self._position = 0
+        self._window = {}
+        self._window_start = 1
+        self._lock = threading.Lock()
+
+    def _default_sheet_name(self):
+        if self.format == "xlsx":
+            workbook = _import_openpyxl().load_workbook(self.path, read_only=True)
+            try:
+                return workbook.active.title
+            finally:
+                workbook.close()
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    def _iter_rows(self, raw=False):
+        """ファイルの各行の値のリストを、見出し行から順に返します。raw=False の場合は文字列に変換します。"""
+        if self.format == "csv":
+            with open(self.path, "r", encoding=self.encoding, newline="") as f:
+                yield from csv.reader(f, delimiter=self.delimiter)
+        elif self.format == "xlsx":
+            workbook = _import_openpyxl().load_workbook(self.path, read_only=True, data_only=True)
+            try:
+                worksheet = workbook[self.sheet_name] if self.sheet_name in workbook.sheetnames else workbook.active
+                for values in worksheet.iter_rows(values_only=True):
+                    yield list(values) if raw else [_cell_text(value) for value in values]
+            finally:
+                workbook.close()
+        else:
+            parquet_file = _import_pyarrow().parquet.ParquetFile(self.path)
+            names = parquet_file.schema_arrow.names
+            yield list(names)
+            for batch in parquet_file.iter_batches(batch_size=self.batch_rows):
+                columns = [batch.column(i).to_pylist() for i in range(len(names))]
+                for values in zip(*columns):
+                    yield list(values) if raw else [_cell_text(value) for value in values]
+
+    def resolve_columns(self, column_settings):
+        """
+        列設定の値 (列記号または見出し名) を列記号に変換した辞書を返します。
+        ファイルの列の範囲内の列記号はそのまま使い、それ以外は見出し名として探します。
+        出力列 (output_col / output) が見出しに無い場合は、その名前の列を右端に追加します。
+        """
+        resolved = {}
+        for key, value in column_settings.items():
+            name = str(value).strip()
+            if _COLUMN_LETTERS.match(name) and column_to_number(name) <= len(self.header):
+                resolved[key] = name
+            elif name in self.header:
+                resolved[key] = number_to_column(self.header.index(name) + 1)
+            elif _COLUMN_LETTERS.match(name):
+                resolved[key] = name
+            elif key in OUTPUT_KEYS:
+                existing = [col for col, header in self.new_columns.items() if header == name]
+                number = existing[0] if existing else len(self.header) + len(self.new_columns) + 1
+                self.new_columns[number] = name
+                resolved[key] = number_to_column(number)
+            else:
+                raise ValueError(f"列 '{name}' が見つかりません ({key})。列記号か1行目の見出し名を指定してください。")
+        return resolved
+
+    def get_row_count(self, spreadsheet_id, sheet_name):
+        if self._row_count is None:
+            if self.format == "parquet":
+                self._row_count = _import_pyarrow().parquet.ParquetFile(self.path).metadata.num_rows + 1
+            else:
+                self._row_count = sum(1 for _ in self._iter_rows(raw=True))
+        return self._row_count
+
+    def batch_get(self, spreadsheet_id, ranges):
+        results = []
+        with self._lock:
+            for cell_range in ranges:
+                _, first_row, last_row, first_col, last_col = parse_a1_range(cell_range)
+                self._read_until(first_row, last_row)
+                values = []
+                for row in range(first_row, last_row + 1):
+                    cells = self._window.get(row, [])
+                    values.append([cells[col - 1] if col <= len(cells) else "" for col in range(first_col, last_col + 1)])
+                # Sheets API と同じく末尾の空行・空セルは省略する
+                while values and not any(values[-1]):
+                    values.pop()
+                for row_values in values:
+                    while row_values and row_values[-1] == "":
+                        row_values.pop()
+                results.append(values)
+        return results
+
+    def _read_until(self, first_row, last_row):
+        """first_row から last_row までの行を読み込み、first_row より前の行はメモリから捨てます。"""
+        if self._stream is None or first_row < self._window_start:
+            self._stream = self._iter_rows()
+            self._position = 0
+            self._window = {}
+        for row in [row for row in self._window if row < first_row]:
+            del self._window[row]
+        self._window_start = first_row
+        while self._position < last_row:
+            values = next(self._stream, None)
+            if values is None:
+                # ファイルの終端。以降の行は空として扱う
+                self._position = last_row
+                break
+            self._position += 1
+            if self._position >= first_row:
+                self._window[self._position] = values
+
+    def batch_update(self, spreadsheet_id, data):
+        cells = []
+        for cell_range, value in data:
+            _, row, _, col, _ = parse_a1_range(cell_range)
+            cells.append((row, col, value))
+        self.results.put_many(cells)
+
+    def sync_to_sheets(self, sheets_backend, spreadsheet_id, sheet_name, chunk_cells=500, caller=None, log=print):
+        """
+        書き込まれた値を、スプレッドシートの同じ行・列にまとめて書き込みます (ファイルで一括処理した結果の反映用)。
+        caller (ResilientCaller) を渡すと、レート制限・一時的なエラーはリトライします。書き込んだセル数を返します。
+        """
+        sheet = quote_sheet_name(sheet_name)
+        total, data = 0, []
+
+        def send(data):
+            if caller:
+                caller.call(lambda: sheets_backend.batch_update(spreadsheet_id, data), "batchUpdate")
+            else:
+                sheets_backend.batch_update(spreadsheet_id, data)
+
+        for row, cells in self.results.iter_rows():
+            data.extend((f"{sheet}!{number_to_column(col)}{row}", value) for col, value in cells.items())
+            if len(data) >= chunk_cells:
+                send(data)
+                total += len(data)
+                log(f"☁️ スプレッドシートに {total} セルを反映しました。")
+                data = []
+        if data:
+            send(data)
+            total += len(data)
+            log(f"☁️ スプレッドシートに {total} セルを反映しました。")
+        return total
+
+    def finalize(self):
+        """
+        書き込まれた値を入力ファイルと突き合わせて出力ファイルを書き出し、書き込んだセル数を返します。
+        出力は一時ファイルに書いてから置き換えるため、入力ファイルと同じパスを指定しても安全です。
+        XLSX は値のみを書き出します (書式・数式は保持されません)。
+        """
+        cells = self.results.count()
+        temp_path = f"{self.output_path}.{os.getpid()}.tmp"
+        with self._lock:
+            self._stream = None
+            self._window = {}
+            if self.format == "csv":
+                self._write_csv(temp_path)
+            elif self.format == "xlsx":
+                self._write_xlsx(temp_path)
+            else:
+                self._write_parquet(temp_path)
+        os.replace(temp_path, self.output_path)
+        self.results.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.results.path + suffix):
+                os.remove(self.results.path + suffix)
+        return cells
+
+    def _merged_rows(self, rows):
+        """rows (見出し行からの各行) に書き込まれた値を重ねて返します。入力より後の行に書き込まれた値は末尾に追加します。"""
+        results = self.results.iter_rows()
+        pending = next(results, None)
+        row = 0
+        for row, values in enumerate(rows, start=1):
+            values = list(values)
+            if row == 1:
+                for col, name in self.new_columns.items():
+                    values.extend([None] * (col - len(values)))
+                    values[col - 1] = name
+            while pending is not None and pending[0] < row:
+                pending = next(results, None)
+            if pending is not None and pending[0] == row:
+                for col, value in pending[1].items():
+                    values.extend([None] * (col - len(values)))
+                    values[col - 1] = value
+                pending = next(results, None)
+            yield values
+        while pending is not None:
+            # 入力より後の行 (通常は発生しない) は、間を空行で埋めて書き出す
+            for _ in range(row + 1, pending[0]):
+                yield []
+            values = []
+            for col, value in pending[1].items():
+                values.extend([None] * (col - len(values)))
+                values[col - 1] = value
+            yield values
+            row = pending[0]
+            pending = next(results, None)
+
+    def _write_csv(self, temp_path):
+        with open(temp_path, "w", encoding=self.encoding, newline="") as f:
+            writer = csv.writer(f, delimiter=self.delimiter)
+            for values in self._merged_rows(self._iter_rows(raw=True)):
+                writer.writerow(["" if value is None else value for value in values])
+
+    def _write_xlsx(self, temp_path):
+        openpyxl = _import_openpyxl()
+        source = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        target = openpyxl.Workbook(write_only=True)
+        try:
+            target_title = self.sheet_name if self.sheet_name in source.sheetnames else source.active.title
+            for title in source.sheetnames:
+                worksheet = target.create_sheet(title=title)
+                rows = source[title].iter_rows(values_only=True)
+                if title == target_title:
+                    rows = self._merged_rows(rows)
+                for values in rows:
+                    worksheet.append(list(values))
+            target.save(temp_path)
+        finally:
+            source.close()
+
+    def _write_parquet(self, temp_path):
+        pyarrow = _import_pyarrow()
+        parquet_file = pyarrow.parquet.ParquetFile(self.path)
+        schema = parquet_file.schema_arrow
+        names = list(schema.names)
+        output_columns = self.results.columns()
+        # 書き込みのある列は文字列の列にする (見出しに無い列は追加する)
+        for col in output_columns:
+            if col <= len(names):
+                schema = schema.set(col - 1, pyarrow.field(names[col - 1], pyarrow.string()))
+            else:
+                name = self.new_columns.get(col, number_to_column(col))
+                schema = schema.append(pyarrow.field(name, pyarrow.string()))
+                names.append(name)
+        results = self.results.iter_rows()
+        pending = next(results, None)
+        first_row = 2
+        with pyarrow.parquet.ParquetWriter(temp_path, schema) as writer:
+            for batch in parquet_file.iter_batches(batch_size=self.batch_rows):
+                last_row = first_row + batch.num_rows - 1
+                updates = {col: {} for col in output_columns}
+                while pending is not None and pending[0] <= last_row:
+                    if pending[0] >= first_row:
+                        for col, value in pending[1].items():
+                            updates[col][pending[0] - first_row] = value
+                    pending = next(results, None)
+                arrays = [batch.column(i) for i in range(batch.num_columns)]
+                for col in output_columns:
+                    if col <= batch.num_columns:
+                        values = [None if value is None else str(value) for value in arrays[col - 1].to_pylist()]
+                    else:
+                        values = [None] * batch.num_rows
+                    for offset, value in updates[col].items():
+                        values[offset] = value
+                    array = pyarrow.array(values, type=pyarrow.string())
+                    if col <= len(arrays):
+                        arrays[col - 1] = array
+                    else:
+                        arrays.append(array)
+                writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+                first_row = last_row + 1
@@ -4,9 +4,28 @@ from tkinter import ttk, scrolledtext, filedialog, messagebox
 import threading
 import os
 import json
+import collections
+import logging
+import logging.handlers
 from datetime import datetime
 # 修正後のコアファイル 'desgen_core.py' からクラスをインポート
 from desgen_core import DescriptionGeneratorCore
+from desgen_dedup import DEFAULT_THRESHOLD
+from desgen_jobs import JobQueue
+from desgen_plan import DEFAULT_PLAN_DIR, load_plan, summary_lines
+from desgen_store import DEFAULT_DATA_DIR
+from desgen_templates import DEFAULT_TEMPLATE_SET, OUTPUT_MODES, available_template_sets
+
+# ログ表示は最新の LOG_MAX_LINES 行だけを保持し、LOG_FLUSH_MS ミリ秒ごとにまとめて描画する
+LOG_MAX_LINES = 2000
+LOG_FLUSH_MS = 200
+# 全文はローテーションするログファイルに残す
+LOG_FILE = os.path.join(DEFAULT_DATA_DIR, "logs", "desgen_gui.log")
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+# ジョブキュー画面の表示を更新する間隔
+JOB_REFRESH_MS = 500
+JOB_STATUS_LABELS = {"queued": "待機中", "running": "実行中", "done": "完了", "failed": "失敗", "cancelled": "取消"}
 
 class DescriptionGeneratorGUI:
     """
@@ -22,9 +41,16 @@ class DescriptionGeneratorGUI:
         self.is_processing = False
         # 新しいバージョン用の設定ファイル
         self.config_file = "description_generator_config_v3.json"
+        # 処理スレッドから届いたログと進捗は、ここにためてタイマーで描画する
+        self._pending_log = collections.deque(maxlen=LOG_MAX_LINES)
+        self._latest_progress = None
+        self.job_queue = None
+        self.job_window = None
+        self.file_logger = self._create_file_logger()
 
         self.create_widgets()
         self.load_config()
+        self.root.after(LOG_FLUSH_MS, self._flush_log)
 
     def create_widgets(self):
         """GUIのウィジェットをすべて作成・配置します。"""
@@ -65,8 +91,37 @@ class DescriptionGeneratorGUI:
         self.start_row_var = tk.StringVar(value="2")
         self._create_entry(processing_frame, "開始行:", 0, self.start_row_var, width=8)
         self.batch_size_var = self._create_combobox(processing_frame, "バッチサイズ:", 2, ["10", "15", "20", "25", "30"], "20")
-        self.translation_delay_var = self._create_combobox(processing_frame, "翻訳間隔(秒):", 4, ["0.5", "1.0", "1.5", "2.0"], "1.0")
-        self.batch_delay_var = self._create_combobox(processing_frame, "バッチ間隔(秒):", 6, ["3.0", "5.0", "10.0"], "5.0")
+        self.max_workers_var = self._create_combobox(processing_frame, "同時翻訳数:", 4, ["1", "2", "4", "8", "16"], "4")
+        self.prefetch_batches_var = self._create_combobox(processing_frame, "先読みバッチ数:", 6, ["1", "2", "4", "8"], "2")
+        self.use_translation_cache_var = tk.BooleanVar(value=True)
+        self._create_checkbox(processing_frame, "翻訳キャッシュを使用", 1, 0, self.use_translation_cache_var)
+        self.book_field_batching_var = tk.BooleanVar(value=True)
+        self._create_checkbox(processing_frame, "書籍項目を一括翻訳", 1, 2, self.book_field_batching_var)
+        self.pack_translations_var = tk.BooleanVar(value=True)
+        self._create_checkbox(processing_frame, "複数行をまとめて翻訳", 1, 4, self.pack_translations_var)
+        self.incremental_var = tk.BooleanVar(value=False)
+        self._create_checkbox(processing_frame, "変更行のみ処理(差分)", 3, 0, self.incremental_var)
+        self.resume_var = tk.BooleanVar(value=True)
+        self._create_checkbox(processing_frame, "前回の続きから再開", 3, 2, self.resume_var)
+        self.template_var = self._create_combobox(
+            processing_frame, "テンプレート:", 4, available_template_sets() or [DEFAULT_TEMPLATE_SET], DEFAULT_TEMPLATE_SET, row=3
+        )
+        self.html_output_var = self._create_combobox(processing_frame, "HTML出力形式:", 6, list(OUTPUT_MODES), "inline", row=3)
+        self.enrich_bibliography_var = tk.BooleanVar(value=False)
+        self._create_checkbox(processing_frame, "書誌情報で空欄を補完", 4, 0, self.enrich_bibliography_var)
+        self.dedup_var = tk.BooleanVar(value=False)
+        self._create_checkbox(processing_frame, "類似文の翻訳を再利用", 4, 2, self.dedup_var)
+        self.dedup_threshold_var = self._create_combobox(
+            processing_frame, "類似度しきい値:", 4, ["0.8", "0.85", "0.9", "0.95"], str(DEFAULT_THRESHOLD), row=4
+        )
+        self.model_routing_var = tk.BooleanVar(value=False)
+        self._create_checkbox(processing_frame, "短い項目は軽量モデルで翻訳", 5, 0, self.model_routing_var)
+        self.chunk_token_budget_var = self._create_combobox(processing_frame, "長文の分割(トークン):", 6, ["0", "500", "800", "1500"], "800", row=4)
+        self.pack_token_budget_var = self._create_combobox(processing_frame, "まとめ上限(トークン):", 6, ["1000", "2000", "4000"], "2000", row=1)
+        self.requests_per_minute_var = self._create_combobox(processing_frame, "リクエスト/分:", 0, ["60", "500", "5000"], "500", row=2)
+        self.tokens_per_minute_var = self._create_combobox(processing_frame, "トークン/分:", 2, ["30000", "450000", "800000"], "30000", row=2)
+        self.write_flush_rows_var = self._create_combobox(processing_frame, "書込み単位(行):", 4, ["20", "50", "100", "200"], "50", row=2)
+        self.write_flush_interval_var = self._create_combobox(processing_frame, "書込み間隔(秒):", 6, ["10.0", "30.0", "60.0"], "30.0", row=2)
 
 
         # --- ボタン (共通) ---
@@ -76,13 +131,27 @@ class DescriptionGeneratorGUI:
         self.start_button.pack(side="left", padx=5)
         self.stop_button = ttk.Button(button_frame, text="処理停止", command=self.stop_processing, state="disabled")
         self.stop_button.pack(side="left", padx=5)
+        self.plan_button = ttk.Button(button_frame, text="見積もり", command=self.estimate_plan)
+        self.plan_button.pack(side="left", padx=5)
+        self.execute_plan_button = ttk.Button(button_frame, text="計画を実行", command=self.execute_plan_file)
+        self.execute_plan_button.pack(side="left", padx=5)
         ttk.Button(button_frame, text="設定保存", command=self.save_config).pack(side="left", padx=5)
         ttk.Button(button_frame, text="設定読込", command=self.load_config).pack(side="left", padx=5)
         ttk.Button(button_frame, text="接続テスト", command=self.test_connection).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="ジョブキュー", command=self.open_job_queue).pack(side="left", padx=5)
+
+        # --- 進捗 (共通) ---
+        progress_frame = ttk.Frame(main_frame, padding=(0, 0, 0, 5))
+        progress_frame.grid(row=4, column=0, sticky="ew")
+        progress_frame.columnconfigure(0, weight=1)
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="determinate", maximum=100)
+        self.progress_bar.grid(row=0, column=0, sticky="ew", padx=5)
+        self.progress_label_var = tk.StringVar(value="待機中")
+        ttk.Label(progress_frame, textvariable=self.progress_label_var, width=52).grid(row=0, column=1, sticky="w", padx=5)
 
         # --- ログエリア (共通) ---
-        log_frame = self._create_section(main_frame, "ログ", 4)
-        main_frame.rowconfigure(4, weight=1)
+        log_frame = self._create_section(main_frame, "ログ", 5)
+        main_frame.rowconfigure(5, weight=1)
         self.log_text = scrolledtext.ScrolledText(log_frame, width=90, height=15, wrap=tk.WORD, relief="solid", bd=1)
         self.log_text.pack(expand=True, fill="both", padx=5, pady=5)
         ttk.Button(log_frame, text="ログクリア", command=self.clear_log).pack(anchor="w", padx=5, pady=(0,5))
@@ -144,6 +213,9 @@ class DescriptionGeneratorGUI:
         ttk.Label(parent, text=label_text).grid(row=row, column=0, sticky="w", pady=2, padx=5)
         ttk.Entry(parent, textvariable=var, **kwargs).grid(row=row, column=1, sticky="w", pady=2, padx=5)
 
+    def _create_checkbox(self, parent, label_text, row, col, var):
+        ttk.Checkbutton(parent, text=label_text, variable=var).grid(row=row, column=col, columnspan=2, sticky="w", pady=2, padx=5)
+
     def _create_file_input(self, parent, label_text, row, var):
         ttk.Label(parent, text=label_text).grid(row=row, column=0, sticky="w", pady=2, padx=5)
         frame = ttk.Frame(parent)
@@ -153,28 +225,87 @@ class DescriptionGeneratorGUI:
         entry.grid(row=0, column=0, sticky="ew")
         ttk.Button(frame, text="参照...", command=lambda: self.browse_credentials(var)).grid(row=0, column=1, padx=5)
 
-    def _create_combobox(self, parent, label_text, col, values, default_value):
+    def _create_combobox(self, parent, label_text, col, values, default_value, row=0):
         """
         Comboboxウィジェットを作成し、gridで配置します。
         """
         var = tk.StringVar(value=default_value)
-        ttk.Label(parent, text=label_text).grid(row=0, column=col, sticky="w", padx=(10, 2))
+        ttk.Label(parent, text=label_text).grid(row=row, column=col, sticky="w", padx=(10, 2))
         combo = ttk.Combobox(parent, textvariable=var, values=values, width=6, state="readonly")
-        combo.grid(row=0, column=col + 1, sticky="w", padx=(0, 10))
+        combo.grid(row=row, column=col + 1, sticky="w", padx=(0, 10))
         return var
 
     def browse_credentials(self, var):
         filename = filedialog.askopenfilename(title="Google API認証ファイルを選択", filetypes=[("JSON files", "*.json")])
         if filename: var.set(filename)
 
-    def log_message(self, message):
-        self.root.after(0, self._append_log, f"[{datetime.now():%H:%M:%S}] {message}\n")
+    def _create_file_logger(self):
+        """ログの全文を保存する、ローテーション付きのファイルロガーを作成します。"""
+        logger = logging.getLogger("desgen_gui")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        if not logger.handlers:
+            try:
+                os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    LOG_FILE, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+                logger.addHandler(handler)
+            except OSError:
+                pass
+        return logger
 
-    def _append_log(self, message):
-        self.log_text.insert(tk.END, message)
-        self.log_text.see(tk.END)
+    def log_message(self, message):
+        # どのスレッドからも呼ばれるため、ここではためるだけにして描画は _flush_log で行う
+        self.file_logger.info(message)
+        self._pending_log.append(f"[{datetime.now():%H:%M:%S}] {message}")
+
+    def _flush_log(self):
+        """たまったログをまとめて描画し、表示を最新の LOG_MAX_LINES 行に切り詰めます。"""
+        lines = []
+        while self._pending_log:
+            try:
+                lines.append(self._pending_log.popleft())
+            except IndexError:
+                break
+        if lines:
+            self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+            excess = int(self.log_text.index("end-1c").split(".")[0]) - LOG_MAX_LINES
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            self.log_text.see(tk.END)
+        self._update_progress()
+        self.root.after(LOG_FLUSH_MS, self._flush_log)
+
+    def _on_progress(self, progress):
+        # 処理スレッドから呼ばれる。最新の値だけを残し、描画は _flush_log で行う
+        self._latest_progress = progress
+
+    def _update_progress(self):
+        progress, self._latest_progress = self._latest_progress, None
+        if progress is None:
+            return
+        total, done = progress["total"], progress["done"]
+        if total:
+            percent = min(100.0, done / total * 100)
+        else:
+            percent = 100.0 if progress["finished"] else 0.0
+        self.progress_bar["value"] = percent
+        eta = progress["eta_seconds"]
+        eta_text = self._format_duration(eta) if eta is not None else "--:--:--"
+        self.progress_label_var.set(
+            f"{done} / {total} 行 ({percent:.1f}%) | {progress['rows_per_second']:.1f} 行/秒 | 残り {eta_text}"
+        )
+
+    @staticmethod
+    def _format_duration(seconds):
+        hours, remainder = divmod(int(seconds), 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
     def clear_log(self):
+        self._pending_log.clear()
         self.log_text.delete(1.0, tk.END)
 
     def validate_settings(self):
@@ -185,7 +316,11 @@ class DescriptionGeneratorGUI:
         except ValueError: return "開始行は半角数値を入力してください。"
         return None
 
-    def start_processing(self):
+    def start_processing(self, task=None):
+        """
+        処理を別スレッドで開始します。task (processor を受け取る関数) を渡すと、
+        選択中のタブの処理の代わりにそれを実行します (見積もり・計画の実行用)。
+        """
         error = self.validate_settings()
         if error:
             messagebox.showerror("設定エラー", error)
@@ -193,61 +328,216 @@ class DescriptionGeneratorGUI:
         if self.is_processing:
             messagebox.showwarning("処理中", "既に処理が実行中です。")
             return
+        if self.job_queue is not None and self.job_queue.running:
+            messagebox.showwarning("処理中", "ジョブキューが実行中です。終了してから開始してください。")
+            return
         
         self.is_processing = True
-        self.start_button.config(state="disabled")
+        for button in (self.start_button, self.plan_button, self.execute_plan_button):
+            button.config(state="disabled")
         self.stop_button.config(state="normal")
         self.clear_log()
+        self.progress_bar["value"] = 0
+        self.progress_label_var.set("開始しています...")
         
-        threading.Thread(target=self._run_processing, daemon=True).start()
+        threading.Thread(target=self._run_processing, args=(task,), daemon=True).start()
 
     def stop_processing(self):
         if self.processor:
             self.processor.stop_processing()
         self.stop_button.config(state="disabled")
 
-    def _run_processing(self):
+    def _run_processing(self, task=None):
         try:
             self.processor = DescriptionGeneratorCore(
                 self.credentials_var.get(), self.openai_api_key_var.get(), self.log_message
             )
-            self.processor.batch_size = int(self.batch_size_var.get())
-            self.processor.translation_delay = float(self.translation_delay_var.get())
-            self.processor.batch_delay = float(self.batch_delay_var.get())
+            self.processor.apply_settings(self.get_config_as_dict())
+            self.processor.progress_callback = self._on_progress
+            if task is not None:
+                task(self.processor)
+                return
             
             # 選択中のタブに応じて処理を分岐
             selected_tab_index = self.notebook.index(self.notebook.select())
             
+            column_settings = self._current_column_settings()
+            
             if selected_tab_index == 0: # 通常モード
                 self.log_message("🚀 通常モードで処理を開始します。")
-                column_settings = {
-                    'input_col': self.nm_input_col_var.get(),
-                    'translated_name_col': self.nm_translated_name_col_var.get(),
-                    'jan_code_col': self.nm_jan_code_col_var.get(),
-                    'description_col': self.nm_description_col_var.get(),
-                    'output_col': self.nm_output_col_var.get()
-                }
                 self.processor.process_product_descriptions(
                     self.spreadsheet_id_var.get(), self.sheet_name_var.get(),
-                    column_settings, int(self.start_row_var.get())
+                    column_settings, int(self.start_row_var.get()), resume=self.resume_var.get()
                 )
             else: # 書籍モード
                 self.log_message("📚 書籍モードで処理を開始します。")
-                column_settings = {key: var.get() for key, (var, _, _, _) in self.bm_vars.items()}
                 self.processor.process_book_descriptions(
                     self.spreadsheet_id_var.get(), self.sheet_name_var.get(),
-                    column_settings, int(self.start_row_var.get())
+                    column_settings, int(self.start_row_var.get()), resume=self.resume_var.get()
                 )
 
         except Exception as e:
             self.log_message(f"❌ 致命的なエラーが発生しました: {e}")
             messagebox.showerror("実行時エラー", f"処理中に予期せぬエラーが発生しました:\n{e}")
         finally:
+            # 実行ごとに新しい DescriptionGeneratorCore を作るため、前回のストアはここで閉じる
+            if self.processor is not None:
+                self.processor.close()
             self.root.after(0, self._reset_ui)
 
+    def estimate_plan(self):
+        """ドライラン: 選択中のタブの処理内容 (行数・トークン数・コスト・所要時間) を見積もり、計画ファイルに保存します。"""
+        mode = "normal" if self.notebook.index(self.notebook.select()) == 0 else "book"
+        spreadsheet_id, sheet_name = self.spreadsheet_id_var.get(), self.sheet_name_var.get()
+        column_settings, settings = self._current_column_settings(), self.get_config_as_dict()
+        start_row, resume = self.start_row_var.get(), self.resume_var.get()
+
+        def run(processor):
+            plan = processor.plan_run(
+                mode, spreadsheet_id, sheet_name, column_settings, int(start_row), resume=resume, settings=settings
+            )
+            if plan:
+                message = "\n".join(summary_lines(plan)) + f"\n\n計画ファイル: {plan['path']}\n「計画を実行」で、この内容のとおりに処理できます。"
+                self.root.after(0, lambda: messagebox.showinfo("見積もり", message))
+
+        self.start_processing(run)
+
+    def execute_plan_file(self):
+        """「見積もり」で保存した計画ファイルを選び、計画時の設定で計画に含まれる行だけを処理します。"""
+        path = filedialog.askopenfilename(
+            title="計画ファイルを選択", initialdir=DEFAULT_PLAN_DIR if os.path.isdir(DEFAULT_PLAN_DIR) else None,
+            filetypes=[("計画ファイル", "*.json"), ("すべてのファイル", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            plan = load_plan(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("計画ファイル", f"計画ファイルを読み込めませんでした:\n{e}")
+            return
+        if not messagebox.askyesno("計画を実行", "\n".join(summary_lines(plan)) + "\n\nこの計画を実行しますか？"):
+            return
+        resume = self.resume_var.get()
+        self.start_processing(lambda processor: processor.execute_plan(plan, resume=resume))
+
+    def _current_column_settings(self):
+        """選択中のタブの列設定を辞書で返します。"""
+        if self.notebook.index(self.notebook.select()) == 0:
+            return {
+                'input_col': self.nm_input_col_var.get(),
+                'translated_name_col': self.nm_translated_name_col_var.get(),
+                'jan_code_col': self.nm_jan_code_col_var.get(),
+                'description_col': self.nm_description_col_var.get(),
+                'output_col': self.nm_output_col_var.get()
+            }
+        return {key: var.get() for key, (var, _, _, _) in self.bm_vars.items()}
+
+    def open_job_queue(self):
+        """複数のシートを順番に (または並行して) 処理するジョブキューの画面を開きます。"""
+        if self.job_window is not None and self.job_window.winfo_exists():
+            self.job_window.lift()
+            return
+        window = tk.Toplevel(self.root)
+        window.title("ジョブキュー")
+        window.geometry("700x360")
+        window.columnconfigure(0, weight=1)
+        window.rowconfigure(0, weight=1)
+        self.job_window = window
+
+        columns = ("name", "mode", "priority", "status", "progress")
+        self.job_tree = ttk.Treeview(window, columns=columns, show="headings", selectmode="extended")
+        for column, heading, width in zip(columns, ("ジョブ", "モード", "優先度", "状態", "進捗"), (260, 70, 60, 70, 150)):
+            self.job_tree.heading(column, text=heading)
+            self.job_tree.column(column, width=width, anchor="w" if column == "name" else "center")
+        self.job_tree.grid(row=0, column=0, sticky="nsew", padx=10, pady=(10, 5))
+
+        controls = ttk.Frame(window, padding=(10, 0, 10, 10))
+        controls.grid(row=1, column=0, sticky="ew")
+        ttk.Label(controls, text="優先度:").pack(side="left")
+        self.job_priority_var = tk.StringVar(value="1")
+        ttk.Combobox(controls, textvariable=self.job_priority_var, values=["1", "2", "3", "5"], width=4, state="readonly").pack(side="left", padx=(0, 10))
+        ttk.Label(controls, text="同時実行数:").pack(side="left")
+        self.job_concurrency_var = tk.StringVar(value="2")
+        ttk.Combobox(controls, textvariable=self.job_concurrency_var, values=["1", "2", "3", "4"], width=4, state="readonly").pack(side="left", padx=(0, 10))
+        ttk.Button(controls, text="現在の設定を追加", command=self.add_job_from_settings).pack(side="left", padx=5)
+        ttk.Button(controls, text="選択を取消", command=self.cancel_selected_jobs).pack(side="left", padx=5)
+        ttk.Button(controls, text="実行", command=self.run_job_queue, style="Accent.TButton").pack(side="left", padx=5)
+        ttk.Button(controls, text="すべて停止", command=self.stop_job_queue).pack(side="left", padx=5)
+        self._refresh_job_queue()
+
+    def _get_job_queue(self):
+        if self.job_queue is None:
+            credentials, api_key = self.credentials_var.get(), self.openai_api_key_var.get()
+            config = self.get_config_as_dict()
+            # リミッターはキューを作った時点の設定で全ジョブに共有する
+            self.job_queue = JobQueue(
+                lambda log: DescriptionGeneratorCore(credentials, api_key, log), config,
+                int(self.job_concurrency_var.get()),
+                requests_per_minute=int(config['requests_per_minute_var']),
+                tokens_per_minute=int(config['tokens_per_minute_var']),
+                log=self.log_message
+            )
+        return self.job_queue
+
+    def add_job_from_settings(self):
+        """現在のスプレッドシート・シート・選択中のタブの列設定をジョブとして追加します。"""
+        error = self.validate_settings()
+        if error:
+            messagebox.showerror("設定エラー", error, parent=self.job_window)
+            return
+        self._get_job_queue().add_job(
+            self.spreadsheet_id_var.get(), self.sheet_name_var.get(),
+            "normal" if self.notebook.index(self.notebook.select()) == 0 else "book",
+            self._current_column_settings(), int(self.start_row_var.get()),
+            priority=int(self.job_priority_var.get()), resume=self.resume_var.get()
+        )
+        self._refresh_job_queue(schedule=False)
+
+    def cancel_selected_jobs(self):
+        if self.job_queue is None:
+            return
+        for item in self.job_tree.selection():
+            self.job_queue.cancel(int(item))
+
+    def run_job_queue(self):
+        if self.job_queue is None or not any(job["status"] == "queued" for job in self.job_queue.status()):
+            messagebox.showinfo("ジョブキュー", "待機中のジョブがありません。", parent=self.job_window)
+            return
+        if self.is_processing:
+            messagebox.showwarning("処理中", "通常の処理が実行中です。終了してから実行してください。", parent=self.job_window)
+            return
+        if self.job_queue.running:
+            # 実行中のキューは追加されたジョブも自動で開始する
+            return
+        self.job_queue.max_concurrent_jobs = int(self.job_concurrency_var.get())
+        self.job_queue.settings = self.get_config_as_dict()
+        self.job_queue.start()
+
+    def stop_job_queue(self):
+        if self.job_queue is not None:
+            self.job_queue.stop()
+
+    def _refresh_job_queue(self, schedule=True):
+        if self.job_window is None or not self.job_window.winfo_exists():
+            return
+        jobs = self.job_queue.status() if self.job_queue else []
+        existing = set(self.job_tree.get_children())
+        for job in jobs:
+            item = str(job["job_id"])
+            progress = job["progress"]
+            progress_text = f"{progress['done']} / {progress['total']} 行" if progress else ""
+            values = (job["name"], job["mode"], job["priority"], JOB_STATUS_LABELS.get(job["status"], job["status"]), progress_text)
+            if item in existing:
+                self.job_tree.item(item, values=values)
+            else:
+                self.job_tree.insert("", "end", iid=item, values=values)
+        if schedule:
+            self.root.after(JOB_REFRESH_MS, self._refresh_job_queue)
+
     def _reset_ui(self):
         self.is_processing = False
-        self.start_button.config(state="normal")
+        for button in (self.start_button, self.plan_button, self.execute_plan_button):
+            button.config(state="normal")
         self.stop_button.config(state="disabled")
         self.processor = None
 
@@ -259,6 +549,7 @@ class DescriptionGeneratorGUI:
         
         self.log_message("🔍 接続テストを開始します...")
         def run_test():
+            core = None
             try:
                 core = DescriptionGeneratorCore(self.credentials_var.get(), self.openai_api_key_var.get(), self.log_message)
                 self.log_message("...Google Sheetsに接続中...")
@@ -271,6 +562,9 @@ class DescriptionGeneratorGUI:
                 else: self.log_message("❌ OpenAI API接続: 失敗。APIキーまたはネットワーク設定を確認してください。")
             except Exception as e:
                 self.log_message(f"❌ 接続テスト失敗: {e}")
+            finally:
+                if core is not None:
+                    core.close()
         threading.Thread(target=run_test, daemon=True).start()
 
     def get_config_as_dict(self):
@@ -282,8 +576,25 @@ class DescriptionGeneratorGUI:
             'sheet_name_var': self.sheet_name_var.get(),
             'start_row_var': self.start_row_var.get(),
             'batch_size_var': self.batch_size_var.get(),
-            'translation_delay_var': self.translation_delay_var.get(),
-            'batch_delay_var': self.batch_delay_var.get(),
+            'max_workers_var': self.max_workers_var.get(),
+            'requests_per_minute_var': self.requests_per_minute_var.get(),
+            'tokens_per_minute_var': self.tokens_per_minute_var.get(),
+            'write_flush_rows_var': self.write_flush_rows_var.get(),
+            'write_flush_interval_var': self.write_flush_interval_var.get(),
+            'prefetch_batches_var': self.prefetch_batches_var.get(),
+            'use_translation_cache_var': self.use_translation_cache_var.get(),
+            'book_field_batching_var': self.book_field_batching_var.get(),
+            'pack_translations_var': self.pack_translations_var.get(),
+            'pack_token_budget_var': self.pack_token_budget_var.get(),
+            'incremental_var': self.incremental_var.get(),
+            'resume_var': self.resume_var.get(),
+            'template_var': self.template_var.get(),
+            'html_output_var': self.html_output_var.get(),
+            'enrich_bibliography_var': self.enrich_bibliography_var.get(),
+            'dedup_var': self.dedup_var.get(),
+            'dedup_threshold_var': self.dedup_threshold_var.get(),
+            'chunk_token_budget_var': self.chunk_token_budget_var.get(),
+            'model_routing_var': self.model_routing_var.get(),
             'selected_tab': self.notebook.index(self.notebook.select()),
             'normal_mode': {
                 'input_col': self.nm_input_col_var.get(),
@@ -318,8 +629,25 @@ class DescriptionGeneratorGUI:
             self.sheet_name_var.set(config.get('sheet_name_var', '集計'))
             self.start_row_var.set(config.get('start_row_var', '2'))
             self.batch_size_var.set(config.get('batch_size_var', '20'))
-            self.translation_delay_var.set(config.get('translation_delay_var', '1.0'))
-            self.batch_delay_var.set(config.get('batch_delay_var', '5.0'))
+            self.max_workers_var.set(config.get('max_workers_var', '4'))
+            self.requests_per_minute_var.set(config.get('requests_per_minute_var', '500'))
+            self.tokens_per_minute_var.set(config.get('tokens_per_minute_var', '30000'))
+            self.write_flush_rows_var.set(config.get('write_flush_rows_var', '50'))
+            self.write_flush_interval_var.set(config.get('write_flush_interval_var', '30.0'))
+            self.prefetch_batches_var.set(config.get('prefetch_batches_var', '2'))
+            self.use_translation_cache_var.set(config.get('use_translation_cache_var', True))
+            self.book_field_batching_var.set(config.get('book_field_batching_var', True))
+            self.pack_translations_var.set(config.get('pack_translations_var', True))
+            self.pack_token_budget_var.set(config.get('pack_token_budget_var', '2000'))
+            self.incremental_var.set(config.get('incremental_var', False))
+            self.resume_var.set(config.get('resume_var', True))
+            self.template_var.set(config.get('template_var', DEFAULT_TEMPLATE_SET))
+            self.html_output_var.set(config.get('html_output_var', "inline"))
+            self.enrich_bibliography_var.set(config.get('enrich_bibliography_var', False))
+            self.dedup_var.set(config.get('dedup_var', False))
+            self.dedup_threshold_var.set(config.get('dedup_threshold_var', str(DEFAULT_THRESHOLD)))
+            self.chunk_token_budget_var.set(config.get('chunk_token_budget_var', '800'))
+            self.model_routing_var.set(config.get('model_routing_var', False))
             
             # 通常モード設定
             nm_config = config.get('normal_mode', {})
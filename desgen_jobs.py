@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# ジョブキュー: 複数のスプレッドシート・シートを、共有のレート制限の下で並行して処理します
+import itertools
+import threading
+import time
+from desgen_ratelimit import FairRateLimiter
+from desgen_resilience import ResilientCaller
+from desgen_store import RowHashStore, ProgressJournal
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+MODES = ("normal", "book")
+
+_job_ids = itertools.count(1)
+
+
+class Job:
+    """
+    1件のジョブ (スプレッドシート・シート・モード・列設定)。
+    priority が大きいジョブほど先に開始し、同時に動いている間は priority の比でレート制限の枠を分け合います。
+    """
+    def __init__(self, spreadsheet_id, sheet_name, mode, column_settings, start_row=2, priority=1, resume=True, name=None):
+        if mode not in MODES:
+            raise ValueError(f"不明なモードです: {mode}")
+        self.job_id = next(_job_ids)
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.mode = mode
+        self.column_settings = dict(column_settings)
+        self.start_row = int(start_row)
+        self.priority = max(1, int(priority))
+        self.resume = resume
+        self.name = name or f"{sheet_name} ({mode})"
+        self.status = QUEUED
+        self.totals = {"success": 0, "failed": 0}
+        self.progress = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.processor = None
+
+    def to_dict(self):
+        """表示・保存用に、ジョブの状態を辞書で返します。"""
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "spreadsheet_id": self.spreadsheet_id,
+            "sheet_name": self.sheet_name,
+            "mode": self.mode,
+            "priority": self.priority,
+            "status": self.status,
+            "totals": dict(self.totals),
+            "progress": dict(self.progress) if self.progress else None,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    ジョブを max_concurrent_jobs 件まで同時に実行するキュー。
+    OpenAI と Sheets API のレート制限 (FairRateLimiter) とサーキットブレーカーは全ジョブで共有し、
+    1つのジョブがレート制限を受けると全ジョブが一緒に待機します。
+    翻訳キャッシュ・ジャーナル・差分処理用のハッシュも共有します。
+    processor_factory はジョブごとに DescriptionGeneratorCore を作る関数で、引数にログ関数を受け取ります。
+    """
+    def __init__(self, processor_factory, settings=None, max_concurrent_jobs=2,
+                 requests_per_minute=500, tokens_per_minute=30000, sheets_requests_per_minute=300, log=print):
+        self.processor_factory = processor_factory
+        self.settings = dict(settings or {})
+        self.max_concurrent_jobs = max(1, int(max_concurrent_jobs))
+        self.log = log
+        self.rate_limiter = FairRateLimiter(requests_per_minute, tokens_per_minute)
+        self.sheets_rate_limiter = FairRateLimiter(sheets_requests_per_minute, 0)
+        # 振り分けで別枠にしたモデルのリミッターも全ジョブで共有する
+        self.model_rate_limiters = {}
+        self.openai_caller = ResilientCaller("OpenAI", log=log)
+        self.sheets_caller = ResilientCaller("Google Sheets", log=log)
+        self.translation_cache = None
+        self.journal = None
+        self.row_hash_store = None
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._changed = threading.Condition(self._lock)
+        self._runner = None
+
+    def add_job(self, spreadsheet_id, sheet_name, mode, column_settings, start_row=2, priority=1, resume=True, name=None):
+        job = Job(spreadsheet_id, sheet_name, mode, column_settings, start_row, priority, resume, name)
+        with self._changed:
+            self.jobs.append(job)
+            self._changed.notify_all()
+        self.log(f"📋 ジョブを追加しました: #{job.job_id} {job.name} (優先度 {job.priority})")
+        return job
+
+    def cancel(self, job_id):
+        """待機中のジョブは取り消し、実行中のジョブは中断します。"""
+        with self._changed:
+            for job in self.jobs:
+                if job.job_id != job_id:
+                    continue
+                if job.status == QUEUED:
+                    job.status = CANCELLED
+                elif job.status == RUNNING and job.processor:
+                    job.processor.stop_processing()
+                self._changed.notify_all()
+                return True
+        return False
+
+    def status(self):
+        with self._lock:
+            return [job.to_dict() for job in self.jobs]
+
+    def stop(self):
+        """待機中のジョブをすべて取り消し、実行中のジョブを中断します。"""
+        self._stop_event.set()
+        with self._changed:
+            for job in self.jobs:
+                if job.status == QUEUED:
+                    job.status = CANCELLED
+                elif job.status == RUNNING and job.processor:
+                    job.processor.stop_processing()
+            self._changed.notify_all()
+
+    def close(self):
+        """キューで共有するストア (翻訳キャッシュ・ジャーナル・差分処理用のハッシュ) を閉じます。次の run() で開き直します。"""
+        for store in (self.translation_cache, self.journal, self.row_hash_store):
+            if store is not None:
+                store.close()
+        self.translation_cache = self.journal = self.row_hash_store = None
+
+    @property
+    def running(self):
+        return self._runner is not None and self._runner.is_alive()
+
+    def start(self):
+        """run() をバックグラウンドのスレッドで開始します。"""
+        self._runner = threading.Thread(target=self.run, name="desgen-jobs", daemon=True)
+        self._runner.start()
+        return self._runner
+
+    def run(self):
+        """
+        待機中のジョブがなくなるまで実行します (実行中に追加されたジョブも実行します)。
+        全ジョブの状態の一覧を返します。
+        """
+        self._stop_event.clear()
+        self._open_shared_stores()
+        threads = []
+        self.log(f"🗂️ ジョブキューを開始します (同時実行 {self.max_concurrent_jobs} 件)。")
+        with self._changed:
+            while True:
+                running = sum(1 for job in self.jobs if job.status == RUNNING)
+                queued = [job for job in self.jobs if job.status == QUEUED]
+                if not queued and not running:
+                    break
+                if queued and running < self.max_concurrent_jobs and not self._stop_event.is_set():
+                    # 優先度の高い順、同じ優先度なら追加した順に開始する
+                    job = min(queued, key=lambda candidate: (-candidate.priority, candidate.job_id))
+                    job.status = RUNNING
+                    thread = threading.Thread(target=self._run_job, args=(job,), name=f"desgen-job-{job.job_id}", daemon=True)
+                    threads.append(thread)
+                    thread.start()
+                    continue
+                self._changed.wait(1.0)
+        for thread in threads:
+            thread.join()
+        summary = self.status()
+        done = sum(1 for job in summary if job["status"] == DONE)
+        self.log(f"🗂️ ジョブキューが終了しました: 完了 {done} 件 / 全 {len(summary)} 件")
+        return summary
+
+    def _open_shared_stores(self):
+        if self.journal is None:
+            self.journal = ProgressJournal()
+        if self.row_hash_store is None:
+            self.row_hash_store = RowHashStore()
+
+    def _run_job(self, job):
+        prefix = f"[#{job.job_id} {job.name}]"
+        processor = None
+        try:
+            processor = self._create_processor(job, lambda message: self.log(f"{prefix} {message}"))
+            with self._lock:
+                if self._stop_event.is_set() or job.status != RUNNING:
+                    job.status = CANCELLED
+                    return
+                job.processor = processor
+                job.started_at = time.time()
+            if job.mode == "normal":
+                totals = processor.process_product_descriptions(
+                    job.spreadsheet_id, job.sheet_name, job.column_settings, job.start_row, resume=job.resume
+                )
+            else:
+                totals = processor.process_book_descriptions(
+                    job.spreadsheet_id, job.sheet_name, job.column_settings, job.start_row, resume=job.resume
+                )
+            job.totals = totals
+            job.status = CANCELLED if processor.stop_flag else DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+            self.log(f"{prefix} ❌ ジョブが失敗しました: {e}")
+        finally:
+            if processor is not None:
+                # キューで共有するストアは残し、ジョブごとに開いたもの (類似文の索引・書誌情報キャッシュなど) だけを閉じる
+                processor.translation_cache = processor.journal = processor.row_hash_store = None
+                processor.close()
+            with self._changed:
+                job.finished_at = time.time()
+                job.processor = None
+                self._changed.notify_all()
+
+    def _create_processor(self, job, log):
+        """ジョブ用の DescriptionGeneratorCore を作り、キューで共有するリミッターやストアを設定します。"""
+        processor = self.processor_factory(log)
+        # キャッシュはキューで共有するため、ジョブごとには開かない
+        processor.apply_settings({key: value for key, value in self.settings.items() if key != "use_translation_cache_var"})
+        processor.rate_limiter = self.rate_limiter
+        processor.model_rate_limiters = self.model_rate_limiters
+        # 別枠のモデルでも、ジョブの優先度に応じて枠を分け合う
+        processor.rate_limiter_factory = lambda model, requests_per_minute, tokens_per_minute: FairRateLimiter(
+            requests_per_minute, tokens_per_minute
+        )
+        processor.sheets_rate_limiter = self.sheets_rate_limiter
+        processor.rate_limit_client = job.job_id
+        processor.rate_limit_weight = job.priority
+        processor.openai_caller = self.openai_caller
+        processor.sheets_caller = self.sheets_caller
+        with self._lock:
+            if self.settings.get("use_translation_cache_var") and self.translation_cache is None:
+                # 最初のジョブで開いた (古いプロンプトのエントリを整理済みの) キャッシュを全ジョブで使う
+                processor.enable_translation_cache()
+                self.translation_cache = processor.translation_cache
+        processor.translation_cache = self.translation_cache
+        processor.journal = self.journal
+        processor.row_hash_store = self.row_hash_store
+        processor.progress_callback = lambda progress: setattr(job, "progress", progress)
+        return processor
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+# 計測: 段ごとの処理時間・トークン使用量・推定コスト・キャッシュ/リトライの集計と、JSON / Prometheus 形式での出力
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# モデルごとの料金 (USD / 100万トークン): (入力, 出力)。表にないモデルのコストは集計しません
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+STAGES = ("index", "fetch", "enrich", "translate", "render", "write")
+# 実行レポートの保存数の既定の上限 (古いものから削除する)
+DEFAULT_REPORT_KEEP = 200
+# 実行レポートのファイル名 (日時_モード.json)。これ以外のファイルは削除しない
+_REPORT_NAME_PATTERN = re.compile(r"^\d{8}_\d{6}_\d{6}_[\w-]+\.json$")
+
+
+def prune_reports(directory, keep=DEFAULT_REPORT_KEEP, max_age_days=None):
+    """
+    directory の実行レポートのうち、新しい keep 件より古いものと、max_age_days 日より古いものを削除します。
+    keep / max_age_days が None または 0 の場合はその条件では削除しません。削除した件数を返します。
+    """
+    if not os.path.isdir(directory):
+        return 0
+    # ファイル名の先頭が日時なので、名前順が作成順になる
+    names = sorted(name for name in os.listdir(directory) if _REPORT_NAME_PATTERN.match(name))
+    expired = set(names[:-keep] if keep else ())
+    if max_age_days:
+        cutoff = time.time() - max_age_days * 86400
+        expired.update(name for name in names if os.path.getmtime(os.path.join(directory, name)) < cutoff)
+    for name in expired:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            # 同じディレクトリを使う別のプロセスが先に削除した
+            pass
+    return len(expired)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, prices=MODEL_PRICES):
+    """トークン数から料金(USD)を見積もります。料金表にないモデルは None を返します。"""
+    if model not in prices:
+        return None
+    input_price, output_price = prices[model]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class RunMetrics:
+    """
+    1回の実行の計測値を集めるスレッドセーフなコレクター。
+    段 (index / fetch / enrich / translate / render / write) は別スレッドで並行して動くため、段ごとの時間の合計は総処理時間を超えることがあります。
+    """
+    def __init__(self, mode, job_key, prices=MODEL_PRICES):
+        self.mode = mode
+        self.job_key = job_key
+        self.prices = prices
+        self.started_at = time.time()
+        self.finished_at = None
+        self.stages = {name: {"calls": 0, "seconds": 0.0, "rows": 0} for name in STAGES}
+        self.models = {}
+        self.counters = {}
+        self.rows = {"success": 0, "failed": 0}
+        self.cache = {}
+        self.retries = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started, rows)
+
+    def record_stage(self, name, seconds, rows=0):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "rows": 0})
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+            stage["rows"] += rows
+
+    def record_completion(self, model, prompt_tokens, completion_tokens):
+        with self._lock:
+            usage = self.models.setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            usage["requests"] += 1
+            usage["prompt_tokens"] += prompt_tokens or 0
+            usage["completion_tokens"] += completion_tokens or 0
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self, totals, cache=None, retries=None):
+        with self._lock:
+            self.finished_at = time.time()
+            self.rows = dict(totals)
+            self.cache = dict(cache or {})
+            self.retries = dict(retries or {})
+
+    @property
+    def cost(self):
+        """料金表にあるモデルの推定コスト(USD)の合計。"""
+        with self._lock:
+            costs = [
+                estimate_cost(model, usage["prompt_tokens"], usage["completion_tokens"], self.prices)
+                for model, usage in self.models.items()
+            ]
+        return sum(cost for cost in costs if cost is not None)
+
+    def report(self):
+        """実行レポートを辞書で返します。実行中に呼んだ場合はその時点の値です。"""
+        cost = self.cost
+        with self._lock:
+            finished_at = self.finished_at or time.time()
+            success = self.rows.get("success", 0)
+            stages = {
+                name: dict(stage, seconds=round(stage["seconds"], 3),
+                           seconds_per_row=round(stage["seconds"] / stage["rows"], 4) if stage["rows"] else None)
+                for name, stage in self.stages.items()
+            }
+            models = {
+                model: dict(usage, cost_usd=estimate_cost(model, usage["prompt_tokens"], usage["completion_tokens"], self.prices))
+                for model, usage in self.models.items()
+            }
+            return {
+                "mode": self.mode,
+                "job_key": self.job_key,
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+                "finished_at": datetime.fromtimestamp(finished_at).isoformat(timespec="seconds") if self.finished_at else None,
+                "duration_seconds": round(finished_at - self.started_at, 3),
+                "rows": dict(self.rows),
+                "stages": stages,
+                "models": models,
+                "tokens": {
+                    "prompt": sum(usage["prompt_tokens"] for usage in self.models.values()),
+                    "completion": sum(usage["completion_tokens"] for usage in self.models.values()),
+                },
+                "cost_usd": {
+                    "total": round(cost, 6),
+                    "per_row": round(cost / success, 8) if success else None,
+                },
+                "counters": dict(self.counters),
+                "cache": dict(self.cache),
+                "retries": dict(self.retries),
+            }
+
+    def write_json(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=4, ensure_ascii=False)
+
+    def to_prometheus(self):
+        """Prometheus のテキスト形式で、この実行の計測値を返します。"""
+        report = self.report()
+        labels = f'mode="{_escape_label(self.mode)}"'
+        lines = []
+
+        def metric(name, help_text, samples, metric_type="gauge"):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for extra, value in samples:
+                label_text = labels + (f",{extra}" if extra else "")
+                lines.append(f"{name}{{{label_text}}} {float(value)!r}")
+
+        metric("desgen_run_start_time_seconds", "Start time of the last run (unix time).", [("", self.started_at)])
+        metric("desgen_run_duration_seconds", "Duration of the last run.", [("", report["duration_seconds"])])
+        metric("desgen_run_rows", "Rows written or failed in the last run.",
+               [(f'status="{status}"', count) for status, count in report["rows"].items()])
+        metric("desgen_stage_seconds", "Time spent in each pipeline stage in the last run.",
+               [(f'stage="{name}"', stage["seconds"]) for name, stage in report["stages"].items()])
+        metric("desgen_stage_rows", "Rows handled by each pipeline stage in the last run.",
+               [(f'stage="{name}"', stage["rows"]) for name, stage in report["stages"].items()])
+        metric("desgen_completion_requests", "Completion requests in the last run.",
+               [(f'model="{_escape_label(model)}"', usage["requests"]) for model, usage in report["models"].items()])
+        metric("desgen_tokens", "Tokens reported by the completion API in the last run.",
+               [(f'model="{_escape_label(model)}",type="{kind}"', usage[f"{kind}_tokens"])
+                for model, usage in report["models"].items() for kind in ("prompt", "completion")])
+        metric("desgen_cost_usd", "Estimated completion cost of the last run in USD.", [("", report["cost_usd"]["total"])])
+        metric("desgen_events", "Translation sources and other events in the last run.",
+               [(f'event="{_escape_label(name)}"', count) for name, count in report["counters"].items()])
+        metric("desgen_cache", "Translation cache lookups in the last run.",
+               [(f'result="{name}"', report["cache"][name]) for name in ("hits", "misses") if name in report["cache"]])
+        metric("desgen_retries", "Retried calls per backend in the last run.",
+               [(f'backend="{_escape_label(name)}"', counts["retries"]) for name, counts in report["retries"].items()])
+        metric("desgen_breaker_trips", "Circuit breaker trips per backend in the last run.",
+               [(f'backend="{_escape_label(name)}"', counts["breaker_trips"]) for name, counts in report["retries"].items()])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """node_exporter の textfile collector で読めるよう、一時ファイルに書いてから置き換えます。"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsServer:
+    """
+    /metrics で Prometheus 形式のテキストを返すHTTPサーバー。
+    provider は応答のたびに呼ばれ、その時点のテキストを返す関数です。
+    既定ではこのマシンからの接続だけを受け付けます。他のマシンから収集する場合は host に "0.0.0.0" などを指定します。
+    """
+    def __init__(self, port, provider, host="127.0.0.1"):
+        self.provider = provider
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = (server.provider() or "").encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="desgen-metrics", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ProgressTracker:
+    """
+    実行中の進捗 (対象行数・成功/失敗/スキップ件数) を数え、直近の処理速度と残り時間を計算します。
+    callback を渡すと、件数が変わるたびに snapshot() の結果を渡して呼び出します (呼び出し元のスレッドで実行されます)。
+    """
+    def __init__(self, callback=None, window=30.0):
+        self.callback = callback
+        self.window = window
+        self.total = 0
+        self.success = 0
+        self.failed = 0
+        self.skipped = 0
+        self.finished = False
+        self.started_at = time.monotonic()
+        self._samples = deque([(self.started_at, 0)])
+        self._lock = threading.Lock()
+
+    def add_total(self, rows):
+        with self._lock:
+            self.total += rows
+        self._notify()
+
+    def record(self, success=0, failed=0, skipped=0):
+        if not (success or failed or skipped):
+            return
+        with self._lock:
+            self.success += success
+            self.failed += failed
+            self.skipped += skipped
+            now = time.monotonic()
+            self._samples.append((now, self.success + self.failed + self.skipped))
+            # 速度は直近 window 秒の件数から求める (最初のサンプルは残しておく)
+            while len(self._samples) > 2 and now - self._samples[1][0] > self.window:
+                self._samples.popleft()
+        self._notify()
+
+    def finish(self):
+        with self._lock:
+            self.finished = True
+        self._notify()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            done = self.success + self.failed + self.skipped
+            first_time, first_done = self._samples[0]
+            elapsed = now - first_time
+            rate = (done - first_done) / elapsed if elapsed > 0 else 0.0
+            remaining = max(0, self.total - done)
+            return {
+                "total": self.total,
+                "done": done,
+                "success": self.success,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "elapsed_seconds": now - self.started_at,
+                "rows_per_second": rate,
+                "eta_seconds": remaining / rate if rate > 0 and not self.finished else None,
+                "finished": self.finished,
+            }
+
+    def _notify(self):
+        if self.callback:
+            self.callback(self.snapshot())
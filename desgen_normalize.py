@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# ルールベースの正規化: 日付・言語・ページ数・寸法をLLMを使わずに英語表記へ変換
+import re
+import unicodedata
+from datetime import date
+
+MONTH_NAMES = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December",
+]
+
+# 元号と元年の前年 (西暦 = 基準年 + 元号の年)
+ERA_BASE_YEARS = {
+    "令和": 2018, "R": 2018,
+    "平成": 1988, "H": 1988,
+    "昭和": 1925, "S": 1925,
+    "大正": 1911, "T": 1911,
+    "明治": 1867, "M": 1867,
+}
+
+LANGUAGE_NAMES = {
+    "日本語": "Japanese",
+    "英語": "English",
+    "中国語": "Chinese",
+    "簡体字中国語": "Simplified Chinese",
+    "繁体字中国語": "Traditional Chinese",
+    "韓国語": "Korean",
+    "朝鮮語": "Korean",
+    "フランス語": "French",
+    "ドイツ語": "German",
+    "スペイン語": "Spanish",
+    "イタリア語": "Italian",
+    "ロシア語": "Russian",
+    "ポルトガル語": "Portuguese",
+    "オランダ語": "Dutch",
+    "タイ語": "Thai",
+    "ベトナム語": "Vietnamese",
+    "インドネシア語": "Indonesian",
+    "アラビア語": "Arabic",
+    "ラテン語": "Latin",
+    "ギリシャ語": "Greek",
+    "多言語": "Multilingual",
+}
+
+_ERA_PATTERN = "|".join(sorted(ERA_BASE_YEARS, key=len, reverse=True))
+_DATE_SUFFIX = r"(?:発売|発行|刊行|刊|頃)?"
+_DATE_PATTERNS = [
+    # 2021年3月15日 / 2021年3月 / 2021年
+    re.compile(r"^(?P<year>\d{4})年(?:(?P<month>\d{1,2})月(?:(?P<day>\d{1,2})日)?)?" + _DATE_SUFFIX + "$"),
+    # 令和3年3月15日 / 平成元年 / H31.4.1
+    re.compile(
+        r"^(?P<era>" + _ERA_PATTERN + r")\s*(?P<era_year>\d{1,2}|元)[年.\-/]?"
+        r"(?:(?P<month>\d{1,2})[月.\-/]?(?:(?P<day>\d{1,2})日?)?)?" + _DATE_SUFFIX + "$"
+    ),
+    # 2021/03/15 / 2021-3-15 / 2021.3
+    re.compile(r"^(?P<year>\d{4})[/.\-](?P<month>\d{1,2})(?:[/.\-](?P<day>\d{1,2}))?" + _DATE_SUFFIX + "$"),
+]
+
+_PAGES_PATTERN = re.compile(r"^(?:全|総)?\s*(?P<pages>\d[\d,]*)\s*(?:ページ|頁|p|pp|pages?)?\.?$", re.IGNORECASE)
+
+_NUMBER = r"\d+(?:\.\d+)?"
+_UNIT = r"(?:cm|mm|m|センチ(?:メートル)?|ミリ(?:メートル)?)"
+_UNIT_NAMES = {"センチ": "cm", "センチメートル": "cm", "ミリ": "mm", "ミリメートル": "mm"}
+_DIMENSION_PATTERN = re.compile(
+    r"^(?:[縦横高幅厚さ奥行]*\s*)?(?P<a>" + _NUMBER + r")\s*(?P<unit_a>" + _UNIT + r")?"
+    r"\s*[x×*]\s*(?:[縦横高幅厚さ奥行]*\s*)?(?P<b>" + _NUMBER + r")\s*(?P<unit_b>" + _UNIT + r")?"
+    r"(?:\s*[x×*]\s*(?:[縦横高幅厚さ奥行]*\s*)?(?P<c>" + _NUMBER + r")\s*(?P<unit_c>" + _UNIT + r")?)?$",
+    re.IGNORECASE
+)
+
+
+def _prepare(text):
+    # 全角数字・記号を半角にそろえ、前後の空白を除く (㎝ → cm も含む)
+    return unicodedata.normalize("NFKC", text).strip()
+
+
+def normalize_date(text):
+    """和暦・西暦の日付を "March 15, 2021" / "March 2021" / "2021" の形式に変換します。"""
+    value = _prepare(text).replace(" ", "")
+    for pattern in _DATE_PATTERNS:
+        match = pattern.match(value)
+        if not match:
+            continue
+        parts = match.groupdict()
+        if parts.get("era"):
+            era_year = 1 if parts["era_year"] == "元" else int(parts["era_year"])
+            year = ERA_BASE_YEARS[parts["era"]] + era_year
+        else:
+            year = int(parts["year"])
+        month = int(parts["month"]) if parts.get("month") else None
+        day = int(parts["day"]) if parts.get("day") else None
+        try:
+            if day is not None:
+                date(year, month, day)
+                return f"{MONTH_NAMES[month - 1]} {day}, {year}"
+            if month is not None:
+                date(year, month, 1)
+                return f"{MONTH_NAMES[month - 1]} {year}"
+        except ValueError:
+            return None
+        return str(year)
+    return None
+
+
+def normalize_language(text):
+    """言語名を英語にします。"日本語・英語" のような併記にも対応します。"""
+    value = _prepare(text)
+    parts = [part.strip() for part in re.split(r"[・,、/&＆]|および|及び|と", value) if part.strip()]
+    if not parts:
+        return None
+    names = []
+    for part in parts:
+        if part in LANGUAGE_NAMES:
+            names.append(LANGUAGE_NAMES[part])
+        elif part.endswith("版") and part[:-1] in LANGUAGE_NAMES:
+            names.append(LANGUAGE_NAMES[part[:-1]])
+        elif re.fullmatch(r"[A-Za-z ]+", part):
+            names.append(part.strip().title())
+        else:
+            return None
+    return ", ".join(names)
+
+
+def normalize_pages(text):
+    """"320ページ" / "320頁" / "320p" を "320 pages" に変換します。"""
+    match = _PAGES_PATTERN.match(_prepare(text))
+    if not match:
+        return None
+    pages = int(match.group("pages").replace(",", ""))
+    return "1 page" if pages == 1 else f"{pages} pages"
+
+
+def normalize_dimensions(text):
+    """"18.2 x 12.8 x 2 cm" / "縦18.2cm×横12.8cm" などを "18.2 x 12.8 x 2 cm" の形式にそろえます。"""
+    match = _DIMENSION_PATTERN.match(_prepare(text))
+    if not match:
+        return None
+    values = [match.group(key) for key in ("a", "b", "c") if match.group(key)]
+    units = {
+        _UNIT_NAMES.get(unit, unit.lower())
+        for unit in (match.group("unit_a"), match.group("unit_b"), match.group("unit_c")) if unit
+    }
+    # 単位が混在している、または単位がない場合は判断できないので変換しない
+    if len(units) != 1:
+        return None
+    return f"{' x '.join(values)} {units.pop()}"
+
+
+NORMALIZERS = {
+    "date": normalize_date,
+    "language": normalize_language,
+    "page count": normalize_pages,
+    "dimensions": normalize_dimensions,
+}
+
+
+def normalize_field(text, context):
+    """
+    context に対応するルールで text を変換します。
+    ルールがない、または一致しない場合は None を返します (LLMで翻訳する)。
+    """
+    normalizer = NORMALIZERS.get(context)
+    if not normalizer or not text or not text.strip():
+        return None
+    return normalizer(text)
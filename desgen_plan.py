@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# ドライラン: APIを呼ばずにトークン数・API呼び出し回数・コスト・所要時間を見積もり、後で実行できる計画ファイルとして保存します
+import json
+import math
+import os
+import threading
+from desgen_backends import CompletionBackend, Completion
+from desgen_metrics import estimate_cost, MODEL_PRICES
+from desgen_store import DEFAULT_DATA_DIR
+from desgen_tokens import estimate_tokens
+
+PLAN_VERSION = 1
+DEFAULT_PLAN_DIR = os.path.join(DEFAULT_DATA_DIR, "plans")
+# 英訳の出力トークン数は、原文 (日本語) の入力トークン数とほぼ同じになる (o200k_base での目安)
+COMPLETION_RATIO = 1.0
+# モデルごとの応答時間の目安: (1リクエストあたりの待ち時間(秒), 1秒あたりの出力トークン数)
+MODEL_SPEEDS = {
+    "gpt-4o": (0.6, 80.0),
+    "gpt-4o-mini": (0.4, 110.0),
+    "gpt-4.1": (0.6, 80.0),
+    "gpt-4.1-mini": (0.4, 110.0),
+    "gpt-4.1-nano": (0.3, 150.0),
+    "gpt-3.5-turbo": (0.4, 100.0),
+}
+DEFAULT_SPEED = (0.8, 60.0)
+# Google Sheets への書き込み1回 (values.batchUpdate) の所要時間の目安 (秒)
+SHEETS_WRITE_SECONDS = 1.0
+# 計画ファイルに保存しない設定 (認証情報)
+SECRET_SETTINGS = ("credentials_var", "openai_api_key_var")
+REQUIRED_KEYS = ("mode", "spreadsheet_id", "sheet_name", "column_settings", "row_numbers")
+
+
+class EstimatingCompletionBackend(CompletionBackend):
+    """
+    APIを呼ばずに、リクエストごとの入力・出力トークン数を見積もって記録する CompletionBackend。
+    出力トークン数は原文のトークン数 × ratio とし、応答はその長さの仮の英文 (JSON出力では同じキーのJSON) です。
+    見積もった出力が max_tokens を超える場合は、実際の応答と同じく打ち切り (finish_reason が length) を返します。
+    prompt_prefix はユーザープロンプトのうち原文より前の定型文で、原文の長さを求める際に除きます。
+    """
+    def __init__(self, prompt_prefix="", ratio=COMPLETION_RATIO):
+        self.prompt_prefix = prompt_prefix
+        self.ratio = ratio
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def _placeholder(self, text, model):
+        count = max(1, math.ceil(estimate_tokens(text, model) * self.ratio))
+        return count, " ".join(["text"] * count)
+
+    def complete(self, model, messages, max_tokens, temperature=0.2, timeout=None, response_format=None):
+        prompt = "".join(message["content"] for message in messages)
+        prompt_tokens = estimate_tokens(prompt, model)
+        user_prompt = messages[-1]["content"]
+        if response_format and response_format.get("type") == "json_object":
+            fields = json.loads(user_prompt)
+            placeholders = {key: self._placeholder(value["text"], model) for key, value in fields.items()}
+            content = json.dumps({key: text for key, (_, text) in placeholders.items()})
+            # キーと記号のぶん (1項目あたり数トークン) を加える
+            completion_tokens = sum(count for count, _ in placeholders.values()) + 4 * len(placeholders) + 2
+        else:
+            if self.prompt_prefix and user_prompt.startswith(self.prompt_prefix):
+                user_prompt = user_prompt[len(self.prompt_prefix):]
+            completion_tokens, content = self._placeholder(user_prompt, model)
+        finish_reason = "stop"
+        if completion_tokens > max_tokens:
+            completion_tokens, finish_reason = max_tokens, "length"
+        with self._lock:
+            self.requests.append((model, prompt_tokens, max_tokens, completion_tokens))
+        return Completion(content, finish_reason, prompt_tokens, completion_tokens)
+
+
+def estimate_duration(requests, max_workers, limits, limiter_names=None, read_seconds=0.0, write_calls=0):
+    """
+    所要時間(秒)を見積もり、内訳の辞書で返します。requests は [(モデル, 入力トークン数, max_tokens, 出力トークン数)] です。
+    limits は {リミッターの名前: (1分あたりのリクエスト数, 1分あたりのトークン数)}、limiter_names は {モデル: リミッターの名前} で、
+    limiter_names に無いモデルは "default" のリミッターを使います。
+    翻訳の時間は、ワーカー数で並行した応答時間と、各リミッターの枠 (最初の1分ぶんはバーストで使える) の制約のうち長いほうとします。
+    読み込み・翻訳・書き込みは並行して動くため、全体はそのうち最も長い段の時間になります。
+    """
+    limiter_names = limiter_names or {}
+    latency = 0.0
+    usage = {name: [0, 0] for name in limits}
+    for model, prompt_tokens, max_tokens, completion_tokens in requests:
+        base, tokens_per_second = MODEL_SPEEDS.get(model, DEFAULT_SPEED)
+        latency += base + completion_tokens / tokens_per_second
+        used = usage.setdefault(limiter_names.get(model, "default"), [0, 0])
+        used[0] += 1
+        # リミッターは max_tokens も含めて枠を確保する
+        used[1] += prompt_tokens + max_tokens
+    components = {"latency": latency / max(1, max_workers)}
+    for name, (requests_per_minute, tokens_per_minute) in limits.items():
+        calls, tokens = usage[name]
+        if requests_per_minute:
+            components[f"{name}:rpm"] = max(0, calls - requests_per_minute) / requests_per_minute * 60
+        if tokens_per_minute:
+            components[f"{name}:tpm"] = max(0, tokens - tokens_per_minute) / tokens_per_minute * 60
+    bottleneck = max(components, key=components.get)
+    translate_seconds = components[bottleneck]
+    write_seconds = write_calls * SHEETS_WRITE_SECONDS
+    return {
+        "read_seconds": round(read_seconds, 1),
+        "translate_seconds": round(translate_seconds, 1),
+        "write_seconds": round(write_seconds, 1),
+        "total_seconds": round(max(read_seconds, translate_seconds, write_seconds), 1),
+        "translate_bottleneck": bottleneck,
+        "components": {name: round(seconds, 1) for name, seconds in components.items()},
+    }
+
+
+def summarize_requests(requests, prices=MODEL_PRICES):
+    """モデルごとのリクエスト数・トークン数・推定コストを集計します。"""
+    models = {}
+    for model, prompt_tokens, _, completion_tokens in requests:
+        usage = models.setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        usage["requests"] += 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+    for model, usage in models.items():
+        cost = estimate_cost(model, usage["prompt_tokens"], usage["completion_tokens"], prices)
+        usage["cost_usd"] = round(cost, 6) if cost is not None else None
+    return {
+        "calls": len(requests),
+        "prompt_tokens": sum(usage["prompt_tokens"] for usage in models.values()),
+        "completion_tokens": sum(usage["completion_tokens"] for usage in models.values()),
+        "cost_usd": round(sum(usage["cost_usd"] or 0 for usage in models.values()), 6),
+        "models": models,
+    }
+
+
+def public_settings(settings):
+    """計画ファイルに保存する設定 (認証情報を除いたもの) を返します。"""
+    return {key: value for key, value in (settings or {}).items() if key not in SECRET_SETTINGS}
+
+
+def summary_lines(plan):
+    """計画の要約をログ用の行のリストで返します。"""
+    rows, api, duration = plan["rows"], plan["api"], plan["duration"]
+    lines = [
+        f"🧾 処理対象: {rows['to_process']} 行 (トリガーあり {rows['triggered']} 行 / 処理済み {rows['skipped_done']} 行 / 変更なし {rows['skipped_unchanged']} 行)",
+        f"🧾 API呼び出し: {api['calls']} 回 / トークン: 入力 {api['prompt_tokens']} / 出力 {api['completion_tokens']} / 推定コスト ${api['cost_usd']:.4f}",
+    ]
+    for model, usage in api["models"].items():
+        cost = f"${usage['cost_usd']:.4f}" if usage["cost_usd"] is not None else "料金不明"
+        lines.append(f"   - {model}: {usage['requests']} 回 / 入力 {usage['prompt_tokens']} / 出力 {usage['completion_tokens']} / {cost}")
+    lines.append(
+        f"🧾 推定所要時間: {duration['total_seconds']:.0f} 秒 (読み込み {duration['read_seconds']:.0f} 秒 / "
+        f"翻訳 {duration['translate_seconds']:.0f} 秒 ({duration['translate_bottleneck']}) / 書き込み {duration['write_seconds']:.0f} 秒)"
+    )
+    return lines
+
+
+def write_plan(plan, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=4, ensure_ascii=False)
+
+
+def load_plan(path):
+    """計画ファイルを読み込みます。形式が正しくない場合は ValueError を送出します。"""
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    if not isinstance(plan, dict) or plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"計画ファイルの形式が正しくありません: {path}")
+    missing = [key for key in REQUIRED_KEYS if key not in plan]
+    if missing:
+        raise ValueError(f"計画ファイルに {', '.join(missing)} がありません: {path}")
+    if plan["mode"] not in ("normal", "book"):
+        raise ValueError(f"計画ファイルのモードが不明です: {plan['mode']}")
+    return plan
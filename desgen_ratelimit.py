@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# レート制限: トークンバケットによるリクエスト数・トークン数の制御
+import time
+import threading
+
+
+class ProcessingCancelled(Exception):
+    """処理の中断により待機や実行が取り消されたことを表す例外。"""
+
+
+class TokenBucket:
+    """
+    一定の速度で補充されるトークンバケット。
+    capacity は1分あたりの上限で、そのぶんのバーストを許容します。
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """amount を取得できるまでの待ち時間(秒)を返します。"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    1分あたりのリクエスト数とトークン数の両方を制限するスレッドセーフなリミッター。
+    複数のワーカー(や複数のジョブ)で1つのインスタンスを共有して使います。
+    0 または None を指定した制限は無効になります。
+    """
+    def __init__(self, requests_per_minute=500, tokens_per_minute=30000):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=0, stop_event=None, client=None, weight=1.0):
+        """
+        リクエスト1件と tokens 分の枠を確保できるまで待機します。
+        stop_event がセットされた場合は ProcessingCancelled を送出します。
+        client / weight は FairRateLimiter 用で、このクラスでは使いません。
+        """
+        while True:
+            with self._lock:
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    self._take(tokens)
+                    return
+            self._sleep(wait, stop_event)
+
+    @staticmethod
+    def _sleep(wait, stop_event):
+        if stop_event is not None:
+            if stop_event.wait(min(wait, 0.5)):
+                raise ProcessingCancelled()
+        else:
+            time.sleep(min(wait, 0.5))
+
+    def _wait_time(self, tokens):
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def _take(self, tokens):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens and tokens:
+            self.tokens.take(tokens)
+
+
+class FairRateLimiter(RateLimiter):
+    """
+    複数のジョブ (client) で1つの枠を公平に分け合うレート制限。
+    待機中のクライアントのうち、これまでの取得数を weight で割った値 (仮想時間) が最も小さいものに次の枠を割り当てます。
+    weight が2倍のクライアントは、競合時に約2倍の枠を得ます。
+    """
+    def __init__(self, requests_per_minute=500, tokens_per_minute=30000):
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self._condition = threading.Condition(self._lock)
+        self._waiting = {}
+        self._virtual_time = {}
+
+    def acquire(self, tokens=0, stop_event=None, client=None, weight=1.0):
+        client = "" if client is None else str(client)
+        with self._condition:
+            if client not in self._waiting:
+                # 待機していなかった間の分をまとめて取り返さないよう、現在の最小値から始める
+                active = [self._virtual_time[other] for other in self._waiting]
+                self._virtual_time[client] = max(self._virtual_time.get(client, 0.0), min(active, default=0.0))
+            self._waiting[client] = self._waiting.get(client, 0) + 1
+            try:
+                while True:
+                    if stop_event is not None and stop_event.is_set():
+                        raise ProcessingCancelled()
+                    wait = 0.5
+                    if client == min(self._waiting, key=lambda other: (self._virtual_time[other], other)):
+                        wait = self._wait_time(tokens)
+                        if wait <= 0:
+                            self._take(tokens)
+                            self._virtual_time[client] += 1.0 / max(weight, 0.001)
+                            return
+                    self._condition.wait(min(wait, 0.5))
+            finally:
+                self._waiting[client] -= 1
+                if not self._waiting[client]:
+                    del self._waiting[client]
+                self._condition.notify_all()
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    複数のプロセス・マシンで1つの枠を共有するレート制限 (シャード実行用)。
+    バケットの状態は RateBudgetStore (共有ディスク上のSQLite) に保存し、key ごとに別の枠になります。
+    同じAPIキー・同じプロジェクトを使うワーカーには同じ key を指定してください。
+    """
+    def __init__(self, store, requests_per_minute=500, tokens_per_minute=30000, key="openai"):
+        self.store = store
+        self.key = key
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+    def acquire(self, tokens=0, stop_event=None, client=None, weight=1.0):
+        buckets = []
+        if self.requests_per_minute:
+            buckets.append((f"{self.key}:requests", self.requests_per_minute, 1))
+        if self.tokens_per_minute and tokens:
+            buckets.append((f"{self.key}:tokens", self.tokens_per_minute, tokens))
+        if not buckets:
+            return
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                raise ProcessingCancelled()
+            wait = self.store.take(buckets)
+            if wait <= 0:
+                return
+            self._sleep(wait, stop_event)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# 耐障害性: エラー分類・指数バックオフ付きリトライ・サーキットブレーカー
+import time
+import random
+import socket
+import threading
+from desgen_ratelimit import ProcessingCancelled
+
+RATE_LIMITED = "rate_limit"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# ステータスコードを持たない一時的なエラーのクラス名 (openai / httplib2 / requests など)
+_TRANSIENT_ERROR_NAMES = {
+    "Timeout", "APITimeoutError", "APIConnectionError", "ServiceUnavailableError",
+    "TryAgain", "ConnectionError", "ReadTimeout", "ConnectTimeout", "ServerNotFoundError", "URLError",
+}
+
+
+def get_status_code(exc):
+    """例外からHTTPステータスコードを取り出します。取り出せない場合は None を返します。"""
+    for attr in ("http_status", "status_code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    resp = getattr(exc, "resp", None)  # googleapiclient.errors.HttpError
+    if resp is not None and getattr(resp, "status", None) is not None:
+        return int(resp.status)
+    response = getattr(exc, "response", None)  # openai>=1.0 / requests
+    if response is not None and isinstance(getattr(response, "status_code", None), int):
+        return response.status_code
+    return None
+
+
+def get_retry_after(exc):
+    """例外に付いている Retry-After (秒) を返します。なければ None を返します。"""
+    value = getattr(exc, "retry_after", None)
+    if value is None:
+        for headers in (
+            getattr(exc, "headers", None),
+            getattr(exc, "resp", None),
+            getattr(getattr(exc, "response", None), "headers", None),
+        ):
+            if headers is not None and hasattr(headers, "get"):
+                value = headers.get("retry-after") or headers.get("Retry-After")
+                if value is not None:
+                    break
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc):
+    """例外を RATE_LIMITED / TRANSIENT / PERMANENT のいずれかに分類します。"""
+    status = get_status_code(exc)
+    if status == 429 or type(exc).__name__ == "RateLimitError":
+        return RATE_LIMITED
+    if status is not None:
+        if status >= 500 or status in (408, 409):
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(exc, (TimeoutError, socket.timeout, ConnectionError)):
+        return TRANSIENT
+    if type(exc).__name__ in _TRANSIENT_ERROR_NAMES:
+        return TRANSIENT
+    return PERMANENT
+
+
+class RetryPolicy:
+    """指数バックオフ(フルジッター)の待ち時間を計算します。Retry-After があればそれ以上待ちます。"""
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, exc=None):
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = get_retry_after(exc) if exc is not None else None
+        return max(backoff, retry_after or 0.0)
+
+
+class CircuitBreaker:
+    """
+    バックエンドごとのサーキットブレーカー。
+    レート制限・一時的なエラーが連続すると開き(open)、cooldown 秒の間すべての呼び出しを待機させます。
+    待機後の最初の呼び出しが再び失敗した場合は、待機時間を倍にして開き直します。
+    """
+    def __init__(self, name, failure_threshold=5, cooldown=30.0, max_cooldown=300.0, log=print):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.log = log
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self.open_until
+
+    def wait_until_closed(self, stop_event=None):
+        while True:
+            remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            if stop_event is not None:
+                if stop_event.wait(min(remaining, 1.0)):
+                    raise ProcessingCancelled()
+            else:
+                time.sleep(min(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures < self.failure_threshold or self.is_open:
+                return
+            pause = max(self.cooldown, retry_after or 0.0)
+            self.open_until = time.monotonic() + pause
+            self.trips += 1
+            self.consecutive_failures = 0
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+        self.log(f"⏸️ {self.name} の負荷が高いため、{pause:.0f}秒間 処理を一時停止します。")
+
+
+class ResilientCaller:
+    """リトライポリシーとサーキットブレーカーを組み合わせて関数を呼び出します。"""
+    def __init__(self, name, policy=None, breaker=None, log=print):
+        self.name = name
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(name, log=log)
+        self.log = log
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, description="", stop_event=None):
+        """
+        func() を実行します。レート制限・一時的なエラーは待機してリトライし、
+        恒久的なエラーやリトライ上限に達した場合は最後の例外を送出します。
+        """
+        attempt = 0
+        while True:
+            self.breaker.wait_until_closed(stop_event)
+            try:
+                result = func()
+            except ProcessingCancelled:
+                raise
+            except Exception as e:
+                kind = classify_error(e)
+                attempt += 1
+                if kind == PERMANENT or attempt >= self.policy.max_attempts:
+                    raise
+                self.breaker.record_failure(get_retry_after(e))
+                delay = self.policy.delay(attempt, e)
+                with self._lock:
+                    self.retries += 1
+                self.log(f"⚠️ {self.name} {description} でエラー ({kind}): {e} - {delay:.1f}秒後にリトライします ({attempt}/{self.policy.max_attempts - 1})")
+                if stop_event is not None:
+                    if stop_event.wait(delay):
+                        raise ProcessingCancelled()
+                else:
+                    time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# モデルの振り分け: 項目 (コンテキスト) と入力の長さでモデル・max_tokens・temperature を選び、品質の低い応答は上位のモデルでやり直します
+import json
+import re
+
+# 既定の振り分け。短い項目は軽量モデルで翻訳し、それ以外は translation_model (escalation_model) を使う
+# 各段は max_input_tokens 以下の入力に使われ、max_input_tokens が無い段はそれより長い入力すべてに使われます
+DEFAULT_ROUTES = {
+    "author name": [{"max_input_tokens": 60, "model": "gpt-4o-mini", "max_tokens": 120, "temperature": 0.0}],
+    "publisher name": [{"max_input_tokens": 60, "model": "gpt-4o-mini", "max_tokens": 120, "temperature": 0.0}],
+    "date": [{"max_input_tokens": 40, "model": "gpt-4o-mini", "max_tokens": 40, "temperature": 0.0}],
+    "language": [{"max_input_tokens": 40, "model": "gpt-4o-mini", "max_tokens": 40, "temperature": 0.0}],
+    "page count": [{"max_input_tokens": 40, "model": "gpt-4o-mini", "max_tokens": 40, "temperature": 0.0}],
+    "product description": [{"max_input_tokens": 120, "model": "gpt-4o-mini", "max_tokens": 400, "temperature": 0.2}],
+}
+DEFAULT_TEMPERATURE = 0.2
+
+_JAPANESE_PATTERN = re.compile(r"[ぁ-ゖァ-ヺ一-鿿々]")
+# 翻訳文ではなく説明や前置きを返した応答
+_COMMENTARY_PATTERN = re.compile(r"^\s*(sure|certainly|here is|here's|translation\s*:|i'm sorry|i cannot|as an ai)\b", re.IGNORECASE)
+
+
+class Route:
+    """1回のリクエストに使うモデルと設定。max_tokens が None の場合は入力の長さから決めます。"""
+    def __init__(self, model, max_tokens=None, temperature=DEFAULT_TEMPERATURE):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    def __repr__(self):
+        return f"Route({self.model!r}, max_tokens={self.max_tokens!r}, temperature={self.temperature!r})"
+
+
+class RoutingPolicy:
+    """
+    コンテキストごとの振り分けの規則。routes は {コンテキスト: [段, ...]} で、段は
+    {"max_input_tokens": 上限, "model": モデル, "max_tokens": 出力の上限, "temperature": 温度} の辞書です (model 以外は省略可)。
+    規則の無いコンテキスト・どの段にも当てはまらない長さの入力は escalation_model を使います。
+    rate_limits は {モデル: {"requests_per_minute": 件数, "tokens_per_minute": トークン数}} で、
+    指定したモデルは translation_model とは別のレート制限の枠で実行します (指定の無いモデルは同じ枠を使います)。
+    """
+    def __init__(self, routes=None, escalation_model="gpt-4o", rate_limits=None):
+        self.routes = {
+            context: sorted(tiers, key=lambda tier: (tier.get("max_input_tokens") is None, tier.get("max_input_tokens") or 0))
+            for context, tiers in (DEFAULT_ROUTES if routes is None else routes).items()
+        }
+        self.escalation_model = escalation_model
+        self.rate_limits = dict(rate_limits or {})
+
+    @classmethod
+    def load(cls, path, escalation_model="gpt-4o"):
+        """{"routes": {...}, "rate_limits": {...}} 形式のJSONファイルから読み込みます。routes を省略すると既定の規則を使います。"""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("振り分けの設定はJSONオブジェクトで指定してください")
+        routes = data.get("routes")
+        for context, tiers in (routes or {}).items():
+            if not isinstance(tiers, list) or not all(isinstance(tier, dict) and tier.get("model") for tier in tiers):
+                raise ValueError(f"'{context}' の振り分けは model を含む段のリストで指定してください")
+        return cls(routes, escalation_model=data.get("escalation_model", escalation_model), rate_limits=data.get("rate_limits"))
+
+    def route(self, context, input_tokens):
+        """context の input_tokens トークンの入力に使う Route を返します。"""
+        for tier in self.routes.get(context, ()):
+            limit = tier.get("max_input_tokens")
+            if limit is None or input_tokens <= limit:
+                return Route(tier["model"], tier.get("max_tokens"), tier.get("temperature", DEFAULT_TEMPERATURE))
+        return Route(self.escalation_model)
+
+    def can_escalate(self, route):
+        return route.model != self.escalation_model
+
+    def escalate(self, route):
+        """route の代わりに使う上位のモデルの Route を返します (max_tokens は入力の長さから決め直します)。"""
+        return Route(self.escalation_model, None, route.temperature)
+
+
+def check_translation(source, output):
+    """
+    翻訳結果の明らかな不備を調べ、問題があればその理由を、無ければ None を返します。
+    空の応答・原文のまま・日本語が多く残っている・前置きや説明が付いている・原文に比べて長すぎる、を不備とみなします。
+    """
+    output = output.strip()
+    if not output:
+        return "空の応答"
+    if output == source.strip() and _JAPANESE_PATTERN.search(output):
+        return "原文のまま"
+    japanese = len(_JAPANESE_PATTERN.findall(output))
+    if japanese and (len(output) < 20 or japanese / len(output) > 0.2):
+        return "日本語が残っている"
+    if _COMMENTARY_PATTERN.match(output):
+        return "翻訳以外の文章が含まれている"
+    if len(output) > max(200, len(source) * 10):
+        return "原文に比べて長すぎる"
+    return None
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# シャード実行: トリガー行を行範囲 (シャード) に分け、リースを使って複数のプロセス・マシンで分担して処理します
+import hashlib
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from desgen_ratelimit import SharedRateLimiter
+from desgen_store import LeaseStore, RateBudgetStore, DEFAULT_DATA_DIR
+
+DEFAULT_LEASE_DB = os.path.join(DEFAULT_DATA_DIR, "shard_leases.sqlite3")
+DEFAULT_SHARD_ROWS = 500
+DEFAULT_LEASE_SECONDS = 300.0
+SHEETS_REQUESTS_PER_MINUTE = 300
+
+
+def plan_ranges(trigger_rows, rows_per_shard, start_row, last_row):
+    """
+    トリガー行を rows_per_shard 件ずつに分け、隙間なく並んだ行範囲 [(先頭行, 最終行)] を返します。
+    索引作成後にトリガーが入った行も取りこぼさないよう、範囲は start_row から last_row までを覆います。
+    """
+    if not trigger_rows:
+        return []
+    firsts = trigger_rows[::max(1, rows_per_shard)]
+    firsts[0] = start_row
+    return [
+        (first, firsts[i + 1] - 1 if i + 1 < len(firsts) else last_row)
+        for i, first in enumerate(firsts)
+    ]
+
+
+def budget_key(api_key):
+    """APIキーごとに別のレート制限の枠にするための識別子。キーそのものは保存しません。"""
+    return "openai:" + hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+def trigger_column(mode, column_settings):
+    return column_settings['input_col'] if mode == "normal" else column_settings['trigger']
+
+
+def create_plan(processor, store, spreadsheet_id, sheet_name, mode, column_settings, start_row=2,
+                rows_per_shard=DEFAULT_SHARD_ROWS, replace=False):
+    """
+    トリガー列の索引から作業表を作り、job_key を返します。対象の行がない場合は None を返します。
+    同じシートの未完了の作業表が残っている場合は、replace=True でない限り索引を作らずにそれを再開します。
+    """
+    job_key = processor._job_key(spreadsheet_id, sheet_name, mode)
+    summary = store.summary(job_key)
+    if (summary["pending"] or summary["leased"]) and not replace:
+        processor.log(f"🧩 未完了の作業表を再開します: 残り {summary['pending'] + summary['leased']} シャード")
+        return job_key
+    trigger_rows = processor.build_trigger_index(spreadsheet_id, sheet_name, trigger_column(mode, column_settings), start_row)
+    last_row = processor._get_last_row(spreadsheet_id, sheet_name)
+    ranges = plan_ranges(trigger_rows, rows_per_shard, start_row, last_row)
+    if not ranges:
+        processor.log("🧩 処理対象の行がないため、作業表は作りませんでした。")
+        return None
+    spec = {
+        "spreadsheet_id": spreadsheet_id, "sheet_name": sheet_name, "mode": mode,
+        "column_settings": column_settings,
+    }
+    store.plan(job_key, spec, ranges, replace=True)
+    processor.log(f"🧩 作業表を作成しました: {len(ranges)} シャード (1シャードあたり最大 {rows_per_shard} 行)")
+    return job_key
+
+
+def configure_shared_limits(processor, budget, sheets_requests_per_minute=SHEETS_REQUESTS_PER_MINUTE):
+    """
+    processor のレート制限を、全ワーカーで共有する SharedRateLimiter に置き換えます。
+    振り分けの rate_limits で別枠にしたモデルも、モデルごとに共有の枠を使います。
+    """
+    key = budget_key(processor.openai_api_key)
+    processor.rate_limiter = SharedRateLimiter(budget, processor.requests_per_minute, processor.tokens_per_minute, key=key)
+    processor.model_rate_limiters = {}
+    processor.rate_limiter_factory = lambda model, requests_per_minute, tokens_per_minute: SharedRateLimiter(
+        budget, requests_per_minute, tokens_per_minute, key=f"{key}:{model}"
+    )
+    processor.sheets_rate_limiter = SharedRateLimiter(budget, sheets_requests_per_minute, 0, key="sheets")
+
+
+class ShardWorker:
+    """
+    作業表からシャードを1件ずつ取得して処理するワーカー。
+    処理中はリースを lease_seconds / 3 ごとに延長し、他のワーカーに取り直されていたら処理を中断します。
+    処理に失敗したシャードは返却し、max_attempts 回失敗したものは 'failed' として残します。
+    """
+    def __init__(self, processor, store, job_key, spec, owner=None, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=3):
+        self.processor = processor
+        self.store = store
+        self.job_key = job_key
+        self.spec = spec
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.totals = {"success": 0, "failed": 0, "shards": 0}
+
+    def run(self, stop_event=None):
+        """取得できるシャードがなくなるまで処理し、このワーカーの合計件数を返します。"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            shard = self.store.claim(self.job_key, self.owner, self.lease_seconds)
+            if shard is None:
+                if not self.store.summary(self.job_key)["leased"]:
+                    break
+                # 他のワーカーが処理中。停止したワーカーのリースが切れたら取り直す
+                stop_event.wait(min(self.lease_seconds / 4, 5.0))
+                continue
+            self._process(shard, stop_event)
+        return self.totals
+
+    def _process(self, shard, stop_event):
+        first_row, last_row = shard["first_row"], shard["last_row"]
+        label = f"シャード {shard['shard_id']} ({first_row}-{last_row}行)"
+        self.processor.log(f"🧩 {label} を処理します" + (" (リース切れのため取り直し)" if shard["reclaimed"] else ""))
+        lost, done = threading.Event(), threading.Event()
+
+        def heartbeat():
+            while not done.wait(self.lease_seconds / 3):
+                if not self.store.renew(self.job_key, shard["shard_id"], self.owner, self.lease_seconds):
+                    lost.set()
+                    self.processor.log(f"⚠️ {label} のリースを失ったため処理を中断します。")
+                    self.processor.stop_processing()
+                    return
+                if stop_event.is_set():
+                    self.processor.stop_processing()
+
+        heartbeat_thread = threading.Thread(target=heartbeat, name="desgen-lease", daemon=True)
+        heartbeat_thread.start()
+        process = (
+            self.processor.process_product_descriptions if self.spec["mode"] == "normal"
+            else self.processor.process_book_descriptions
+        )
+        try:
+            totals = process(
+                self.spec["spreadsheet_id"], self.spec["sheet_name"], self.spec["column_settings"],
+                first_row, resume=True, end_row=last_row
+            )
+        except Exception as e:
+            self.processor.log(f"❌ {label} の処理に失敗しました: {e}")
+            self.store.release(self.job_key, shard["shard_id"], self.owner, str(e), self.max_attempts)
+            return
+        finally:
+            done.set()
+            heartbeat_thread.join()
+
+        if lost.is_set():
+            return
+        if self.processor.stop_flag:
+            # 中断したシャードは試行回数に数えずに返却する (進捗はジャーナルから再開できる)
+            self.store.release(self.job_key, shard["shard_id"], self.owner, "中断されました", max_attempts=None)
+            return
+        if self.store.complete(self.job_key, shard["shard_id"], self.owner, totals):
+            self.totals["success"] += totals["success"]
+            self.totals["failed"] += totals["failed"]
+            self.totals["shards"] += 1
+
+
+def create_processor(config, log, report_dir=None):
+    """設定ファイルの辞書からワーカー用の DescriptionGeneratorCore を作ります。"""
+    from desgen_core import DescriptionGeneratorCore
+    processor = DescriptionGeneratorCore(config["credentials_var"], config["openai_api_key_var"], log)
+    processor.apply_settings(config)
+    if report_dir:
+        processor.metrics_report_dir = report_dir
+    return processor
+
+
+def _worker_main(config, lease_path, job_key, lease_seconds, stop_event, log, report_dir, processor_factory):
+    # 割り込みは親プロセスが受け取り、stop_event で各ワーカーに伝える
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 同じマシンで複数の実行が同じ作業表に参加しても区別できるよう、プロセスIDを含める
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    processor = processor_factory(config, lambda message: log(f"[{owner}] {message}"), report_dir)
+    store = LeaseStore(lease_path)
+    configure_shared_limits(
+        processor, RateBudgetStore(lease_path),
+        int(config.get("sheets_requests_per_minute_var", SHEETS_REQUESTS_PER_MINUTE))
+    )
+
+    def stop_when_requested():
+        stop_event.wait()
+        processor.stop_processing()
+
+    threading.Thread(target=stop_when_requested, name="desgen-stop", daemon=True).start()
+    _, spec = store.get_plan(job_key)
+    ShardWorker(processor, store, job_key, spec, owner, lease_seconds).run(stop_event)
+
+
+def run_workers(config, job_key, processes=2, lease_path=DEFAULT_LEASE_DB, lease_seconds=DEFAULT_LEASE_SECONDS,
+                stop_event=None, log=print, report_dir=None, processor_factory=create_processor):
+    """
+    作業表 job_key を processes 個のワーカープロセスで処理し、全シャードの集計 (LeaseStore.summary) を返します。
+    stop_event (multiprocessing.Event) をセットすると、各ワーカーは処理中のシャードを中断して終了します。
+    log と processor_factory はワーカープロセスに渡すため、モジュールの関数である必要があります。
+    """
+    context = multiprocessing.get_context("spawn")
+    stop_event = stop_event or context.Event()
+    store = LeaseStore(lease_path)
+    workers = [
+        context.Process(
+            target=_worker_main, name=f"desgen-shard-{index}",
+            args=(config, lease_path, job_key, lease_seconds, stop_event, log, report_dir, processor_factory)
+        )
+        for index in range(processes)
+    ]
+    log(f"🧩 {processes} 個のワーカープロセスでシャードを処理します。")
+    for worker in workers:
+        worker.start()
+    last_summary = None
+    while any(worker.is_alive() for worker in workers):
+        for worker in workers:
+            worker.join(timeout=5.0)
+        summary = store.summary(job_key)
+        if summary != last_summary:
+            total = summary["pending"] + summary["leased"] + summary["done"] + summary["failed"]
+            log(f"🧩 シャードの進捗: 完了 {summary['done']} / 全 {total} (処理中 {summary['leased']}, 失敗 {summary['failed']})")
+            last_summary = summary
+    summary = store.summary(job_key)
+    log(f"🧩 シャード実行が終了しました: 成功 {summary['success']} 件 / 失敗 {summary['failed_rows']} 件")
+    if summary["failed"]:
+        log(f"⚠️ {summary['failed']} シャードは再試行の上限に達しました。作業表を作り直して再実行してください。")
+    store.close()
+    return summary
+
+
+def _totals(summary):
+    """作業表の集計を、成功・失敗件数と未完了のシャード数にまとめます。"""
+    return {
+        "success": summary["success"],
+        "failed": summary["failed_rows"],
+        "failed_shards": summary["failed"],
+        "unfinished_shards": summary["pending"] + summary["leased"],
+    }
+
+
+def run_sharded(config, mode, processes=2, rows_per_shard=DEFAULT_SHARD_ROWS, lease_path=DEFAULT_LEASE_DB,
+                lease_seconds=DEFAULT_LEASE_SECONDS, replace=False, stop_event=None, log=print, report_dir=None,
+                processor_factory=create_processor):
+    """
+    設定ファイルのスプレッドシート・シートについて作業表を作り (未完了のものがあれば再開し)、ワーカープロセスで処理します。
+    {"success", "failed", "failed_shards", "unfinished_shards"} を返します。他のマシンからは join_sharded() で同じ作業表に参加できます。
+    """
+    column_settings = config.get("normal_mode" if mode == "normal" else "book_mode", {})
+    processor = processor_factory(config, log, report_dir)
+    store = LeaseStore(lease_path)
+    try:
+        job_key = create_plan(
+            processor, store, config["spreadsheet_id_var"], config.get("sheet_name_var", "集計"), mode,
+            column_settings, int(config.get("start_row_var", 2)), rows_per_shard, replace
+        )
+    finally:
+        store.close()
+        # 作業表を作るだけの processor なので、ワーカーを起動する前にストアを閉じる
+        processor.close()
+    if job_key is None:
+        return _totals(LeaseStore.empty_summary())
+    return _totals(run_workers(config, job_key, processes, lease_path, lease_seconds, stop_event, log, report_dir, processor_factory))
+
+
+def join_sharded(config, processes=2, lease_path=DEFAULT_LEASE_DB, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 stop_event=None, log=print, report_dir=None, processor_factory=create_processor):
+    """共有ディスク上の作業表のうち、未完了の最新のものに参加して処理します。"""
+    store = LeaseStore(lease_path)
+    try:
+        plan = store.get_plan()
+    finally:
+        store.close()
+    if plan is None:
+        log("🧩 参加できる未完了の作業表がありません。")
+        return _totals(LeaseStore.empty_summary())
+    job_key, spec = plan
+    log(f"🧩 作業表に参加します: {spec['sheet_name']} ({spec['mode']}モード)")
+    return _totals(run_workers(config, job_key, processes, lease_path, lease_seconds, stop_event, log, report_dir, processor_factory))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# スプレッドシートへの一括書き込み
+import re
+import time
+from desgen_resilience import classify_error, PERMANENT
+
+# Google スプレッドシートの1セルあたりの文字数上限
+CELL_CHARACTER_LIMIT = 50000
+_RANGE_PATTERN = re.compile(r"^(?:'(?P<quoted>(?:[^']|'')*)'|(?P<plain>[^!]+))!(?P<c1>[A-Z]+)(?P<r1>\d+)(?::(?P<c2>[A-Z]+)(?P<r2>\d+))?$")
+
+
+def quote_sheet_name(sheet_name):
+    """A1表記で使えるようにシート名をクォートします。"""
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+
+def column_to_number(column):
+    """列記号 (A, B, ..., AA) を1始まりの列番号に変換します。"""
+    number = 0
+    for char in column.upper():
+        number = number * 26 + (ord(char) - ord('A') + 1)
+    return number
+
+
+def number_to_column(number):
+    """1始まりの列番号を列記号に変換します。"""
+    letters = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def parse_a1_range(cell_range):
+    """
+    'シート名'!A2:B10 形式の範囲を (シート名, 先頭行, 最終行, 先頭列番号, 最終列番号) に分解します。
+    解釈できない場合は ValueError を送出します。
+    """
+    match = _RANGE_PATTERN.match(cell_range)
+    if not match:
+        raise ValueError(f"Unable to parse range: {cell_range}")
+    sheet_name = match.group("quoted").replace("''", "'") if match.group("quoted") is not None else match.group("plain")
+    first_col, first_row = column_to_number(match.group("c1")), int(match.group("r1"))
+    last_col = column_to_number(match.group("c2")) if match.group("c2") else first_col
+    last_row = int(match.group("r2")) if match.group("r2") else first_row
+    return sheet_name, first_row, last_row, first_col, last_col
+
+
+def coalesce_rows(rows, max_gap=0):
+    """
+    行番号のリストを連続した範囲 [(開始行, 終了行)] にまとめます。
+    間隔が max_gap 行以下の範囲は1つにつなげます(読み込み範囲の数を減らすため)。
+    """
+    runs = []
+    for row in sorted(set(rows)):
+        if runs and row - runs[-1][1] <= max_gap + 1:
+            runs[-1][1] = row
+        else:
+            runs.append([row, row])
+    return [tuple(run) for run in runs]
+
+
+class SheetWriter:
+    """
+    出力セルをためておき、values.batchUpdate でまとめて書き込むライター。
+    flush_rows 件たまるか、前回の書き込みから flush_interval 秒経過した時点で書き込みます。
+    一括書き込みが失敗した場合は範囲を分割して再送し、失敗した行を特定します。
+    backend は desgen_backends.SheetsBackend の実装です。
+    caller (ResilientCaller) を渡すと、レート制限・一時的なエラーはバックオフしながらリトライします。
+    throttle は書き込みの直前に呼ばれる関数で、共有のレート制限の枠を待つために使います。
+    cell_limit を超える値の行は書き込まずに失敗として扱います (None の場合は確認しません。ファイルへの出力用)。
+    """
+    def __init__(self, backend, spreadsheet_id, sheet_name, flush_rows=50, flush_interval=30.0, log=print, caller=None, throttle=None,
+                 cell_limit=CELL_CHARACTER_LIMIT):
+        self.backend = backend
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.log = log
+        self.caller = caller
+        self.throttle = throttle
+        self.cell_limit = cell_limit
+        self.pending = []
+        self.last_flush = time.time()
+
+    def add(self, row, column_letter, value):
+        self.pending.append((row, column_letter, value))
+
+    def is_due(self):
+        if not self.pending:
+            return False
+        return len(self.pending) >= self.flush_rows or time.time() - self.last_flush >= self.flush_interval
+
+    def flush_if_due(self):
+        if self.is_due():
+            return self.flush()
+        return [], {}
+
+    def flush(self):
+        """
+        たまっているセルを書き込みます。
+        (成功した行のリスト, {失敗した行: エラー内容}) を返します。
+        """
+        pending, self.pending = self.pending, []
+        self.last_flush = time.time()
+        if not pending:
+            return [], {}
+
+        failed = {}
+        writable = []
+        for entry in pending:
+            if self.cell_limit is not None and len(entry[2]) > self.cell_limit:
+                failed[entry[0]] = (
+                    f"セルの文字数上限({self.cell_limit})を超えています: {len(entry[2])}文字 "
+                    "(HTML出力形式を minify / class にすると短くなります)"
+                )
+            else:
+                writable.append(entry)
+
+        succeeded = self._write(writable, failed)
+        self.log(f"💾 {len(succeeded)}行をまとめて書き込みました。")
+        for row, error in sorted(failed.items()):
+            self.log(f"❌ {row}行目の書き込みに失敗しました: {error}")
+        return succeeded, failed
+
+    def _write(self, entries, failed):
+        if not entries:
+            return []
+        sheet = quote_sheet_name(self.sheet_name)
+        data = [(f"{sheet}!{column}{row}", value) for row, column, value in entries]
+
+        def send():
+            if self.throttle:
+                self.throttle()
+            self.backend.batch_update(self.spreadsheet_id, data)
+
+        try:
+            if self.caller:
+                # 中断後の最終書き込みでもリトライできるよう、停止イベントは渡さない
+                self.caller.call(send, "batchUpdate")
+            else:
+                send()
+            return [row for row, _, _ in entries]
+        except Exception as e:
+            if len(entries) == 1 or classify_error(e) != PERMANENT:
+                # 単一行、またはリトライしても解消しないレート制限・サーバーエラーの場合は、分割しても意味がないので全行を失敗にする
+                for row, _, _ in entries:
+                    failed[row] = str(e)
+                return []
+            # 半分ずつに分けて再送し、失敗の原因になった行を絞り込む
+            middle = len(entries) // 2
+            return self._write(entries[:middle], failed) + self._write(entries[middle:], failed)
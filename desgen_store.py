@@ -0,0 +1,771 @@
+# -*- coding: utf-8 -*-
+# 永続ストア: SQLiteを使ったキャッシュ・状態保存
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DATA_DIR = "desgen_data"
+
+
+class SQLiteStore:
+    """
+    SQLiteを使った永続ストアの基底クラス。
+    WALモードとビジータイムアウトにより、複数プロセス・複数スレッドから同時に利用できます。
+    WALは同じマシンのプロセス間でしか共有できないため、共有ディスク上で複数のマシンから使うストアは
+    journal_mode = "DELETE" にします。
+    """
+    schema = ""
+    journal_mode = "WAL"
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        # isolation_level=None で自動コミットにし、複数文の更新は transaction() で明示的に囲む
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self.schema:
+            self._conn.executescript(self.schema)
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """書き込みロックを先に確保するトランザクション (BEGIN IMMEDIATE)。"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TranslationCache(SQLiteStore):
+    """
+    翻訳結果のディスクキャッシュ。
+    キーは 原文・コンテキスト・モデル・プロンプトバージョン の組み合わせです。
+    件数・合計サイズ・経過日数による削除(エビクション)を行います。
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS translations (
+        key TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        context TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        result TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_translations_accessed ON translations (accessed_at);
+    CREATE INDEX IF NOT EXISTS idx_translations_version ON translations (prompt_version);
+    """
+
+    def __init__(self, path=os.path.join(DEFAULT_DATA_DIR, "translation_cache.sqlite3"),
+                 max_entries=200000, max_bytes=200 * 1024 * 1024, max_age_days=180, timeout=30.0):
+        super().__init__(path, timeout=timeout)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._counter_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text, context, model, prompt_version):
+        payload = json.dumps([text, context, model, prompt_version], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expiry_threshold(self):
+        if not self.max_age_days:
+            return None
+        return time.time() - self.max_age_days * 86400
+
+    def get(self, text, context, model, prompt_version, peek=False):
+        """
+        キャッシュされた翻訳を返します。見つからない場合は None です。
+        model にモデルのリストを渡すと、先頭から順に探して最初に見つかったものを返します (ヒット・ミスは1回として数えます)。
+        peek=True の場合は読み取りだけを行い、最終アクセス日時・期限切れのエントリの削除・ヒット/ミスの件数を更新しません (ドライラン用)。
+        """
+        models = [model] if isinstance(model, str) else list(model)
+        keys = [self.make_key(text, context, name, prompt_version) for name in models]
+        rows = dict(
+            (key, (result, created_at)) for key, result, created_at in self.execute(
+                f"SELECT key, result, created_at FROM translations WHERE key IN ({', '.join('?' * len(keys))})", keys
+            )
+        )
+        threshold = self._expiry_threshold()
+        for key in keys:
+            if key in rows and (threshold is None or rows[key][1] >= threshold):
+                if peek:
+                    return rows[key][0]
+                self.execute("UPDATE translations SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                with self._counter_lock:
+                    self.hits += 1
+                return rows[key][0]
+        if peek:
+            return None
+        expired = [key for key in keys if key in rows]
+        if expired:
+            # 期限切れのエントリは削除してミス扱い
+            self.execute(f"DELETE FROM translations WHERE key IN ({', '.join('?' * len(expired))})", expired)
+        with self._counter_lock:
+            self.misses += 1
+        return None
+
+    def set(self, text, context, model, prompt_version, result):
+        key = self.make_key(text, context, model, prompt_version)
+        now = time.time()
+        size = len(text.encode("utf-8")) + len(result.encode("utf-8"))
+        self.execute(
+            "INSERT OR REPLACE INTO translations "
+            "(key, source, context, model, prompt_version, result, size, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, text, context, model, prompt_version, result, size, now, now)
+        )
+        with self._counter_lock:
+            self._writes_since_evict += 1
+            should_evict = self._writes_since_evict >= 100
+            if should_evict:
+                self._writes_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """期限切れ・件数超過・サイズ超過のエントリを古い順に削除します。削除件数を返します。"""
+        removed = 0
+        with self.transaction() as conn:
+            threshold = self._expiry_threshold()
+            if threshold is not None:
+                removed += conn.execute("DELETE FROM translations WHERE created_at < ?", (threshold,)).rowcount
+            if self.max_entries:
+                count = conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+                if count > self.max_entries:
+                    removed += conn.execute(
+                        "DELETE FROM translations WHERE key IN "
+                        "(SELECT key FROM translations ORDER BY accessed_at ASC LIMIT ?)",
+                        (count - self.max_entries,)
+                    ).rowcount
+            if self.max_bytes:
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM translations").fetchone()[0]
+                if total > self.max_bytes:
+                    # 古いものから累積サイズが超過分に達するまで削除
+                    excess = total - self.max_bytes
+                    keys, freed = [], 0
+                    for key, size in conn.execute("SELECT key, size FROM translations ORDER BY accessed_at ASC"):
+                        keys.append(key)
+                        freed += size
+                        if freed >= excess:
+                            break
+                    conn.executemany("DELETE FROM translations WHERE key = ?", [(k,) for k in keys])
+                    removed += len(keys)
+        return removed
+
+    def invalidate(self, prompt_version=None, keep_current=False, context=None):
+        """
+        エントリを無効化します。
+        keep_current=True の場合は prompt_version 以外のバージョンをすべて削除します(プロンプト変更時)。
+        """
+        conditions, params = [], []
+        if prompt_version is not None:
+            conditions.append("prompt_version != ?" if keep_current else "prompt_version = ?")
+            params.append(prompt_version)
+        if context is not None:
+            conditions.append("context = ?")
+            params.append(context)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.transaction() as conn:
+            return conn.execute(f"DELETE FROM translations{where}", params).rowcount
+
+    def stats(self):
+        count, total = self.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM translations")[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+        }
+
+
+class RowHashStore(SQLiteStore):
+    """
+    行ごとの入力ハッシュを保存するストア。
+    job_key (スプレッドシートID・シート名・モード) と行番号をキーに、最後に出力したときの入力ハッシュを記録します。
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS row_hashes (
+        job_key TEXT NOT NULL,
+        row INTEGER NOT NULL,
+        input_hash TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (job_key, row)
+    );
+    """
+
+    def __init__(self, path=os.path.join(DEFAULT_DATA_DIR, "row_hashes.sqlite3"), timeout=30.0):
+        super().__init__(path, timeout=timeout)
+
+    @staticmethod
+    def hash_fields(fields):
+        payload = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, job_key, rows):
+        result = {}
+        rows = list(rows)
+        # SQLiteのパラメータ数の上限を避けるため分割して問い合わせる
+        for i in range(0, len(rows), 500):
+            chunk = rows[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for row, input_hash in self.execute(
+                f"SELECT row, input_hash FROM row_hashes WHERE job_key = ? AND row IN ({placeholders})",
+                [job_key] + chunk
+            ):
+                result[row] = input_hash
+        return result
+
+    def set_many(self, job_key, row_hashes):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO row_hashes (job_key, row, input_hash, updated_at) VALUES (?, ?, ?, ?)",
+                [(job_key, row, input_hash, now) for row, input_hash in row_hashes]
+            )
+
+
+class ProgressJournal(SQLiteStore):
+    """
+    実行の進捗を記録する先行書き込みジャーナル。
+    生成したHTMLはスプレッドシートへ書き込む前に 'rendered' として保存し、書き込み後に 'written' にします。
+    中断・異常終了した実行は、この記録から翻訳をやり直さずに再開できます。
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS journal_runs (
+        job_key TEXT PRIMARY KEY,
+        start_row INTEGER NOT NULL,
+        column_settings TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS journal_rows (
+        job_key TEXT NOT NULL,
+        row INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        output TEXT,
+        input_hash TEXT,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (job_key, row)
+    );
+    CREATE TABLE IF NOT EXISTS journal_translations (
+        job_key TEXT NOT NULL,
+        key TEXT NOT NULL,
+        result TEXT NOT NULL,
+        PRIMARY KEY (job_key, key)
+    );
+    """
+
+    def __init__(self, path=os.path.join(DEFAULT_DATA_DIR, "progress_journal.sqlite3"), timeout=30.0):
+        super().__init__(path, timeout=timeout)
+
+    def get_run(self, job_key):
+        rows = self.execute("SELECT start_row, column_settings FROM journal_runs WHERE job_key = ?", (job_key,))
+        if not rows:
+            return None
+        return {"start_row": rows[0][0], "column_settings": json.loads(rows[0][1])}
+
+    def begin(self, job_key, start_row, column_settings, resume=False):
+        """実行の開始を記録します。resume=False の場合は以前の記録を破棄します。"""
+        now = time.time()
+        with self.transaction() as conn:
+            if not resume:
+                conn.execute("DELETE FROM journal_rows WHERE job_key = ?", (job_key,))
+                conn.execute("DELETE FROM journal_translations WHERE job_key = ?", (job_key,))
+                conn.execute("DELETE FROM journal_runs WHERE job_key = ?", (job_key,))
+            conn.execute(
+                "INSERT OR IGNORE INTO journal_runs (job_key, start_row, column_settings, started_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_key, start_row, json.dumps(column_settings, ensure_ascii=False), now, now)
+            )
+
+    def written_rows(self, job_key):
+        return {row for (row,) in self.execute(
+            "SELECT row FROM journal_rows WHERE job_key = ? AND status = 'written'", (job_key,)
+        )}
+
+    def pending_outputs(self, job_key):
+        """生成済みで未書き込みの結果を [{'row', 'output', 'input_hash'}] で返します。"""
+        return [
+            {"row": row, "output": output, "input_hash": input_hash}
+            for row, output, input_hash in self.execute(
+                "SELECT row, output, input_hash FROM journal_rows WHERE job_key = ? AND status = 'rendered' ORDER BY row",
+                (job_key,)
+            )
+        ]
+
+    def get_translation(self, job_key, text, context):
+        rows = self.execute(
+            "SELECT result FROM journal_translations WHERE job_key = ? AND key = ?",
+            (job_key, TranslationCache.make_key(text, context, "", ""))
+        )
+        return rows[0][0] if rows else None
+
+    def record_translation(self, job_key, text, context, result):
+        """HTML生成前に中断されても支払い済みの翻訳を失わないよう、翻訳結果を1件ずつ記録します。"""
+        self.execute(
+            "INSERT OR REPLACE INTO journal_translations (job_key, key, result) VALUES (?, ?, ?)",
+            (job_key, TranslationCache.make_key(text, context, "", ""), result)
+        )
+
+    def record_rendered(self, job_key, results):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO journal_rows (job_key, row, status, output, input_hash, updated_at) "
+                "VALUES (?, ?, 'rendered', ?, ?, ?)",
+                [(job_key, r["row"], r["output"], r.get("input_hash"), now) for r in results if "output" in r]
+            )
+            conn.execute("UPDATE journal_runs SET updated_at = ? WHERE job_key = ?", (now, job_key))
+
+    def mark_written(self, job_key, rows):
+        now = time.time()
+        with self.transaction() as conn:
+            # 書き込み済みの行は出力本文を保持する必要がないので消しておく
+            conn.executemany(
+                "UPDATE journal_rows SET status = 'written', output = NULL, updated_at = ? WHERE job_key = ? AND row = ?",
+                [(now, job_key, row) for row in rows]
+            )
+
+    def finish(self, job_key):
+        """実行の完了を記録します。未書き込みの結果が残っている場合は、それだけを次回に持ち越します。"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM journal_rows WHERE job_key = ? AND status = 'written'", (job_key,))
+            remaining = conn.execute("SELECT COUNT(*) FROM journal_rows WHERE job_key = ?", (job_key,)).fetchone()[0]
+            if not remaining:
+                conn.execute("DELETE FROM journal_translations WHERE job_key = ?", (job_key,))
+                conn.execute("DELETE FROM journal_runs WHERE job_key = ?", (job_key,))
+        return remaining
+
+
+class LeaseStore(SQLiteStore):
+    """
+    シャード実行の作業表。行範囲 (シャード) ごとに状態と担当ワーカーのリース期限を記録します。
+    ワーカーは claim() でシャードを1件ずつ取得し、処理中は renew() でリースを延長します。
+    期限が切れたシャードは (ワーカーが停止したとみなして) 他のワーカーが取り直します。
+    複数のマシンから共有ディスク上のファイルを使えるよう、WALではなくロールバックジャーナルを使います。
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS shard_plans (
+        job_key TEXT PRIMARY KEY,
+        spec TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS shards (
+        job_key TEXT NOT NULL,
+        shard_id INTEGER NOT NULL,
+        first_row INTEGER NOT NULL,
+        last_row INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        owner TEXT,
+        lease_expires REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        success INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (job_key, shard_id)
+    );
+    """
+    journal_mode = "DELETE"
+
+    def __init__(self, path=os.path.join(DEFAULT_DATA_DIR, "shard_leases.sqlite3"), timeout=60.0):
+        super().__init__(path, timeout=timeout)
+
+    def plan(self, job_key, spec, ranges, replace=False):
+        """
+        job_key の作業表を作ります。未完了のシャードが残っている場合は replace=True でない限りそのまま再利用します。
+        spec は他のワーカーが処理内容 (シート・モード・列設定) を知るための辞書です。作業表のシャード数を返します。
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            unfinished = conn.execute(
+                "SELECT COUNT(*) FROM shards WHERE job_key = ? AND status IN ('pending', 'leased')", (job_key,)
+            ).fetchone()[0]
+            if unfinished and not replace:
+                return conn.execute("SELECT COUNT(*) FROM shards WHERE job_key = ?", (job_key,)).fetchone()[0]
+            conn.execute("DELETE FROM shards WHERE job_key = ?", (job_key,))
+            conn.execute(
+                "INSERT OR REPLACE INTO shard_plans (job_key, spec, created_at) VALUES (?, ?, ?)",
+                (job_key, json.dumps(spec, ensure_ascii=False), now)
+            )
+            conn.executemany(
+                "INSERT INTO shards (job_key, shard_id, first_row, last_row, status, updated_at) VALUES (?, ?, ?, ?, 'pending', ?)",
+                [(job_key, shard_id, first_row, last_row, now) for shard_id, (first_row, last_row) in enumerate(ranges)]
+            )
+        return len(ranges)
+
+    def get_plan(self, job_key=None):
+        """job_key (省略時は未完了のシャードが残っている最新の作業表) の (job_key, spec) を返します。"""
+        if job_key is None:
+            rows = self.execute(
+                "SELECT job_key, spec FROM shard_plans WHERE job_key IN "
+                "(SELECT job_key FROM shards WHERE status IN ('pending', 'leased')) ORDER BY created_at DESC LIMIT 1"
+            )
+        else:
+            rows = self.execute("SELECT job_key, spec FROM shard_plans WHERE job_key = ?", (job_key,))
+        return (rows[0][0], json.loads(rows[0][1])) if rows else None
+
+    def claim(self, job_key, owner, lease_seconds=300.0):
+        """
+        未着手またはリース切れのシャードを1件取得し、{'shard_id', 'first_row', 'last_row', 'attempts', 'reclaimed'} を返します。
+        取得できるシャードがない場合は None を返します。
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT shard_id, first_row, last_row, attempts, status FROM shards "
+                "WHERE job_key = ? AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+                "ORDER BY shard_id LIMIT 1",
+                (job_key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            shard_id, first_row, last_row, attempts, status = row
+            conn.execute(
+                "UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE job_key = ? AND shard_id = ?",
+                (owner, now + lease_seconds, now, job_key, shard_id)
+            )
+        return {
+            "shard_id": shard_id, "first_row": first_row, "last_row": last_row,
+            "attempts": attempts + 1, "reclaimed": status == "leased",
+        }
+
+    def renew(self, job_key, shard_id, owner, lease_seconds=300.0):
+        """リースを延長します。他のワーカーに取り直されていた場合は False を返します。"""
+        now = time.time()
+        with self.transaction() as conn:
+            updated = conn.execute(
+                "UPDATE shards SET lease_expires = ?, updated_at = ? "
+                "WHERE job_key = ? AND shard_id = ? AND owner = ? AND status = 'leased'",
+                (now + lease_seconds, now, job_key, shard_id, owner)
+            ).rowcount
+        return updated == 1
+
+    def complete(self, job_key, shard_id, owner, totals):
+        """シャードの完了と件数を記録します。リースを失っていた場合は記録せず False を返します。"""
+        with self.transaction() as conn:
+            updated = conn.execute(
+                "UPDATE shards SET status = 'done', lease_expires = NULL, success = ?, failed = ?, error = NULL, updated_at = ? "
+                "WHERE job_key = ? AND shard_id = ? AND owner = ? AND status = 'leased'",
+                (totals["success"], totals["failed"], time.time(), job_key, shard_id, owner)
+            ).rowcount
+        return updated == 1
+
+    def release(self, job_key, shard_id, owner, error=None, max_attempts=3):
+        """
+        処理できなかったシャードを返却します。試行回数が max_attempts に達したものは 'failed' にします。
+        中断で返却する場合は max_attempts=None にすると、試行回数にかかわらず未着手に戻します。
+        """
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE shards SET status = CASE WHEN ? AND attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE job_key = ? AND shard_id = ? AND owner = ? AND status = 'leased'",
+                (max_attempts is not None, max_attempts or 0, error, time.time(), job_key, shard_id, owner)
+            )
+
+    @staticmethod
+    def empty_summary():
+        return {"pending": 0, "leased": 0, "done": 0, "failed": 0, "success": 0, "failed_rows": 0}
+
+    def summary(self, job_key):
+        """状態ごとのシャード数と、完了したシャードの成功・失敗件数の合計を返します。"""
+        result = self.empty_summary()
+        for status, count, success, failed in self.execute(
+            "SELECT status, COUNT(*), SUM(success), SUM(failed) FROM shards WHERE job_key = ? GROUP BY status", (job_key,)
+        ):
+            result[status] = count
+            result["success"] += success or 0
+            result["failed_rows"] += failed or 0
+        return result
+
+
+class RateBudgetStore(SQLiteStore):
+    """
+    複数のプロセス・マシンで共有するトークンバケットの状態。
+    バケットごとに残量と最終更新時刻 (time.time()) を保存し、残量の確認と消費を1つのトランザクションで行います。
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS rate_buckets (
+        name TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """
+    journal_mode = "DELETE"
+
+    def __init__(self, path=os.path.join(DEFAULT_DATA_DIR, "shard_leases.sqlite3"), timeout=60.0):
+        super().__init__(path, timeout=timeout)
+
+    def take(self, buckets):
+        """
+        buckets は [(バケット名, 1分あたりの上限, 消費量)] です。
+        すべてのバケットに残量があれば消費して 0.0 を、足りなければ消費せずに必要な待ち時間(秒)を返します。
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            wait, levels = 0.0, []
+            for name, per_minute, amount in buckets:
+                capacity, rate = float(per_minute), per_minute / 60.0
+                row = conn.execute("SELECT tokens, updated_at FROM rate_buckets WHERE name = ?", (name,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+                amount = min(amount, capacity)
+                if tokens < amount:
+                    wait = max(wait, (amount - tokens) / rate)
+                levels.append((name, tokens - amount))
+            if wait <= 0:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    [(name, tokens, now) for name, tokens in levels]
+                )
+        return wait
+
+
+class BatchJobStore(SQLiteStore):
+    """
+    一括モードで投入したバッチの記録。
+    プロセスが終了しても、次回の実行で完了待ちのバッチを引き継ぎ、結果を取り込めるようにします。
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS batch_jobs (
+        batch_id TEXT PRIMARY KEY,
+        job_key TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        input_path TEXT NOT NULL,
+        requests INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        output_file_id TEXT,
+        error_file_id TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        ingested_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS batch_jobs_job_key ON batch_jobs (job_key);
+    """
+    _columns = (
+        "batch_id", "job_key", "model", "prompt_version", "input_path", "requests", "status",
+        "output_file_id", "error_file_id", "created_at", "updated_at", "ingested_at",
+    )
+
+    def __init__(self, path=os.path.join(DEFAULT_DATA_DIR, "batch_jobs.sqlite3"), timeout=30.0):
+        super().__init__(path, timeout=timeout)
+
+    def add(self, batch_id, job_key, model, prompt_version, input_path, requests, status):
+        now = time.time()
+        self.execute(
+            "INSERT INTO batch_jobs (batch_id, job_key, model, prompt_version, input_path, requests, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (batch_id, job_key, model, prompt_version, input_path, requests, status, now, now)
+        )
+
+    def update(self, batch_id, status, output_file_id=None, error_file_id=None):
+        self.execute(
+            "UPDATE batch_jobs SET status = ?, output_file_id = COALESCE(?, output_file_id), "
+            "error_file_id = COALESCE(?, error_file_id), updated_at = ? WHERE batch_id = ?",
+            (status, output_file_id, error_file_id, time.time(), batch_id)
+        )
+
+    def mark_ingested(self, batch_id):
+        self.execute("UPDATE batch_jobs SET ingested_at = ? WHERE batch_id = ?", (time.time(), batch_id))
+
+    def pending(self, job_key):
+        """結果をまだ取り込んでいないバッチを、投入した順に返します。"""
+        rows = self.execute(
+            f"SELECT {', '.join(self._columns)} FROM batch_jobs WHERE job_key = ? AND ingested_at IS NULL ORDER BY created_at",
+            (job_key,)
+        )
+        return [dict(zip(self._columns, row)) for row in rows]
+
+
+class MetadataCache(SQLiteStore):
+    """
+    ISBNごとの書誌情報のディスクキャッシュ。
+    見つからなかったISBNも空の結果として記録し、missing_ttl_days の間は問い合わせ直しません。
+    期限 (見つかったものは ttl_days) を過ぎたエントリは evict() で削除します。
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS bibliography (
+        isbn TEXT PRIMARY KEY,
+        source TEXT,
+        data TEXT,
+        fetched_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_bibliography_fetched ON bibliography (fetched_at);
+    """
+
+    def __init__(self, path=os.path.join(DEFAULT_DATA_DIR, "bibliography_cache.sqlite3"),
+                 ttl_days=30, missing_ttl_days=1, timeout=30.0):
+        super().__init__(path, timeout=timeout)
+        self.ttl_days = ttl_days
+        self.missing_ttl_days = missing_ttl_days
+
+    def get_many(self, isbns):
+        """
+        期限内のエントリを {ISBN: 書誌情報} で返します。見つからなかったと記録されているISBNの値は None です。
+        キャッシュに無い (または期限切れの) ISBNは結果に含まれません。
+        """
+        now = time.time()
+        results = {}
+        isbns = list(isbns)
+        for i in range(0, len(isbns), 500):
+            chunk = isbns[i:i + 500]
+            rows = self.execute(
+                f"SELECT isbn, data, fetched_at FROM bibliography WHERE isbn IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            for isbn, data, fetched_at in rows:
+                ttl_days = self.ttl_days if data is not None else self.missing_ttl_days
+                if now - fetched_at <= ttl_days * 86400:
+                    results[isbn] = json.loads(data) if data is not None else None
+        return results
+
+    def set_many(self, entries):
+        """entries は [(ISBN, 取得元, 書誌情報 または None)] です。"""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO bibliography (isbn, source, data, fetched_at) VALUES (?, ?, ?, ?)",
+                [(isbn, source, json.dumps(data, ensure_ascii=False) if data is not None else None, now)
+                 for isbn, source, data in entries]
+            )
+
+    def evict(self):
+        """期限切れのエントリを削除し、削除件数を返します。"""
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM bibliography WHERE (data IS NOT NULL AND fetched_at < ?) OR (data IS NULL AND fetched_at < ?)",
+                (now - self.ttl_days * 86400, now - self.missing_ttl_days * 86400)
+            )
+            return cursor.rowcount
+
+
+class DedupIndex(SQLiteStore):
+    """
+    翻訳済みの原文の MinHash / LSH 索引と、類似の翻訳を再利用した記録 (監査ログ)。
+    バケットのキーはコンテキスト・モデル・プロンプトバージョンごとに分かれます (desgen_dedup.band_keys)。
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS dedup_entries (
+        id INTEGER PRIMARY KEY,
+        scope TEXT NOT NULL,
+        context TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        source TEXT NOT NULL,
+        translation TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        UNIQUE (scope, source)
+    );
+    CREATE TABLE IF NOT EXISTS dedup_buckets (
+        bucket TEXT NOT NULL,
+        entry_id INTEGER NOT NULL,
+        PRIMARY KEY (bucket, entry_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_dedup_buckets_entry ON dedup_buckets (entry_id);
+    CREATE TABLE IF NOT EXISTS dedup_audit (
+        id INTEGER PRIMARY KEY,
+        created_at REAL NOT NULL,
+        job_key TEXT,
+        context TEXT NOT NULL,
+        action TEXT NOT NULL,
+        similarity REAL NOT NULL,
+        source TEXT NOT NULL,
+        matched_source TEXT NOT NULL,
+        translation TEXT NOT NULL,
+        patches TEXT NOT NULL
+    );
+    """
+    AUDIT_COLUMNS = ("created_at", "job_key", "context", "action", "similarity", "source", "matched_source", "translation", "patches")
+
+    def __init__(self, path=os.path.join(DEFAULT_DATA_DIR, "dedup_index.sqlite3"), timeout=30.0):
+        super().__init__(path, timeout=timeout)
+
+    def add(self, scope, context, model, prompt_version, source, translation, buckets):
+        with self.transaction() as conn:
+            row = conn.execute("SELECT id FROM dedup_entries WHERE scope = ? AND source = ?", (scope, source)).fetchone()
+            if row:
+                conn.execute("UPDATE dedup_entries SET translation = ?, created_at = ? WHERE id = ?", (translation, time.time(), row[0]))
+                return
+            entry_id = conn.execute(
+                "INSERT INTO dedup_entries (scope, context, model, prompt_version, source, translation, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (scope, context, model, prompt_version, source, translation, time.time())
+            ).lastrowid
+            conn.executemany(
+                "INSERT OR IGNORE INTO dedup_buckets (bucket, entry_id) VALUES (?, ?)", [(bucket, entry_id) for bucket in buckets]
+            )
+
+    def candidates(self, buckets, limit=10):
+        """buckets と同じバケットに入っているエントリを、共通のバケットが多い順に [(原文, 翻訳)] で返します。"""
+        buckets = list(buckets)
+        return self.execute(
+            "SELECT e.source, e.translation FROM dedup_entries e JOIN "
+            f"(SELECT entry_id, COUNT(*) AS hits FROM dedup_buckets WHERE bucket IN ({', '.join('?' * len(buckets))}) "
+            "GROUP BY entry_id ORDER BY hits DESC LIMIT ?) b ON b.entry_id = e.id ORDER BY b.hits DESC",
+            (*buckets, limit)
+        )
+
+    def invalidate(self, prompt_version, keep_current=False):
+        """prompt_version のエントリ (keep_current=True の場合はそれ以外のバージョンのエントリ) を削除します。"""
+        condition = "prompt_version != ?" if keep_current else "prompt_version = ?"
+        with self.transaction() as conn:
+            removed = conn.execute(f"DELETE FROM dedup_entries WHERE {condition}", (prompt_version,)).rowcount
+            if removed:
+                conn.execute("DELETE FROM dedup_buckets WHERE entry_id NOT IN (SELECT id FROM dedup_entries)")
+            return removed
+
+    def record(self, job_key, context, action, similarity, source, matched_source, translation, patches):
+        """再利用 (action: reuse / patch) の記録を監査ログに追加します。patches は [(元の語句, 新しい語句)] です。"""
+        self.execute(
+            f"INSERT INTO dedup_audit ({', '.join(self.AUDIT_COLUMNS)}) VALUES ({', '.join('?' * len(self.AUDIT_COLUMNS))})",
+            (time.time(), job_key, context, action, similarity, source, matched_source, translation,
+             json.dumps(patches, ensure_ascii=False))
+        )
+
+    def audit(self, job_key=None, limit=None):
+        """監査ログを新しい順に辞書のリストで返します。"""
+        sql = f"SELECT {', '.join(self.AUDIT_COLUMNS)} FROM dedup_audit"
+        params = []
+        if job_key is not None:
+            sql += " WHERE job_key = ?"
+            params.append(job_key)
+        sql += " ORDER BY id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [dict(zip(self.AUDIT_COLUMNS, row)) for row in self.execute(sql, params)]
+
+    def stats(self):
+        entries = self.execute("SELECT COUNT(*) FROM dedup_entries")[0][0]
+        reused = dict(self.execute("SELECT action, COUNT(*) FROM dedup_audit GROUP BY action"))
+        return {"entries": entries, "reused": reused.get("reuse", 0), "patched": reused.get("patch", 0)}
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# HTMLテンプレート: テンプレートファイルを読み込んで Python の関数にコンパイルし、値をエスケープしながら1回で描画します
+import html
+import os
+import re
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+DEFAULT_TEMPLATE_SET = "default"
+# テンプレートセットのファイル (layout は各モードの本文を {{{ body }}} で埋め込む外枠)
+TEMPLATE_NAMES = ("layout", "normal", "book")
+# inline: テンプレートのまま / minify: タグ間の空白と改行を除く / class: minify に加えてインラインスタイルをクラスにまとめる
+OUTPUT_MODES = ("inline", "minify", "class")
+
+_TOKEN_PATTERN = re.compile(r"(\{\{\{.*?\}\}\}|\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\})", re.DOTALL)
+_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+_TAG_PATTERN = re.compile(r"<[A-Za-z][^<>]*>")
+_STYLE_ATTR_PATTERN = re.compile(r'\sstyle\s*=\s*"([^"{}]*)"', re.IGNORECASE)
+_CLASS_ATTR_PATTERN = re.compile(r'\sclass\s*=\s*"([^"]*)"', re.IGNORECASE)
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def _text(value):
+    return "" if value is None else str(value)
+
+
+def _escape(value):
+    """テキストとして埋め込む値のエスケープ。引用符は変換しません (セルの文字数を増やさないため)。"""
+    return html.escape(_text(value), quote=False)
+
+
+def _escape_attribute(value):
+    """タグの中 (属性値) に埋め込む値のエスケープ。引用符も変換します。"""
+    return html.escape(_text(value), quote=True)
+
+
+def _inside_tag(text, inside):
+    """直前の状態 inside (タグの中かどうか) から、固定部分 text の後でタグの中にいるかを返します。"""
+    opened, closed = text.rfind("<"), text.rfind(">")
+    if opened == closed:
+        return inside
+    return opened > closed
+
+
+def _attr(value, name):
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def _minify(text):
+    """テンプレートの固定部分から、タグ間の空白・改行を除き、それ以外の連続する空白を1つにまとめます。"""
+    text = re.sub(r">\s+<", "><", text)
+    text = re.sub(r"^\s+(?=<)|(?<=>)\s+$", "", text)
+    return re.sub(r"\s+", " ", text)
+
+
+def extract_styles(source, classes):
+    """
+    タグの style 属性をクラスに置き換えます。classes は {スタイル: クラス名} の辞書で、同じスタイルは同じクラスになります。
+    値を埋め込んでいる style 属性 ({{ }} を含むもの) はそのまま残します。
+    """
+    def replace(match):
+        tag = match.group(0)
+        style = _STYLE_ATTR_PATTERN.search(tag)
+        if not style:
+            return tag
+        declarations = ";".join(
+            re.sub(r"\s*:\s*", ":", part.strip()) for part in style.group(1).split(";") if part.strip()
+        )
+        tag = tag[:style.start()] + tag[style.end():]
+        if not declarations:
+            return tag
+        class_name = classes.setdefault(declarations, f"ds{len(classes) + 1}")
+        existing = _CLASS_ATTR_PATTERN.search(tag)
+        if existing:
+            return tag[:existing.end(1)] + f" {class_name}" + tag[existing.end(1):]
+        end = len(tag) - 2 if tag.endswith("/>") else len(tag) - 1
+        return tag[:end].rstrip() + f' class="{class_name}"' + tag[end:]
+
+    return _TAG_PATTERN.sub(replace, source)
+
+
+def _tokenize(source):
+    """
+    テンプレートを (種類, 内容, 行番号) のリストに分けます。
+    {% %} と {# #} だけの行は、行頭の空白と直後の改行を取り除きます (出力に空行を残さないため)。
+    """
+    parts = _TOKEN_PATTERN.split(source)
+    lines, line = [], 1
+    for part in parts:
+        lines.append(line)
+        line += part.count("\n")
+    for index in range(1, len(parts), 2):
+        if not parts[index].startswith(("{%", "{#")):
+            continue
+        before = parts[index - 1]
+        indent = before[before.rfind("\n") + 1:]
+        if not indent.strip() and ("\n" in before or index == 1):
+            parts[index - 1] = before[:len(before) - len(indent)]
+        if parts[index + 1].startswith("\n"):
+            parts[index + 1] = parts[index + 1][1:]
+    tokens = []
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            tokens.append(("text", part, lines[index]))
+        elif part.startswith("{{{"):
+            tokens.append(("raw", part[3:-3].strip(), lines[index]))
+        elif part.startswith("{{"):
+            tokens.append(("value", part[2:-2].strip(), lines[index]))
+        elif part.startswith("{%"):
+            tokens.append(("block", part[2:-2].strip(), lines[index]))
+    return tokens
+
+
+class Template:
+    """
+    テンプレートを1つの描画関数にコンパイルしたもの。書式は次のとおりです。
+    {{ name }} はHTMLエスケープして、{{{ name }}} はそのまま埋め込みます (name は item.label のように . で属性を参照できます)。
+    {{ name }} の引用符は、タグの中 (属性値) に書いた場合だけエスケープします。
+    {% if name %} ... {% else %} ... {% endif %}、{% for item in items %} ... {% endfor %}、{# コメント #}。
+    """
+    def __init__(self, source, name="<template>", minify=False, classes=None):
+        self.name = name
+        if classes is not None:
+            source = extract_styles(source, classes)
+        self.code = self._generate(_tokenize(source), minify)
+        namespace = {"_text": _text, "_escape": _escape, "_escape_attribute": _escape_attribute, "_attr": _attr}
+        exec(compile(self.code, f"<template {name}>", "exec"), namespace)
+        self._render = namespace["render"]
+
+    def _error(self, line, message):
+        return TemplateError(f"{self.name}:{line}: {message}")
+
+    def _expression(self, text, scopes, line):
+        if not _NAME_PATTERN.match(text):
+            raise self._error(line, f"不正な式です: {text}")
+        first, *attributes = text.split(".")
+        expression = next((scope[first] for scope in reversed(scopes) if first in scope), None)
+        if expression is None:
+            expression = f"context.get({first!r})"
+        for attribute in attributes:
+            expression = f"_attr({expression}, {attribute!r})"
+        return expression
+
+    def _generate(self, tokens, minify):
+        code = ["def render(context):", "    out = []", "    append = out.append"]
+        blocks, scopes = [], [{}]
+        inside_tag = False
+        for kind, text, line in tokens:
+            indent = "    " * (len(blocks) + 1)
+            if kind == "text":
+                inside_tag = _inside_tag(text, inside_tag)
+                if minify:
+                    text = _minify(text)
+                if text:
+                    code.append(f"{indent}append({text!r})")
+            elif kind in ("value", "raw"):
+                if kind == "raw":
+                    function = "_text"
+                else:
+                    function = "_escape_attribute" if inside_tag else "_escape"
+                code.append(f"{indent}append({function}({self._expression(text, scopes, line)}))")
+            else:
+                words = text.split()
+                keyword = words[0] if words else ""
+                if keyword == "for" and len(words) == 4 and words[2] == "in" and _NAME_PATTERN.match(words[1]) and "." not in words[1]:
+                    variable = f"_loop{len(code)}"
+                    code.append(f"{indent}for {variable} in {self._expression(words[3], scopes, line)} or ():")
+                    blocks.append("for")
+                    scopes.append({words[1]: variable})
+                elif keyword == "if" and len(words) == 2:
+                    code.append(f"{indent}if {self._expression(words[1], scopes, line)}:")
+                    blocks.append("if")
+                elif keyword == "else" and len(words) == 1:
+                    if not blocks or blocks[-1] != "if":
+                        raise self._error(line, "対応する {% if %} がない {% else %} です")
+                    code.append(f"{indent}pass")
+                    code.append(f"{'    ' * len(blocks)}else:")
+                    blocks[-1] = "else"
+                elif keyword in ("endfor", "endif") and len(words) == 1:
+                    expected = ("for",) if keyword == "endfor" else ("if", "else")
+                    if not blocks or blocks[-1] not in expected:
+                        raise self._error(line, f"対応するブロックがない {{% {keyword} %}} です")
+                    code.append(f"{indent}pass")
+                    if blocks.pop() == "for":
+                        scopes.pop()
+                else:
+                    raise self._error(line, f"不明なタグです: {{% {text} %}}")
+        if blocks:
+            raise TemplateError(f"{self.name}: {{% {blocks[-1]} %}} が閉じられていません")
+        code.append("    return ''.join(out)")
+        return "\n".join(code)
+
+    def render(self, context):
+        return self._render(context)
+
+
+class TemplateSet:
+    """
+    1つのストア向けのテンプレート (layout / normal / book) の組。
+    テンプレートセットは templates/<名前>/ のディレクトリで、無いファイルは default のものを使います。
+    output_mode が class の場合は、全テンプレートのインラインスタイルを共通のクラスにまとめ、出力の先頭に <style> を付けます。
+    """
+    def __init__(self, templates, stylesheet="", name=DEFAULT_TEMPLATE_SET, output_mode="inline"):
+        self.templates = templates
+        self.stylesheet = stylesheet
+        self.name = name
+        self.output_mode = output_mode
+
+    @classmethod
+    def load(cls, name=DEFAULT_TEMPLATE_SET, output_mode="inline", base_dir=TEMPLATE_DIR):
+        """テンプレートセットの名前 (templates/ 内) またはディレクトリのパスから読み込み、コンパイルします。"""
+        if output_mode not in OUTPUT_MODES:
+            raise TemplateError(f"不明な出力形式です: {output_mode} ({' / '.join(OUTPUT_MODES)})")
+        name = name or DEFAULT_TEMPLATE_SET
+        directory = name if os.path.isdir(name) else os.path.join(base_dir, name)
+        if not os.path.isdir(directory):
+            raise TemplateError(f"テンプレートセットが見つかりません: {name}")
+        classes = {} if output_mode == "class" else None
+        templates = {}
+        for template_name in TEMPLATE_NAMES:
+            path = os.path.join(directory, f"{template_name}.html")
+            if not os.path.exists(path):
+                path = os.path.join(base_dir, DEFAULT_TEMPLATE_SET, f"{template_name}.html")
+            with open(path, encoding="utf-8") as f:
+                source = f.read()
+            # ファイル末尾の改行は出力に含めない
+            if source.endswith("\n"):
+                source = source[:-1]
+            templates[template_name] = Template(source, path, minify=output_mode != "inline", classes=classes)
+        stylesheet = ""
+        if classes:
+            stylesheet = "<style>" + "".join(f".{class_name}{{{style}}}" for style, class_name in classes.items()) + "</style>"
+        return cls(templates, stylesheet, name, output_mode)
+
+    def render(self, mode, context):
+        """mode (normal / book) の本文を描画し、layout に埋め込んだHTMLを返します。"""
+        body = self.templates[mode].render(context)
+        return self.stylesheet + self.templates["layout"].render(dict(context, body=body))
+
+
+def available_template_sets(base_dir=TEMPLATE_DIR):
+    """templates/ にあるテンプレートセットの名前を返します。"""
+    if not os.path.isdir(base_dir):
+        return []
+    return sorted(entry for entry in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, entry)))
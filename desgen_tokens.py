@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# トークン数の見積もりとリクエストのパッキング・長いテキストの分割
+import re
+
+_encodings = {}
+_tiktoken = None
+_tiktoken_checked = False
+
+
+def _load_tiktoken():
+    # tiktoken はインポートに時間がかかるため、最初に見積もる時点で読み込む
+    global _tiktoken, _tiktoken_checked
+    if not _tiktoken_checked:
+        try:
+            import tiktoken
+            _tiktoken = tiktoken
+        except ImportError:
+            _tiktoken = None
+        _tiktoken_checked = True
+    return _tiktoken
+
+
+def _get_encoding(model):
+    tiktoken = _load_tiktoken()
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model]
+
+
+def estimate_tokens(text, model="gpt-4o"):
+    """
+    テキストのトークン数を見積もります。
+    tiktoken がインストールされていればそれを使い、なければ文字種による概算を返します。
+    """
+    if not text:
+        return 0
+    if _load_tiktoken() is not None:
+        return len(_get_encoding(model).encode(text))
+    # 概算: ASCIIは約4文字で1トークン、日本語などの非ASCII文字は1文字で約1トークン
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def pack_items(items, token_budget, model="gpt-4o", overhead=8):
+    """
+    (キー, テキスト) のリストを、合計トークン数が token_budget 以内のグループに分けます。
+    1件で予算を超えるものは単独のグループになります。順序は保持されます。
+    """
+    packs, current, current_tokens = [], [], 0
+    for key, text in items:
+        tokens = estimate_tokens(text, model) + overhead
+        if current and current_tokens + tokens > token_budget:
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append((key, text))
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+# 段落 (空行) ・改行の区切り
+_LINE_BREAK_PATTERN = re.compile(r"(\n[ \t　]*\n\s*|\n)")
+# 文の区切り: 句点・感嘆符・疑問符 (閉じ括弧を含む) か、空白が続くピリオド
+_SENTENCE_PATTERN = re.compile(r".*?(?:[。！？!?]+[」』）)]*|\.(?=\s)|$)\s*", re.DOTALL)
+
+
+def _split_long_unit(text, token_budget, model):
+    """1文で予算を超えるテキストを、ほぼ同じ長さの部分に分けます。"""
+    count = -(-estimate_tokens(text, model) // token_budget)
+    size = -(-len(text) // count)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def split_text(text, token_budget, model="gpt-4o"):
+    """
+    長いテキストを段落・改行・文の区切りで、それぞれ token_budget 以内のチャンクに分けます。
+    [(チャンク, 区切り)] のリストを返します。区切りは翻訳後にチャンクの後ろへ付ける文字列で、
+    段落は "\\n\\n"、改行は "\\n"、文の途中で分けた場合は " " (最後のチャンクは "") です。
+    """
+    # (原文の一部, 原文での後ろの区切り, 翻訳後の区切り) の単位に分ける
+    units = []
+    pieces = _LINE_BREAK_PATTERN.split(text.strip())
+    for index in range(0, len(pieces), 2):
+        separator = pieces[index + 1] if index + 1 < len(pieces) else ""
+        joiner = "\n\n" if separator.count("\n") > 1 else separator
+        piece = pieces[index]
+        if estimate_tokens(piece, model) <= token_budget:
+            units.append((piece, separator, joiner))
+            continue
+        sentences = []
+        for sentence in (s for s in _SENTENCE_PATTERN.findall(piece) if s):
+            if estimate_tokens(sentence, model) > token_budget:
+                sentences.extend(_split_long_unit(sentence, token_budget, model))
+            else:
+                sentences.append(sentence)
+        for position, sentence in enumerate(sentences):
+            last = position == len(sentences) - 1
+            units.append((sentence, separator if last else "", joiner if last else " "))
+
+    chunks, current, current_tokens = [], "", 0
+    for position, (unit, separator, joiner) in enumerate(units):
+        tokens = estimate_tokens(unit, model)
+        if current and current_tokens + tokens > token_budget:
+            chunks.append((current.strip(), previous_joiner))
+            current, current_tokens = "", 0
+        current += unit + separator
+        current_tokens += tokens + estimate_tokens(separator, model)
+        previous_joiner = joiner
+    if current.strip():
+        chunks.append((current.strip(), ""))
+    return chunks
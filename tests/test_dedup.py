@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from desgen_dedup import apply_replacements, diff_segments, is_verbatim, jaccard, normalize_text, shingles
+
+
+class ApplyReplacementsTest(unittest.TestCase):
+    def test_ambiguous_verbatim_term_is_not_patched(self):
+        source = "このワイヤレスイヤホンは2個セットでお届けします。保証期間は2年間です。充電ケース付き。"
+        target = "このワイヤレスイヤホンは3個セットでお届けします。保証期間は2年間です。充電ケース付き。"
+        self.assertGreaterEqual(jaccard(shingles(normalize_text(source)), shingles(normalize_text(target))), 0.85)
+        segments = diff_segments(source, target)
+        self.assertEqual(segments, [("2", "3")])
+        translation = "These wireless earphones come as a set of 2 pieces. The warranty period is 2 years. Charging case included."
+        replacements = [(old, new, is_verbatim(old)) for old, new in segments]
+        self.assertIsNone(apply_replacements(translation, replacements))
+
+    def test_unique_term_is_patched(self):
+        translation = "A set of 2 pieces. The warranty period is one year."
+        self.assertEqual(
+            apply_replacements(translation, [("2", "3", True)]),
+            "A set of 3 pieces. The warranty period is one year."
+        )
+
+    def test_missing_term_returns_none(self):
+        self.assertIsNone(apply_replacements("A red shirt.", [("blue", "green", False)]))
+
+
+if __name__ == "__main__":
+    unittest.main()